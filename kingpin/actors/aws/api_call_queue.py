@@ -1,11 +1,14 @@
 import asyncio
 import functools
+import time
 from collections.abc import Callable
 from concurrent.futures import ThreadPoolExecutor
 
 from botocore import exceptions as botocore_exceptions
 
-EXECUTOR = ThreadPoolExecutor(10)
+from kingpin.actors import metrics, profiler
+
+EXECUTOR = ThreadPoolExecutor(10, thread_name_prefix="api-call-queue")
 
 
 class ApiCallQueue:
@@ -14,9 +17,13 @@ class ApiCallQueue:
     with exponential backoff when there is throttling.
 
     Invoke the `call` method to queue up a new API call.
+
+    Args:
+        name: Name of the queue, that its metrics are reported under.
     """
 
-    def __init__(self):
+    def __init__(self, name: str = "default"):
+        self.name = name
         self.executor = EXECUTOR
 
         self._queue = asyncio.Queue()
@@ -57,7 +64,19 @@ class ApiCallQueue:
         will bubble up immediately and won't be retried here.
         """
         result_queue = asyncio.Queue(maxsize=1)
-        await self._queue.put((result_queue, api_function, args, kwargs))
+        # The consumer runs in a task of its own, so tell it who the call is
+        # being made for.
+        await self._queue.put(
+            (
+                result_queue,
+                api_function,
+                args,
+                kwargs,
+                profiler.CURRENT.get(),
+                time.monotonic(),
+            )
+        )
+        self._report()
         result = await result_queue.get()
         if isinstance(result, Exception):
             raise result
@@ -74,11 +93,17 @@ class ApiCallQueue:
         This sleeps between API calls based on `delay`.
         """
         while True:
-            result_queue, api_function, args, kwargs = await self._queue.get()
-            try:
-                result = await self._call(api_function, *args, **kwargs)
-            except Exception as e:
-                result = e
+            result_queue, api_function, args, kwargs, stats, queued = (
+                await self._queue.get()
+            )
+            self._report()
+            with profiler.attribute(stats):
+                profiler.record_queue_wait(time.monotonic() - queued)
+                try:
+                    result = await self._call(api_function, *args, **kwargs)
+                except Exception as e:
+                    result = e
+            self._report()
             await result_queue.put(result)
             await asyncio.sleep(self.delay)
 
@@ -92,19 +117,37 @@ class ApiCallQueue:
         rate limiting exception, this will backoff and try again.
         """
         while True:
+            started = time.monotonic()
             try:
-                result = await self._thread(api_function, *args, **kwargs)
+                try:
+                    result = await self._thread(api_function, *args, **kwargs)
+                finally:
+                    profiler.record_api_call(
+                        profiler.operation_name(api_function),
+                        time.monotonic() - started,
+                    )
                 self._decrease_delay()
                 return result
             except botocore_exceptions.ClientError as e:
                 # Boto3 exception.
                 if e.response["Error"]["Code"] == "Throttling":
+                    profiler.record_throttle()
+                    metrics.METRICS.increment(
+                        "api_queue.throttles", labels={"queue": self.name}
+                    )
                     self._increase_delay()
-                    await asyncio.sleep(self.delay)
+                    self._report()
+                    await profiler.sleep(self.delay)
                 else:
                     self._decrease_delay()
                     raise e
 
+    def _report(self):
+        """Reports the depth and current delay of the queue."""
+        labels = {"queue": self.name}
+        metrics.METRICS.gauge("api_queue.depth", self._queue.qsize(), labels)
+        metrics.METRICS.gauge("api_queue.delay", self.delay, labels)
+
     def _decrease_delay(self):
         """Decrease `delay` by one step.
 
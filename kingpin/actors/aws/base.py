@@ -26,7 +26,8 @@ below for using each actor.
 
 import asyncio
 import logging
-from collections.abc import Callable
+import time
+from collections.abc import AsyncIterator, Callable
 from concurrent.futures import ThreadPoolExecutor
 
 import boto3
@@ -36,18 +37,66 @@ from botocore import exceptions as botocore_exceptions
 
 from kingpin import exceptions as kingpin_exceptions
 from kingpin import utils
-from kingpin.actors import base, exceptions
-from kingpin.actors.aws import api_call_queue
+from kingpin.actors import base, exceptions, metrics, profiler
+from kingpin.actors.aws import api_call_queue, governor
 from kingpin.actors.aws import settings as aws_settings
 
 log = logging.getLogger(__name__)
 
 __author__ = "Matt Wise <matt@nextdoor.com>"
 
-EXECUTOR = ThreadPoolExecutor(10)
+EXECUTOR = ThreadPoolExecutor(10, thread_name_prefix="aws")
 
 NAMED_API_CALL_QUEUES = {}
 
+SERVICE_GOVERNORS = {}
+
+
+class _PageFetcher:
+    """Hands out the pages of a boto3 paginator, one page per call.
+
+    Each call blocks on the API, so it's meant to be run in an executor (see
+    :py:meth:`AWSBaseActor.paginate`). The botocore page iterator is a
+    generator, and is finished for good once a request raises. If a failed
+    call is retried (ie, by an :py:class:`ApiCallQueue` after throttling), the
+    pages are started over, and those already handed out are skipped.
+
+    Args:
+        api_function: The boto3 client method to paginate.
+        kwargs: Parameters for the API call.
+    """
+
+    def __init__(self, api_function, kwargs):
+        # Named after the API call, for the profiler.
+        self.__name__ = api_function.__name__
+        self.__self__ = api_function.__self__
+        self._paginator = self.__self__.get_paginator(self.__name__)
+        self._kwargs = kwargs
+        self._pages = None
+        self._fetched = 0
+
+    def __call__(self):
+        if self._pages is None:
+            self._pages = iter(self._paginator.paginate(**self._kwargs))
+            for _ in range(self._fetched):
+                next(self._pages)
+
+        try:
+            page = next(self._pages, None)
+        except Exception:
+            self._pages = None
+            raise
+
+        if page is not None:
+            self._fetched += 1
+        return page
+
+
+def _can_paginate(api_function) -> bool:
+    client = getattr(api_function, "__self__", None)
+    can_paginate = getattr(client, "can_paginate", None)
+    return callable(can_paginate) and can_paginate(api_function.__name__)
+
 
 class InvalidPolicy(exceptions.RecoverableActorFailure):
     """Raised when Amazon indicates that policy JSON is invalid."""
@@ -63,6 +112,29 @@ class AWSBaseActor(base.BaseActor):
 
         super().__init__(*args, **kwargs)
 
+        # Establish connection objects that don't require a region
+        self.iam_conn = self._get_boto3_client("iam")
+
+        # Establish region-specific connection objects.
+        self.region = self.option("region")
+        if not self.region:
+            return
+
+        self.ecs_conn = self._get_boto3_client("ecs", self.region)
+        self.cfn_conn = self._get_boto3_client("cloudformation", self.region)
+        self.sqs_conn = self._get_boto3_client("sqs", self.region)
+        self.s3_conn = self._get_boto3_client("s3", self.region)
+
+    def _get_boto3_client(self, service_name: str, region: str | None = None):
+        """Returns a new boto3 client for the supplied service and region.
+
+        Actors that manage many resources at once can override this to share
+        clients between them.
+
+        Args:
+            service_name: The boto3 service name (ie, "cloudformation")
+            region: AWS region name, or None for global services.
+        """
         # By default, we will try to let Boto handle discovering its
         # credentials at instantiation time. This _can_ result in synchronous
         # API calls to the Metadata service, but those should be fast.
@@ -80,37 +152,20 @@ class AWSBaseActor(base.BaseActor):
         )
         boto3_client_kwargs["aws_session_token"] = aws_settings.AWS_SESSION_TOKEN
 
-        # Establish connection objects that don't require a region
-        self.iam_conn = boto3.client(
-            service_name="iam", config=None, **boto3_client_kwargs
-        )
-
-        # Establish region-specific connection objects.
-        self.region = self.option("region")
-        if not self.region:
-            return
-
         # Generate our common config options that will be passed into the boto3
         # client constructors...
-        boto_config = botocore_config.Config(
-            region_name=self.region,
-            retries={
-                "max_attempts": aws_settings.AWS_MAX_ATTEMPTS,
-                "mode": aws_settings.AWS_RETRY_MODE,
-            },
-        )
+        boto_config = None
+        if region:
+            boto_config = botocore_config.Config(
+                region_name=region,
+                retries={
+                    "max_attempts": aws_settings.AWS_MAX_ATTEMPTS,
+                    "mode": aws_settings.AWS_RETRY_MODE,
+                },
+            )
 
-        self.ecs_conn = boto3.client(
-            service_name="ecs", config=boto_config, **boto3_client_kwargs
-        )
-        self.cfn_conn = boto3.client(
-            service_name="cloudformation", config=boto_config, **boto3_client_kwargs
-        )
-        self.sqs_conn = boto3.client(
-            service_name="sqs", config=boto_config, **boto3_client_kwargs
-        )
-        self.s3_conn = boto3.client(
-            service_name="s3", config=boto_config, **boto3_client_kwargs
+        return boto3.client(
+            service_name=service_name, config=boto_config, **boto3_client_kwargs
         )
 
     async def api_call(
@@ -121,15 +176,29 @@ class AWSBaseActor(base.BaseActor):
         Wraps a synchronous boto3 call so it doesn't block the event loop.
         """
 
+        started = None
+
         @utils.exception_logger
         def _call():
+            nonlocal started
+            started = time.monotonic()
             return api_function(*args, **kwargs)
 
         loop = asyncio.get_event_loop()
+        submitted = time.monotonic()
         try:
-            return await loop.run_in_executor(self.executor, _call)
+            with metrics.executor_call(self.executor):
+                return await loop.run_in_executor(self.executor, _call)
         except boto3_exceptions.Boto3Error as e:
             raise self._wrap_boto_exception(e) from e
+        finally:
+            # Time spent waiting for a free thread, then making the call.
+            finished = time.monotonic()
+            if started is not None:
+                profiler.record_queue_wait(started - submitted)
+                profiler.record_api_call(
+                    profiler.operation_name(api_function), finished - started
+                )
 
     @utils.exception_logger
     async def api_call_with_queueing(
@@ -160,7 +229,7 @@ class AWSBaseActor(base.BaseActor):
             >>>     ec2_conn.get_all_zones, queue_name='get_all_zones')
         """
         if queue_name not in NAMED_API_CALL_QUEUES:
-            NAMED_API_CALL_QUEUES[queue_name] = api_call_queue.ApiCallQueue()
+            NAMED_API_CALL_QUEUES[queue_name] = api_call_queue.ApiCallQueue(queue_name)
         queue = NAMED_API_CALL_QUEUES[queue_name]
         try:
             result = await queue.call(api_function, *args, **kwargs)
@@ -169,6 +238,102 @@ class AWSBaseActor(base.BaseActor):
         else:
             return result
 
+    async def api_call_with_governor(
+        self,
+        api_function: Callable[..., object],
+        service: str,
+        *args: object,
+        entity: str | None = None,
+        **kwargs: object,
+    ) -> object:
+        """Execute `api_function` through the concurrency governor of a service.
+
+        Use this instead of :py:meth:`api_call` when fanning out many calls at
+        once. No more than `KINGPIN_AWS_SERVICE_CONCURRENCY` governed calls
+        to any one service are in flight at a time across all actors, and
+        waiting calls are served round-robin between entities.
+
+        Example:
+            >>> tasks = [self.api_call_with_governor(
+            >>>     self.iam_conn.get_role_policy, 'iam', entity=role,
+            >>>     RoleName=role, PolicyName=p) for p in names]
+
+        Args:
+            api_function: The boto3 client method to call.
+            service: The name of the service (ie, 'iam') the call is made to.
+            entity: The entity the call is made on behalf of.
+        """
+        if service not in SERVICE_GOVERNORS:
+            SERVICE_GOVERNORS[service] = governor.ServiceGovernor(
+                aws_settings.KINGPIN_AWS_SERVICE_CONCURRENCY
+            )
+        waiting = time.monotonic()
+        async with SERVICE_GOVERNORS[service].slot(entity):
+            profiler.record_queue_wait(time.monotonic() - waiting)
+            return await self.api_call(api_function, *args, **kwargs)
+
+    async def paginate(
+        self,
+        api_function: Callable[..., object],
+        queue_name: str | None = None,
+        **kwargs: object,
+    ) -> AsyncIterator[dict]:
+        """Yields every page of a paginated API call.
+
+        The pages come from boto3's own paginator for the call, and each one
+        is requested in the executor through :py:meth:`api_call` (or
+        :py:meth:`api_call_with_queueing` if a `queue_name` is supplied), so
+        pagination obeys the same executor, queues and rate limits as any
+        other call. While the caller is busy with one page the next one is
+        already being fetched, but never more than one page ahead.
+
+        API calls that boto3 can't paginate are made once, and yield a single
+        page.
+
+        Example:
+            >>> async for page in self.paginate(
+            >>>     self.iam_conn.list_user_policies, UserName='bob'):
+            >>>     names.extend(page['PolicyNames'])
+
+        Args:
+            api_function: The boto3 client method to call.
+            queue_name: Optional name of the serialized API call queue to use.
+            kwargs: Parameters for the API call.
+        """
+        if _can_paginate(api_function):
+            fetch_page, params = _PageFetcher(api_function, kwargs), {}
+        else:
+            fetch_page, params = api_function, kwargs
+
+        def _fetch():
+            if queue_name:
+                call = self.api_call_with_queueing(
+                    fetch_page, queue_name=queue_name, **params
+                )
+            else:
+                call = self.api_call(fetch_page, **params)
+            return asyncio.ensure_future(call)
+
+        pending = _fetch()
+        try:
+            while pending is not None:
+                page = await pending
+                pending = None
+                if page is None:
+                    break
+
+                if fetch_page is not api_function:
+                    pending = _fetch()
+
+                yield page
+        finally:
+            # The caller stopped early (or failed). Throw away the page we
+            # were prefetching, and make sure its result is never reported as
+            # an unretrieved exception.
+            if pending is not None:
+                pending.cancel()
+                pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+
     def _wrap_boto_exception(self, e):
         if isinstance(e, boto3_exceptions.Boto3Error):
             return exceptions.RecoverableActorFailure(f"Boto3 had a failure: {e}")
@@ -209,3 +374,137 @@ class AWSBaseActor(base.BaseActor):
 
 class EnsurableAWSBaseActor(AWSBaseActor, base.EnsurableBaseActor):
     """Ensurable version of the AWS Base Actor"""
+
+
+class FanOutMember:
+    """Mixin for the actors managed by a :py:class:`FanOutAWSBaseActor`.
+
+    Borrows the boto3 clients of the actor managing it, rather than creating
+    a set of its own.
+
+    Args:
+        owner: The FanOutAWSBaseActor managing this actor.
+    """
+
+    def __init__(self, owner, *args, **kwargs):
+        self._owner = owner
+        self._parent = owner
+        super().__init__(*args, **kwargs)
+
+    def _get_boto3_client(self, service_name, region=None):
+        return self._owner._get_boto3_client(service_name, region)
+
+
+class FanOutAWSBaseActor(AWSBaseActor):
+    """Base class for actors that manage many copies of another actor at once.
+
+    The managed actors (the "members", built with the :py:class:`FanOutMember`
+    mixin and handed to :py:meth:`_add_member`) share one boto3 client per
+    service and region, show up under this actor in the orgchart, and are
+    executed by :py:meth:`_execute_members` a bounded number at a time.
+    """
+
+    # Like the group actors, we have no timeout of our own. Each member has
+    # its own default timeout.
+    default_timeout = None
+
+    # What the members are called, in log messages and errors.
+    member_noun = "actors"
+
+    def __init__(self, *args, **kwargs):
+        self._clients = {}
+        self._members = []
+        super().__init__(*args, **kwargs)
+
+    def _get_boto3_client(self, service_name, region=None):
+        """Returns a boto3 client shared by all of our members."""
+        key = (service_name, region)
+        if key not in self._clients:
+            self._clients[key] = super()._get_boto3_client(service_name, region)
+        return self._clients[key]
+
+    def _add_member(self, member) -> None:
+        member._position = len(self._members)
+        self._members.append(member)
+
+    def journal_fingerprint(self):
+        """Returns what each of the members works from."""
+        return [member.journal_fingerprint() for member in self._members]
+
+    def get_orgchart(self, parent=""):
+        """Return orgchart including each of the members."""
+        ret = super().get_orgchart(parent=parent)
+        for member in self._members:
+            ret = ret + member.get_orgchart(parent=str(id(self)))
+        return ret
+
+    def get_actors(self):
+        """Return this actor and each of the members."""
+        ret = super().get_actors()
+        for member in self._members:
+            ret = ret + member.get_actors()
+        return ret
+
+    async def _execute_members(
+        self, concurrency: int, max_failures: int | None = None
+    ) -> None:
+        """Executes every member, no more than `concurrency` at a time.
+
+        Args:
+            concurrency: Maximum number of members to execute at once.
+            max_failures: Number of member failures to tolerate. Once more
+                than this many have failed, no further members are started
+                (except in dry mode, so that every problem is reported). If
+                None, every member is started, and any failure is fatal.
+
+        Raises:
+            RecoverableActorFailure: If too many members failed, or
+            UnrecoverableActorFailure if any of those failures was.
+        """
+        total = len(self._members)
+        noun = self.member_noun
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        counts = {"done": 0, "skipped": 0}
+        errors = []
+
+        async def _ensure(member):
+            async with semaphore:
+                stopping = max_failures is not None and len(errors) > max_failures
+                if stopping and not self._dry:
+                    counts["skipped"] += 1
+                    return
+
+                try:
+                    await member.execute()
+                except exceptions.ActorException as e:
+                    errors.append(e)
+
+                counts["done"] += 1
+                self.log.info(
+                    f"Progress: {counts['done']}/{total} {noun} finished, "
+                    f"{len(errors)} failed"
+                )
+
+        await asyncio.gather(*[_ensure(member) for member in self._members])
+
+        if counts["skipped"]:
+            self.log.error(
+                f"Too many failures, skipped {counts['skipped']} of {total} {noun}"
+            )
+
+        tolerated = max_failures or 0
+        if len(errors) > tolerated:
+            wrapper = exceptions.RecoverableActorFailure
+            for e in errors:
+                if isinstance(e, exceptions.UnrecoverableActorFailure):
+                    wrapper = exceptions.UnrecoverableActorFailure
+            msg = f"{len(errors)} of {total} {noun} failed"
+            if max_failures is not None:
+                msg += f" (max_failures={max_failures})"
+            raise wrapper(msg)
+
+        if errors:
+            self.log.warning(
+                f"{len(errors)} of {total} {noun} failed, within the tolerated "
+                f"max_failures={max_failures}"
+            )
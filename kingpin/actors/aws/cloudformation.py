@@ -8,6 +8,7 @@ import datetime
 import json
 import logging
 import re
+import time
 import uuid
 from concurrent.futures import ThreadPoolExecutor
 from hashlib import md5
@@ -17,11 +18,12 @@ import boto3
 from botocore.exceptions import ClientError
 
 from kingpin import utils
-from kingpin.actors import exceptions
+from kingpin.actors import exceptions, metrics, profiler
 from kingpin.actors.aws import base
 from kingpin.actors.aws.settings import (
     KINGPIN_CFN_DEFAULT_ROLE_ARN,
     KINGPIN_CFN_HASH_OUTPUT_KEY,
+    KINGPIN_CFN_VALIDATION_CACHE,
 )
 from kingpin.actors.utils import dry
 from kingpin.constants import REQUIRED, STATE, SchemaCompareBase, StringCompareBase
@@ -37,7 +39,21 @@ class DateEncoder(JSONEncoder):
             return obj.isoformat()
 
 
-EXECUTOR = ThreadPoolExecutor(10)
+EXECUTOR = ThreadPoolExecutor(10, thread_name_prefix="cloudformation")
+
+# Change Sets generated during the dry run are normally deleted right away.
+# When a real run follows in the same process (see kingpin.bin.deploy),
+# KEEP_DRY_CHANGE_SETS is enabled and they are instead recorded in
+# DRY_CHANGE_SETS, keyed by (stack id, template hash, parameters hash), so that
+# the real run can execute them directly rather than generating and waiting on
+# identical ones. Any that are left unused must be removed with
+# delete_dry_change_sets().
+KEEP_DRY_CHANGE_SETS = False
+DRY_CHANGE_SETS = {}
+
+# Hashes of the templates that have already passed validation with AWS in this
+# process (and, if KINGPIN_CFN_VALIDATION_CACHE is set, in previous runs).
+VALIDATED_TEMPLATES = set()
 
 
 S3_REGEX = re.compile(r"s3://(?P<bucket>[a-z0-9.-]+)/(?P<key>.*)")
@@ -163,6 +179,15 @@ class CloudFormationBaseActor(base.AWSBaseActor):
         "region": (str, REQUIRED, "AWS region (or zone) name, like us-west-2")
     }
 
+    # The contents of our template, for the actors that take one.
+    _template_body = None
+
+    def journal_fingerprint(self):
+        # The template can change without its path (or S3 URL) changing.
+        if self._template_body is None:
+            return None
+        return md5(self._template_body.encode()).hexdigest()
+
     def _discover_noecho_params(self, template_body):
         """Scans a CFN template for NoEcho parameters.
 
@@ -306,9 +331,16 @@ class CloudFormationBaseActor(base.AWSBaseActor):
         """
         return boto3.client("s3", region_name=region)
 
+    def _template_key(self, body=None, url=None) -> str:
+        """Returns a hash identifying a template for validation caching."""
+        return md5((body or url or "").encode()).hexdigest()
+
     async def _validate_template(self, body=None, url=None):
         """Validates the CloudFormation template.
 
+        Templates that have already been validated (for example by
+        :py:func:`preflight`) are not sent to AWS again.
+
         Args:
             body: The body of the template
             url: A URL pointing to a template
@@ -317,6 +349,10 @@ class CloudFormationBaseActor(base.AWSBaseActor):
             InvalidTemplate
             exceptions.InvalidCredentials
         """
+        key = self._template_key(body, url)
+        if key in VALIDATED_TEMPLATES:
+            self.log.debug("Template has already been validated")
+            return
 
         if url is not None:
             cfg = {"TemplateURL": url}
@@ -332,6 +368,10 @@ class CloudFormationBaseActor(base.AWSBaseActor):
                 await self.api_call(self.cfn_conn.validate_template, **cfg)
             except ClientError as e:
                 raise InvalidTemplate(e) from e
+        else:
+            return
+
+        VALIDATED_TEMPLATES.add(key)
 
     def _create_parameters(self, parameters):
         """Converts a simple Key/Value dict into Amazon CFN Parameters.
@@ -423,6 +463,7 @@ class CloudFormationBaseActor(base.AWSBaseActor):
             StackNotFound: If the stack doesn't exist.
         """
         while True:
+            metrics.poll(self)
             stack = await self._get_stack(stack_name)
 
             if not stack:
@@ -435,7 +476,7 @@ class CloudFormationBaseActor(base.AWSBaseActor):
                 self.log.info(
                     f"Stack state is {stack['StackStatus']}, waiting {sleep}(s)..."
                 )
-                await asyncio.sleep(sleep)
+                await profiler.sleep(sleep)
                 continue
 
             # If the stack is in the desired state, then return
@@ -577,6 +618,113 @@ class CloudFormationBaseActor(base.AWSBaseActor):
         return stack["StackId"]
 
 
+async def delete_dry_change_sets():
+    """Deletes any Change Sets kept by the dry run that were never executed."""
+    while DRY_CHANGE_SETS:
+        _, (actor, change_set_id) = DRY_CHANGE_SETS.popitem()
+        actor.log.debug(f"Deleting unused change set {change_set_id}")
+        try:
+            await actor.api_call(
+                actor.cfn_conn.delete_change_set, ChangeSetName=change_set_id
+            )
+        except ClientError as e:
+            actor.log.warning(f"Unable to delete change set {change_set_id}: {e}")
+
+
+def _load_validation_cache():
+    if not KINGPIN_CFN_VALIDATION_CACHE:
+        return
+
+    try:
+        with open(KINGPIN_CFN_VALIDATION_CACHE) as f:
+            VALIDATED_TEMPLATES.update(json.load(f))
+    except (OSError, ValueError) as e:
+        log.debug(f"Unable to read {KINGPIN_CFN_VALIDATION_CACHE}: {e}")
+
+
+def _save_validation_cache():
+    if not KINGPIN_CFN_VALIDATION_CACHE:
+        return
+
+    try:
+        with open(KINGPIN_CFN_VALIDATION_CACHE, "w") as f:
+            json.dump(sorted(VALIDATED_TEMPLATES), f)
+    except OSError as e:
+        log.warning(f"Unable to write {KINGPIN_CFN_VALIDATION_CACHE}: {e}")
+
+
+async def preflight(actors):
+    """Validates the templates of all supplied CloudFormation actors.
+
+    Meant to be run once the whole actor tree has been built, but before any
+    of it is executed, so that a broken template deep inside a long script is
+    reported right away. Templates are de-duplicated by hash, and all of the
+    unique ones are validated concurrently (paced by the `validate_template`
+    API call queue). Templates that passed validation are remembered for the
+    rest of the process, and across runs if `KINGPIN_CFN_VALIDATION_CACHE`
+    points to a file.
+
+    Args:
+        actors: A list of actor objects. Non-CloudFormation actors are ignored.
+
+    Raises:
+        InvalidTemplate: If any of the templates failed validation.
+    """
+    _load_validation_cache()
+
+    # Group the actors by template, so that each unique template is only
+    # validated once -- but every actor using a bad template is reported.
+    templates = {}
+    for actor in actors:
+        if not isinstance(actor, CloudFormationBaseActor):
+            continue
+        body = getattr(actor, "_template_body", None)
+        url = getattr(actor, "_template_url", None)
+        if body is None and url is None:
+            continue
+        key = actor._template_key(body, url)
+        if key not in VALIDATED_TEMPLATES:
+            templates.setdefault(key, []).append(actor)
+
+    log.info(f"Preflight: validating {len(templates)} CloudFormation template(s)")
+
+    async def _validate(actor):
+        cfg = {"TemplateURL": actor._template_url}
+        if not actor._template_url:
+            cfg = {"TemplateBody": actor._template_body}
+        try:
+            await actor.api_call_with_queueing(
+                actor.cfn_conn.validate_template,
+                queue_name="validate_template",
+                **cfg,
+            )
+        except ClientError as e:
+            raise InvalidTemplate(e) from e
+
+    keys = list(templates.keys())
+    results = await asyncio.gather(
+        *[_validate(templates[key][0]) for key in keys], return_exceptions=True
+    )
+
+    failures = 0
+    for key, result in zip(keys, results, strict=True):
+        if isinstance(result, InvalidTemplate):
+            failures += len(templates[key])
+            for actor in templates[key]:
+                actor.log.critical(f"Template failed validation: {result}")
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            VALIDATED_TEMPLATES.add(key)
+
+    _save_validation_cache()
+
+    if failures:
+        raise InvalidTemplate(
+            f"Preflight found {failures} actor(s) with invalid templates"
+        )
+
+
 class Create(CloudFormationBaseActor):
     """Creates a CloudFormation stack.
 
@@ -873,6 +1021,11 @@ class Stack(CloudFormationBaseActor):
 
     Validates the template, verifies that an existing stack with that name does
     not exist. Does not create the stack.
+
+    If the stack needs an update, the Change Set generated during the dry run
+    is handed over to the real run that follows it, which executes it directly
+    as long as the stack, template and parameters have not changed in the
+    meantime.
     """
 
     all_options = {
@@ -996,21 +1149,28 @@ class Stack(CloudFormationBaseActor):
         """
         needs_update = False
 
-        # Get the current template for the stack, and get our local template
-        # body. Make sure they're in the same form (dict).
-        existing = await self._get_stack_template(stack["StackId"])
-        new = json.loads(self._template_body)
-
-        # Compare the two templates. If they differ at all, log it out for the
-        # user and flip the needs_update bit.
-        diff = utils.diff_dicts(existing, new)
-        if diff:
-            self.log.warning("Stack templates do not match.")
-            for line in diff.split("\n"):
-                self.log.info(f"Diff: {line}")
-
-            # Plan to make a change set!
-            needs_update = True
+        # If the live stack carries the hash output that we embedded the last
+        # time we updated it, and that hash matches our local template, then
+        # the templates are identical and we can skip downloading and diffing
+        # the live template entirely.
+        if self._template_hash_matches(stack):
+            self.log.debug("Stack template hash matches, skipping template diff")
+        else:
+            # Get the current template for the stack, and get our local
+            # template body. Make sure they're in the same form (dict).
+            existing = await self._get_stack_template(stack["StackId"])
+            new = json.loads(self._template_body)
+
+            # Compare the two templates. If they differ at all, log it out for
+            # the user and flip the needs_update bit.
+            diff = utils.diff_dicts(existing, new)
+            if diff:
+                self.log.warning("Stack templates do not match.")
+                for line in diff.split("\n"):
+                    self.log.info(f"Diff: {line}")
+
+                # Plan to make a change set!
+                needs_update = True
 
         # Get and compare the parameters we have vs the ones in CFN. If they're
         # different, plan to do an update!
@@ -1023,30 +1183,105 @@ class Stack(CloudFormationBaseActor):
             self.log.debug("Stack matches configuration, no changes necessary")
             return
 
-        # If we're here, the templates have diverged. Generate the change set,
-        # log out the changes, and execute them.
-        change_set_req = await self._create_change_set(stack)
-        change_set = await self._wait_until_change_set_ready(
-            change_set_req["Id"], "Status", "CREATE_COMPLETE"
-        )
+        # If we're here, the templates have diverged. If the dry run already
+        # generated an identical change set, use that one. Otherwise generate
+        # the change set, log out the changes, and execute them.
+        change_set_key = self._change_set_key(stack)
+        change_set = await self._get_dry_change_set(change_set_key)
+        if change_set:
+            change_set_id = change_set["ChangeSetId"]
+        else:
+            change_set_req = await self._create_change_set(stack)
+            change_set_id = change_set_req["Id"]
+            change_set = await self._wait_until_change_set_ready(
+                change_set_id, "Status", "CREATE_COMPLETE"
+            )
         self._print_change_set(change_set)
 
         # Ok run the change set itself!
         try:
-            await self._execute_change_set(change_set_name=change_set_req["Id"])
+            await self._execute_change_set(change_set_name=change_set_id)
         except (ClientError, StackFailed) as e:
             raise StackFailed(e) from e
 
-        # In dry mode, delete our change set so we don't leave it around as
-        # cruft. THis isn't necessary in the real run, because the changeset
-        # cannot be deleted once its been applied.
-        if self._dry:
+        # In dry mode, either hand our change set over to the real run, or
+        # delete it so we don't leave it around as cruft. THis isn't necessary
+        # in the real run, because the changeset cannot be deleted once its
+        # been applied.
+        if self._dry and KEEP_DRY_CHANGE_SETS:
+            self.log.debug(f"Keeping change set {change_set_id} for the real run")
+            DRY_CHANGE_SETS[change_set_key] = (self, change_set_id)
+        elif self._dry:
             await self.api_call(
-                self.cfn_conn.delete_change_set, ChangeSetName=change_set_req["Id"]
+                self.cfn_conn.delete_change_set, ChangeSetName=change_set_id
             )
 
         self.log.info("Done updating template")
 
+    def _change_set_key(self, stack: dict) -> tuple[str, str, str]:
+        """Returns the key used to match up dry run and real run Change Sets.
+
+        Args:
+            stack: Boto3 Stack dict
+
+        Returns:
+            A (stack id, template hash, parameters hash) tuple
+        """
+        opts = {
+            "Parameters": self._parameters,
+            "Capabilities": self.option("capabilities"),
+            "RoleARN": self.option("role_arn") or KINGPIN_CFN_DEFAULT_ROLE_ARN,
+            "TemplateURL": self._template_url,
+        }
+        opts_hash = md5(json.dumps(opts, sort_keys=True).encode()).hexdigest()
+        return (stack["StackId"], self._template_hash(), opts_hash)
+
+    async def _get_dry_change_set(self, key):
+        """Returns a Change Set left behind by the dry run, if it is usable.
+
+        The Change Set must have been created for the same stack, template and
+        parameters (see :py:meth:`_change_set_key`), and must still be
+        executable. CloudFormation marks a Change Set `OBSOLETE` if the stack
+        has been updated since it was created, in which case it is deleted and
+        None is returned.
+
+        Args:
+            key: A key generated by :py:meth:`_change_set_key`
+
+        Returns:
+            A Change Set dict, or None
+        """
+        if self._dry or key not in DRY_CHANGE_SETS:
+            return None
+
+        _, change_set_id = DRY_CHANGE_SETS.pop(key)
+        try:
+            change_set = await self.api_call(
+                self.cfn_conn.describe_change_set, ChangeSetName=change_set_id
+            )
+        except ClientError as e:
+            self.log.warning(f"Unable to reuse change set {change_set_id}: {e}")
+            return None
+
+        if (
+            change_set["Status"] == "CREATE_COMPLETE"
+            and change_set["ExecutionStatus"] == "AVAILABLE"
+        ):
+            self.log.info(f"Reusing change set {change_set_id} from the dry run")
+            return change_set
+
+        self.log.warning(
+            f"Change set {change_set_id} from the dry run is "
+            f"{change_set['ExecutionStatus']}, generating a new one"
+        )
+        try:
+            await self.api_call(
+                self.cfn_conn.delete_change_set, ChangeSetName=change_set_id
+            )
+        except ClientError as e:
+            self.log.warning(f"Unable to delete change set {change_set_id}: {e}")
+        return None
+
     def _diff_params_safely(self, remote, local):
         """Safely diffs the CloudFormation parameters.
 
@@ -1098,6 +1333,58 @@ class Stack(CloudFormationBaseActor):
 
         return False
 
+    def _template_hash(self, template_obj: dict | None = None) -> str:
+        """Returns the hash of our local template body.
+
+        This is the value that gets embedded into the stack Outputs by
+        :py:meth:`_template_body_with_hash`, so it can later be compared
+        against the value reported by `describe_stacks`.
+
+        Args:
+            template_obj: (dict) Pre-parsed copy of our template body. If not
+                supplied, self._template_body is parsed.
+
+        Returns:
+            A hex digest string
+        """
+        if template_obj is None:
+            template_obj = json.loads(self._template_body)
+
+        if not isinstance(template_obj.get("Outputs", None), dict):
+            # overwrite the outputs with an empty dict
+            template_obj["Outputs"] = {}
+
+        return md5(json.dumps(template_obj).encode()).hexdigest()
+
+    def journal_fingerprint(self):
+        # Shared by all of the stacks of a StackSet, so only hashed once.
+        return self._template_hash()
+
+    def _template_hash_matches(self, stack: dict) -> bool:
+        """Compares the live stack hash output with our local template hash.
+
+        Stacks that were last updated by Kingpin carry a
+        `KINGPIN_CFN_HASH_OUTPUT_KEY` output holding the hash of the template
+        that was applied. If that output is missing (the feature is disabled,
+        the stack was created outside of a change set, etc), this returns False
+        and the caller must fall back to a full template diff.
+
+        Args:
+            stack: Boto3 Stack dict
+
+        Returns:
+            Boolean
+        """
+        # Bail if the user has disabled this feature.
+        if not KINGPIN_CFN_HASH_OUTPUT_KEY:
+            return False
+
+        for output in stack.get("Outputs", []):
+            if output.get("OutputKey") == KINGPIN_CFN_HASH_OUTPUT_KEY:
+                return output.get("OutputValue") == self._template_hash()
+
+        return False
+
     def _template_body_with_hash(self) -> str:
         """Add a hash to the template to force a change in the stack."""
 
@@ -1106,14 +1393,9 @@ class Stack(CloudFormationBaseActor):
             return self._template_body
 
         template_obj = json.loads(self._template_body)
+        template_hash = self._template_hash(template_obj)
 
-        if not isinstance(template_obj.get("Outputs", None), dict):
-            # overwrite the outputs with an empty dict
-            template_obj["Outputs"] = {}
-
-        template_obj["Outputs"][KINGPIN_CFN_HASH_OUTPUT_KEY] = {
-            "Value": md5(json.dumps(template_obj).encode()).hexdigest()
-        }
+        template_obj["Outputs"][KINGPIN_CFN_HASH_OUTPUT_KEY] = {"Value": template_hash}
 
         return json.dumps(template_obj)
 
@@ -1180,6 +1462,7 @@ class Stack(CloudFormationBaseActor):
         """
         self.log.info(f"Waiting for {change_set_name} to reach {desired_state}")
         while True:
+            metrics.poll(self)
             try:
                 change = await self.api_call(
                     self.cfn_conn.describe_change_set, ChangeSetName=change_set_name
@@ -1188,7 +1471,7 @@ class Stack(CloudFormationBaseActor):
                 # If we hit an intermittent error, lets just loop around and try
                 # again.
                 self.log.error(f"Error receiving Change Set state: {e}")
-                await asyncio.sleep(sleep)
+                await profiler.sleep(sleep)
                 continue
 
             # The Stack State can be 'AVAILABLE', or an IN_PROGRESS string. In
@@ -1197,7 +1480,7 @@ class Stack(CloudFormationBaseActor):
                 self.log.info(
                     f"Change Set state is {change[status_key]}, waiting {sleep}(s)..."
                 )
-                await asyncio.sleep(sleep)
+                await profiler.sleep(sleep)
                 continue
 
             # If the stack is in the desired state, then return
@@ -1346,3 +1629,326 @@ class Stack(CloudFormationBaseActor):
         # This main method triggers the creation, deletion or update of the
         # stack as necessary.
         await self._ensure_stack()
+
+
+class StackSetConfig(SchemaCompareBase):
+    """Validates the Stacks option of the StackSet actor.
+
+    A valid `stacks` option is a list of dictionaries, each with a `name` and
+    optionally a `region` and a dictionary of `parameters`.
+    """
+
+    SCHEMA = {
+        "type": "array",
+        "minItems": 1,
+        "items": {
+            "type": "object",
+            "required": ["name"],
+            "additionalProperties": False,
+            "properties": {
+                "name": {"type": "string"},
+                "region": {"type": "string"},
+                "parameters": ParametersConfig.SCHEMA,
+            },
+        },
+    }
+
+
+class _StackStatusPoller:
+    """Serves `describe_stacks` lookups for many stacks from shared snapshots.
+
+    Rather than having every stack of a :py:class:`StackSet` poll
+    `describe_stacks` on its own, the stacks of the StackSet in a region are
+    looked up together, and that snapshot is shared by every caller that is
+    happy with data no older than it. Concurrent callers wait on a single
+    refresh rather than each triggering their own.
+
+    A handful of stacks in a region are each described by name. Past
+    `list_threshold` stacks, it's cheaper to list every stack in the region
+    (a page of up to 100 at a time) and keep only ours.
+
+    Args:
+        names: Dictionary of the stack names, by region.
+    """
+
+    # Maximum age (in seconds) of a snapshot used to answer a lookup.
+    max_age = 5
+
+    # Regions with more of our stacks than this are listed, not described.
+    list_threshold = 10
+
+    def __init__(self, names):
+        self._names = names
+        self._snapshots = {}
+        self._locks = {}
+
+    async def get_stack(self, actor, stack, newer_than=0):
+        """Returns the stack (by name or id) from the region snapshot.
+
+        Args:
+            actor: The _StackSetMember asking, used for its region and
+                client.
+            stack: Stack name or stack ID
+            newer_than: time.monotonic() value that the snapshot must have
+                been taken after.
+
+        Returns:
+            <Stack Dict> or <None> if it is not in the snapshot. Deleted stacks
+            are never in it.
+        """
+        newer_than = max(newer_than, time.monotonic() - self.max_age)
+        lock = self._locks.setdefault(actor.region, asyncio.Lock())
+        async with lock:
+            taken, stacks = self._snapshots.get(actor.region, (None, None))
+            if taken is None or taken < newer_than:
+                taken = time.monotonic()
+                stacks = await self._describe_stacks(actor)
+                self._snapshots[actor.region] = (taken, stacks)
+
+        return stacks.get(stack)
+
+    async def _describe_stacks(self, actor):
+        names = self._names.get(actor.region, set())
+        if len(names) <= self.list_threshold:
+            found = await asyncio.gather(
+                *[actor._describe_stack(name) for name in sorted(names)]
+            )
+        else:
+            found = []
+            pages = actor.paginate(
+                actor.cfn_conn.describe_stacks, queue_name="describe_stacks"
+            )
+            try:
+                async for ret in pages:
+                    found.extend(s for s in ret["Stacks"] if s["StackName"] in names)
+            except ClientError as e:
+                raise CloudFormationError(e) from e
+
+        stacks = {}
+        for s in found:
+            if s is not None:
+                stacks[s["StackName"]] = s
+                stacks[s["StackId"]] = s
+        return stacks
+
+
+class _StackSetMember(base.FanOutMember, Stack):
+    """A single stack managed by a :py:class:`StackSet`.
+
+    Behaves exactly like a :py:class:`Stack`, but borrows the parsed template,
+    the boto3 clients and the status poller from its StackSet.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._fresh_after = 0
+        super().__init__(*args, **kwargs)
+
+    def _get_template_body(self, template, s3_region):
+        return self._owner._template_body, self._owner._template_url
+
+    def _discover_default_params(self, template_body):
+        return self._owner._default_params
+
+    def _discover_noecho_params(self, template_body):
+        return self._owner._noecho_params
+
+    def _template_hash(self, template_obj=None):
+        if template_obj is not None:
+            return super()._template_hash(template_obj)
+
+        if self._owner._shared_template_hash is None:
+            self._owner._shared_template_hash = super()._template_hash()
+        return self._owner._shared_template_hash
+
+    async def _get_stack(self, stack):
+        ret = await self._owner._poller.get_stack(self, stack, self._fresh_after)
+        if ret is None:
+            # Not in the snapshot: either a brand new stack, or a deleted one
+            # (which can only be found by its stack id).
+            ret = await self._describe_stack(stack)
+        return ret
+
+    async def _describe_stack(self, stack):
+        """Looks a stack up on its own, rather than in the shared snapshot."""
+        return await super()._get_stack(stack)
+
+    async def _wait_until_state(self, stack_name, desired_states, sleep=15):
+        # Called right after the stack was mutated, so any snapshot taken
+        # before this point is out of date for this stack.
+        self._fresh_after = time.monotonic()
+        return await super()._wait_until_state(stack_name, desired_states, sleep)
+
+
+class StackSet(base.FanOutAWSBaseActor, CloudFormationBaseActor):
+    """Manages the state of many copies of one CloudFormation stack.
+
+    Takes a single template and a list of stacks (each with a name, and
+    optionally a region and its own parameters) and ensures each of them
+    exactly like :py:class:`Stack` would. This is a purely local construct;
+    it does not use the Amazon CloudFormation StackSets service.
+
+    Compared to a `group.Async` of individual `Stack` actors, the template is
+    read, parsed, hashed and validated only once, the boto3 clients are
+    shared per region, and the stack states are polled together, once per
+    region, rather than by every stack on its own.
+
+    **Options**
+
+    :stacks:
+        (:py:class:`StackSetConfig`)
+
+        A list of stacks, each a dictionary with a `name`, and optionally a
+        `region` (defaults to the `region` option) and `parameters` (merged
+        over the shared `parameters` option).
+
+    :concurrency:
+        (int) Maximum number of stacks to create/update/delete at once.
+        Default: 10
+
+    :max_failures:
+        (int) Number of stacks that are allowed to fail before no further
+        stacks are started. The actor fails if more than this many stacks
+        failed. Stacks that are already in flight are always allowed to
+        finish. Default: 0
+
+    :region:
+        AWS region (or zone) string used for stacks that do not supply their
+        own, and for finding the template bucket.
+
+    :state:, :capabilities:, :disable_rollback:, :on_failure:, :parameters:,
+    :role_arn:, :template:, :template_s3_region:, :timeout_in_minutes:,
+    :enable_termination_protection:
+
+        Shared by every stack; see :py:class:`Stack`.
+
+    **Examples**
+
+    .. code-block:: json
+
+        {
+            "actor": "aws.cloudformation.StackSet",
+            "desc": "Regional edge stacks",
+            "options": {
+                "capabilities": [ "CAPABILITY_IAM" ],
+                "concurrency": 20,
+                "max_failures": 2,
+                "parameters": { "Environment": "production" },
+                "region": "us-east-1",
+                "stacks": [
+                    { "name": "edge-use1" },
+                    { "name": "edge-usw2", "region": "us-west-2" },
+                    {
+                        "name": "edge-euw1",
+                        "region": "eu-west-1",
+                        "parameters": { "Environment": "production-eu" }
+                    }
+                ],
+                "template": "/examples/cloudformation_test.json"
+            }
+        }
+
+    **Dry Mode**
+
+    Every stack is checked as described for :py:class:`Stack`. The failure
+    tolerance is not enforced, so that every failing stack is reported.
+    """
+
+    member_noun = "stacks"
+
+    all_options = {
+        "stacks": (StackSetConfig, REQUIRED, "List of stacks to manage"),
+        "concurrency": (int, 10, "Max number of stacks to work on at once"),
+        "max_failures": (int, 0, "Number of stack failures to tolerate"),
+        "state": (STATE, "present", "Desired state of the stacks: present/absent"),
+        "capabilities": Stack.all_options["capabilities"],
+        "disable_rollback": Stack.all_options["disable_rollback"],
+        "on_failure": Stack.all_options["on_failure"],
+        "parameters": (
+            ParametersConfig,
+            {},
+            "Parameters passed into the CFN template execution of every stack",
+        ),
+        "region": (str, REQUIRED, "Default AWS region (or zone) for the stacks"),
+        "role_arn": Stack.all_options["role_arn"],
+        "template": Stack.all_options["template"],
+        "template_s3_region": Stack.all_options["template_s3_region"],
+        "timeout_in_minutes": Stack.all_options["timeout_in_minutes"],
+        "enable_termination_protection": Stack.all_options[
+            "enable_termination_protection"
+        ],
+    }
+
+    desc = "CloudFormation StackSet {template}"
+
+    # Options passed through to every stack as-is.
+    shared_options = (
+        "state",
+        "capabilities",
+        "disable_rollback",
+        "on_failure",
+        "role_arn",
+        "template",
+        "template_s3_region",
+        "timeout_in_minutes",
+        "enable_termination_protection",
+    )
+
+    def __init__(self, *args, **kwargs):
+        """Read the template and build each of the stacks."""
+        super().__init__(*args, **kwargs)
+
+        # Two copies of one stack would create/update it at the same time, and
+        # share one entry of the region's snapshot.
+        names = {}
+        for config in self.option("stacks"):
+            region = config.get("region", self.option("region"))
+            if config["name"] in names.setdefault(region, set()):
+                raise exceptions.InvalidOptions(
+                    f"Stack {config['name']} is listed more than once in {region}"
+                )
+            names[region].add(config["name"])
+
+        self._template_body, self._template_url = self._get_template_body(
+            self.option("template"),
+            self.option("template_s3_region"),
+        )
+        self._default_params = self._discover_default_params(self._template_body)
+        self._noecho_params = self._discover_noecho_params(self._template_body)
+        self._shared_template_hash = None
+
+        self._poller = _StackStatusPoller(names)
+        self._build_stacks()
+
+    def _build_stacks(self):
+        shared = {name: self.option(name) for name in self.shared_options}
+        shared_params = self.option("parameters") or {}
+
+        for config in self.option("stacks"):
+            region = config.get("region", self.option("region"))
+            options = dict(
+                shared,
+                name=config["name"],
+                region=region,
+                parameters=dict(shared_params, **config.get("parameters", {})),
+            )
+            self._add_member(
+                _StackSetMember(
+                    self,
+                    desc=f"CloudFormation Stack {config['name']} ({region})",
+                    options=options,
+                    dry=self._dry,
+                )
+            )
+
+    async def _execute(self):
+        # All of the stacks share one template, so validating it once covers
+        # every one of them.
+        await self._validate_template(self._template_body, self._template_url)
+
+        concurrency = self.option("concurrency")
+        max_failures = self.option("max_failures")
+        self.log.info(
+            f"Ensuring {len(self._members)} stacks (concurrency={concurrency}, "
+            f"max_failures={max_failures})"
+        )
+        await self._execute_members(concurrency, max_failures)
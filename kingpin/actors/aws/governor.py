@@ -0,0 +1,95 @@
+"""
+:mod:`kingpin.actors.aws.governor`
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+Limits on how many API calls are in flight to each AWS service at once.
+"""
+
+import asyncio
+import collections
+import contextlib
+
+
+class ServiceGovernor:
+    """
+    Bounds the number of concurrent API calls made to a single AWS service.
+
+    A single governor is shared by every actor talking to a service, so the
+    limit holds no matter how many actors (ie, inside a `group.Async`) are
+    fanning out at once.
+
+    Callers are grouped by an `entity` key (ie, the IAM Role name). When more
+    calls are waiting than there are free slots, the slots are handed out
+    round-robin between the waiting entities rather than in arrival order, so
+    an entity that queued up hundreds of calls can't starve the others.
+
+    A `limit` of 0 disables the governor entirely.
+
+    Example:
+        >>> async with governor.slot('my-role'):
+        >>>     await actor.api_call(...)
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+
+        # Waiting futures, keyed by entity. The order of the keys is the
+        # round-robin order in which the entities are served.
+        self._waiters = collections.OrderedDict()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, entity: str | None = None):
+        """Holds one of the governor's slots for the duration of the block.
+
+        Args:
+            entity: The entity the call is made on behalf of.
+        """
+        if not self.limit:
+            yield
+            return
+
+        await self._acquire(entity)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, entity):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(entity, collections.deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We were handed a slot just as we got cancelled. Pass it on.
+                self._release()
+            else:
+                self._discard(entity, future)
+            raise
+
+    def _release(self):
+        self.active -= 1
+        while self._waiters and self.active < self.limit:
+            entity, waiters = self._waiters.popitem(last=False)
+            future = waiters.popleft()
+            if waiters:
+                # Send this entity to the back of the line.
+                self._waiters[entity] = waiters
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    def _discard(self, entity, future):
+        waiters = self._waiters.get(entity)
+        if waiters is None:
+            return
+        with contextlib.suppress(ValueError):
+            waiters.remove(future)
+        if not waiters:
+            del self._waiters[entity]
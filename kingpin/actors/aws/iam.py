@@ -4,15 +4,19 @@
 """
 
 import asyncio
+import hashlib
 import json
 import logging
 import os
+import re
+import urllib.parse
 
 from botocore.exceptions import ClientError
 
 from kingpin import utils
 from kingpin.actors import exceptions
 from kingpin.actors.aws import base
+from kingpin.actors.aws.settings import KINGPIN_IAM_SNAPSHOT_THRESHOLD
 from kingpin.constants import REQUIRED, STATE
 
 log = logging.getLogger(__name__)
@@ -25,6 +29,343 @@ __author__ = "Matt Wise <matt@nextdoor.com>"
 # make.
 MAX_ITEMS = 1000
 
+# The list keys in the detail dicts of each entity type returned by
+# get_account_authorization_details.
+SNAPSHOT_LIST_KEYS = {
+    "User": ("UserPolicyList", "GroupList", "AttachedManagedPolicies", "Tags"),
+    "Group": ("GroupPolicyList", "AttachedManagedPolicies"),
+    "Role": (
+        "RolePolicyList",
+        "AttachedManagedPolicies",
+        "InstanceProfileList",
+        "Tags",
+    ),
+}
+
+
+class _IAMSnapshot:
+    """A shared copy of the Users, Groups and Roles in the account.
+
+    Looking up an entity, its inline policies and (for users) its groups
+    takes several IAM calls per actor. Once enough IAM actors have been built
+    in this process (see `KINGPIN_IAM_SNAPSHOT_THRESHOLD`), all of that is
+    instead read once for the whole account through the paginated
+    `get_account_authorization_details` call, and shared by every actor.
+    Changes made by Kingpin itself are applied to the snapshot in place, and
+    the whole snapshot can be dropped with :py:meth:`forget` (for example
+    between a rehearsal and the real run) so that it's read again.
+
+    Entities are stored by type ("User", "Group" or "Role") and name, as the
+    detail dicts returned by Amazon.
+    """
+
+    def __init__(self):
+        # The (type, name) of the Users, Groups and Roles managed by actors
+        # in this process.
+        self.managed = set()
+
+        self._entities = None
+        self._loading = None
+
+    def enabled(self) -> bool:
+        if not KINGPIN_IAM_SNAPSHOT_THRESHOLD:
+            return False
+        return len(self.managed) >= KINGPIN_IAM_SNAPSHOT_THRESHOLD
+
+    def forget(self) -> None:
+        """Drops the snapshot, so that it's read again when next needed."""
+        self._entities = None
+
+    async def get_entity(self, actor, entity_type: str, name: str) -> dict | None:
+        """Returns the detail dict of an entity, or None if it doesn't exist.
+
+        Args:
+            actor: The IAM actor asking, used for its client.
+            entity_type: "User", "Group" or "Role"
+            name: The entity name
+        """
+        if self._entities is None:
+            # Concurrent callers all wait on the same download.
+            loading = self._loading
+            if loading is None:
+                loading = self._loading = asyncio.ensure_future(self._load(actor))
+            try:
+                await asyncio.shield(loading)
+            finally:
+                if self._loading is loading and loading.done():
+                    self._loading = None
+
+        return self._entities[entity_type].get(name)
+
+    def get_policies(self, entity_type: str, entity: dict | None) -> dict:
+        """Returns the inline policies of an entity as a name/document dict."""
+        if entity is None:
+            return {}
+        return {
+            p["PolicyName"]: p["PolicyDocument"]
+            for p in entity.get(f"{entity_type}PolicyList", [])
+        }
+
+    def _get(self, entity_type, name):
+        if self._entities is None or entity_type is None:
+            return None
+        return self._entities[entity_type].get(name)
+
+    def add_entity(self, entity_type: str, name: str, entity: dict) -> None:
+        if self._entities is not None and entity_type is not None:
+            # The create_* calls don't return the lists that
+            # get_account_authorization_details does, and a new entity has
+            # nothing in them yet.
+            lists = {key: [] for key in SNAPSHOT_LIST_KEYS[entity_type]}
+            self._entities[entity_type][name] = dict(entity, **lists)
+
+    def delete_entity(self, entity_type: str, name: str) -> None:
+        if self._entities is not None and entity_type is not None:
+            self._entities[entity_type].pop(name, None)
+
+    def put_policy(self, entity_type, name, policy_name, policy_doc) -> None:
+        entity = self._get(entity_type, name)
+        if entity is not None:
+            self.delete_policy(entity_type, name, policy_name)
+            entity.setdefault(f"{entity_type}PolicyList", []).append(
+                {"PolicyName": policy_name, "PolicyDocument": policy_doc}
+            )
+
+    def delete_policy(self, entity_type, name, policy_name) -> None:
+        entity = self._get(entity_type, name)
+        if entity is not None:
+            key = f"{entity_type}PolicyList"
+            entity[key] = [
+                p for p in entity.get(key, []) if p["PolicyName"] != policy_name
+            ]
+
+    def set_assume_role_policy(self, name, policy_doc) -> None:
+        entity = self._get("Role", name)
+        if entity is not None:
+            entity["AssumeRolePolicyDocument"] = policy_doc
+
+    def add_user_to_group(self, name, group) -> None:
+        entity = self._get("User", name)
+        if entity is not None and group not in entity.get("GroupList", []):
+            entity.setdefault("GroupList", []).append(group)
+
+    def remove_user_from_group(self, name, group) -> None:
+        entity = self._get("User", name)
+        if entity is not None and group in entity.get("GroupList", []):
+            entity["GroupList"].remove(group)
+
+    def _decode(self, doc):
+        # Boto3 normally decodes the policy documents for us, but make sure.
+        if isinstance(doc, str):
+            doc = json.loads(urllib.parse.unquote(doc))
+        return doc
+
+    async def _load(self, actor):
+        entities = {"User": {}, "Group": {}, "Role": {}}
+        params = {"Filter": list(entities.keys()), "MaxItems": MAX_ITEMS}
+        pages = actor.paginate(
+            actor.iam_conn.get_account_authorization_details, **params
+        )
+        try:
+            async for ret in pages:
+                for entity_type, store in entities.items():
+                    for entity in ret.get(f"{entity_type}DetailList", []):
+                        for policy in entity.get(f"{entity_type}PolicyList", []):
+                            policy["PolicyDocument"] = self._decode(
+                                policy["PolicyDocument"]
+                            )
+                        if "AssumeRolePolicyDocument" in entity:
+                            entity["AssumeRolePolicyDocument"] = self._decode(
+                                entity["AssumeRolePolicyDocument"]
+                            )
+                        store[entity[f"{entity_type}Name"]] = entity
+        except ClientError as e:
+            raise exceptions.RecoverableActorFailure(
+                f"An unexpected API error occurred: {e}"
+            ) from e
+
+        log.debug(
+            "Loaded an IAM snapshot of "
+            + ", ".join(f"{len(v)} {k}s" for k, v in entities.items())
+        )
+        self._entities = entities
+
+
+IAM_SNAPSHOT = _IAMSnapshot()
+
+
+# Statement keys whose value may be a single string or a list of strings,
+# with the order of the list being meaningless.
+POLICY_LIST_KEYS = ("Action", "NotAction", "Resource", "NotResource")
+
+# A bare account ID in a Principal, which IAM expands into the account's root
+# ARN.
+ACCOUNT_ID_RE = re.compile(r"^\d{12}$")
+
+
+def _normalize_principal(principal):
+    if not isinstance(principal, dict):
+        return principal
+
+    normalized = {}
+    for kind, values in principal.items():
+        if isinstance(values, str):
+            values = [values]
+        if kind == "AWS":
+            values = [
+                f"arn:aws:iam::{v}:root" if ACCOUNT_ID_RE.match(v) else v
+                for v in values
+            ]
+        normalized[kind] = sorted(set(values))
+    return normalized
+
+
+def _condition_values(values):
+    # IAM compares condition values as strings, so `true` and "true" match.
+    if not isinstance(values, list):
+        values = [values]
+    return sorted({str(v).lower() if isinstance(v, bool) else str(v) for v in values})
+
+
+def _normalize_statement(statement):
+    if not isinstance(statement, dict):
+        return statement
+
+    normalized = dict(statement)
+    for key in POLICY_LIST_KEYS:
+        if key in normalized:
+            values = normalized[key]
+            if isinstance(values, str):
+                values = [values]
+            normalized[key] = sorted(set(values))
+
+    for key in ("Principal", "NotPrincipal"):
+        if key in normalized:
+            normalized[key] = _normalize_principal(normalized[key])
+
+    if isinstance(normalized.get("Condition"), dict):
+        normalized["Condition"] = {
+            operator: {
+                key: _condition_values(values) for key, values in conditions.items()
+            }
+            for operator, conditions in normalized["Condition"].items()
+        }
+
+    return normalized
+
+
+def _normalize_policy(doc):
+    """Returns the canonical form of an IAM policy document.
+
+    IAM treats a number of differently written documents as the very same
+    policy, and does not always hand a document back exactly as it was
+    written. The canonical form irons those differences out so that two
+    documents can be compared directly:
+
+      * A single `Statement` becomes a list of one, and the statements are
+        sorted (and de-duplicated) since their order has no meaning.
+      * `Action`, `NotAction`, `Resource` and `NotResource` values, principals
+        and condition values become sorted lists, even if they were written as
+        a single string.
+      * AWS principals written as a bare account ID become the account's root
+        ARN, which is how IAM returns them.
+
+    Args:
+        doc: A parsed policy document.
+
+    Returns:
+        A new, normalized document. Anything that doesn't look like a policy
+        document is returned untouched.
+    """
+    if not isinstance(doc, dict):
+        return doc
+
+    normalized = dict(doc)
+    statements = normalized.get("Statement")
+    if isinstance(statements, dict):
+        statements = [statements]
+    if isinstance(statements, list):
+        statements = {
+            json.dumps(s, sort_keys=True): s
+            for s in map(_normalize_statement, statements)
+        }
+        normalized["Statement"] = [v for _, v in sorted(statements.items())]
+    return normalized
+
+
+class _PolicyDocumentCache:
+    """Parsed IAM policy documents, shared by every actor in the process.
+
+    Large scripts tend to point hundreds of Users, Groups and Roles at the
+    same handful of policy files. Each file is read, token-substituted and
+    parsed only once per distinct set of tokens, and the resulting document
+    is shared between the actors -- so it must never be modified in place.
+
+    Every document also gets a digest of its canonical form (see
+    `_normalize_policy`), so that comparing it against the document in IAM is
+    a simple equality check.
+    """
+
+    def __init__(self):
+        # (path, token fingerprint) -> parsed document
+        self._documents = {}
+
+        # id(document) -> (document, normalized document, digest). The
+        # document itself is kept around so that its id() can't be reused by
+        # another object.
+        self._canonical = {}
+
+    def load(self, actor, path: str) -> dict:
+        """Returns the parsed policy document at `path` for an actor.
+
+        Args:
+            actor: The IAM actor asking, used for its tokens and parser.
+            path: Path to the JSON policy document.
+
+        Raises:
+            UnrecoverableActorFailure: If the document cannot be parsed.
+        """
+        key = (path, self._fingerprint(actor._init_tokens))
+        if key not in self._documents:
+            doc = actor._parse_json(path)
+            self._documents[key] = doc
+            self._canonical[id(doc)] = (doc, *self._canonicalize(doc))
+        return self._documents[key]
+
+    def normalized(self, doc: dict | None) -> dict | None:
+        """Returns the normalized form of a policy document."""
+        return self._lookup(doc)[0]
+
+    def digest(self, doc: dict | None) -> str:
+        """Returns the digest of the normalized form of a policy document."""
+        return self._lookup(doc)[1]
+
+    def _lookup(self, doc):
+        cached = self._canonical.get(id(doc))
+        if cached is not None and cached[0] is doc:
+            return cached[1:]
+        return self._canonicalize(doc)
+
+    def _canonicalize(self, doc):
+        normalized = _normalize_policy(doc)
+        canonical = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+        return normalized, hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _fingerprint(self, tokens):
+        # Only tokens that populate_with_tokens() would substitute matter. The
+        # canonical JSON keeps 1, 1.0, True and "1" apart, which hash() would
+        # not, and can't collide the way a 64-bit hash can.
+        substituted = {
+            k: v
+            for k, v in (tokens or {}).items()
+            if type(v) in (str, bool, int, float)
+        }
+        canonical = json.dumps(substituted, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+POLICY_DOCUMENTS = _PolicyDocumentCache()
+
 
 class IAMBaseActor(base.AWSBaseActor):
     """User/Group/Role Base Management Class
@@ -33,6 +374,10 @@ class IAMBaseActor(base.AWSBaseActor):
     class abstracts that work, so that the actual User/Group/Role actors can be
     extremely simple and just handle the differences between each type of IAM
     entity.
+
+    When a script manages many Users, Groups and Roles (at least
+    ``KINGPIN_IAM_SNAPSHOT_THRESHOLD``, default 10), they are all read from a
+    single account-wide snapshot rather than looked up one by one.
     """
 
     all_options = {
@@ -64,6 +409,10 @@ class IAMBaseActor(base.AWSBaseActor):
         #  User, Group, Role, InstanceProfiles
         self.entity_name = "Base"
 
+        # The type of the entity in the shared IAM_SNAPSHOT ("User", "Group" or
+        # "Role"), or None if the entity type is not part of the snapshot.
+        self.snapshot_type = None
+
         self.create_entity = None
         self.delete_entity = None
         self.delete_entity_policy = None
@@ -72,10 +421,16 @@ class IAMBaseActor(base.AWSBaseActor):
         self.get_entity_policy = None
         self.put_entity_policy = None
 
+        # Set by _parse_inline_policies()
+        self.inline_policies = None
+
     @property
     def entity_kwarg_name(self):
         return f"{self.entity_name.capitalize()}Name"
 
+    def _use_snapshot(self) -> bool:
+        return self.snapshot_type is not None and IAM_SNAPSHOT.enabled()
+
     def _generate_policy_name(self, policy):
         """Generates an Amazon-friendly Policy name from a filename.
 
@@ -108,6 +463,10 @@ class IAMBaseActor(base.AWSBaseActor):
 
         return name
 
+    def journal_fingerprint(self):
+        # The policy files can change without their names changing.
+        return self.inline_policies
+
     def _parse_inline_policies(self, policies):
         """Read, parse and store our inline policies.
 
@@ -140,7 +499,7 @@ class IAMBaseActor(base.AWSBaseActor):
         # not corrupt very early on.
         for policy in policies:
             p_name = self._generate_policy_name(policy)
-            self.inline_policies[p_name] = self._parse_json(policy)
+            self.inline_policies[p_name] = POLICY_DOCUMENTS.load(self, policy)
 
             self.log.debug(f"Parsed policy {p_name}: {self.inline_policies[p_name]}")
 
@@ -155,6 +514,10 @@ class IAMBaseActor(base.AWSBaseActor):
             dict-version of the policy document.
         """
 
+        if self._use_snapshot():
+            entity = await IAM_SNAPSHOT.get_entity(self, self.snapshot_type, name)
+            return IAM_SNAPSHOT.get_policies(self.snapshot_type, entity)
+
         policies = {}
 
         # Get the list of inline policies attached to an entity.
@@ -165,10 +528,10 @@ class IAMBaseActor(base.AWSBaseActor):
         policy_names = []
         try:
             self.log.debug(f"Searching for any inline policies for {name}")
-            ret = await self.api_call(
+            async for ret in self.paginate(
                 self.list_entity_policies, **{self.entity_kwarg_name: name}
-            )
-            policy_names = ret.get("PolicyNames", [])
+            ):
+                policy_names.extend(ret.get("PolicyNames", []))
         except ClientError as e:
             if "NoSuchEntity" in str(e):
                 # The user doesn't exist.. likely in a dry run. Return no
@@ -179,32 +542,32 @@ class IAMBaseActor(base.AWSBaseActor):
                     f"An unexpected API error occurred: {e}"
                 ) from e
 
-        # Iterate through all of the named policies and fire off
-        # get-requests, but don't await on them yet.
-        tasks = []
-        for p_name in policy_names:
-            tasks.append(
-                (
-                    p_name,
-                    self.api_call(
-                        self.get_entity_policy,
-                        **{self.entity_kwarg_name: name, "PolicyName": p_name},
-                    ),
+        # Fire off a get-request for each of the named policies at once. The
+        # IAM governor bounds how many of them (across every actor in the
+        # run) are actually in flight at any time.
+        results = await asyncio.gather(
+            *[
+                self.api_call_with_governor(
+                    self.get_entity_policy,
+                    "iam",
+                    entity=name,
+                    **{self.entity_kwarg_name: name, "PolicyName": p_name},
                 )
-            )
+                for p_name in policy_names
+            ],
+            return_exceptions=True,
+        )
 
-        # Now that we've fired off all the calls, we walk through each awaited
-        # result, parse the returned policy, and append it to our policies
-        # list. We also catch any raised exceptions here.
-        for t in tasks:
-            p_name, p_task = t
-            try:
-                raw = await p_task
-            except ClientError as e:
+        # Now walk through each result, parse the returned policy, and append
+        # it to our policies list. We also raise any failures here.
+        for p_name, raw in zip(policy_names, results, strict=True):
+            if isinstance(raw, ClientError):
                 raise exceptions.RecoverableActorFailure(
                     f"An unexpected API error occurred downloading "
-                    f"policy {p_name}: {e}"
-                ) from e
+                    f"policy {p_name}: {raw}"
+                ) from raw
+            if isinstance(raw, BaseException):
+                raise raw
 
             # Convert the uuencoded doc string into a dict
             p_doc = raw.get("PolicyDocument", {})
@@ -248,10 +611,13 @@ class IAMBaseActor(base.AWSBaseActor):
             ):
                 new = self.inline_policies[policy]
                 exist = existing_policies[policy]
-                diff = utils.diff_dicts(exist, new)
-                if diff:
+                if POLICY_DOCUMENTS.digest(exist) != POLICY_DOCUMENTS.digest(new):
                     self.log.info(f"Policy {policy} differs from Amazons:")
-                    for line in diff.split("\n"):
+                    diff = utils.diff_dicts(
+                        POLICY_DOCUMENTS.normalized(exist),
+                        POLICY_DOCUMENTS.normalized(new),
+                    )
+                    for line in (diff or "").splitlines():
                         self.log.info(f"Diff: {line}")
                     policy_doc = self.inline_policies[policy]
                     tg.create_task(self._put_entity_policy(name, policy, policy_doc))
@@ -279,11 +645,14 @@ class IAMBaseActor(base.AWSBaseActor):
 
         self.log.info(f"Deleting policy {policy_name} from {self.entity_name} {name}")
         try:
-            ret = await self.api_call(
+            ret = await self.api_call_with_governor(
                 self.delete_entity_policy,
+                "iam",
+                entity=name,
                 **{self.entity_kwarg_name: name, "PolicyName": policy_name},
             )
             self.log.debug(f"Policy {policy_name} deleted: {ret}")
+            IAM_SNAPSHOT.delete_policy(self.snapshot_type, name, policy_name)
         except ClientError as e:
             if "NoSuchEntity" not in str(e):
                 raise exceptions.RecoverableActorFailure(
@@ -307,8 +676,10 @@ class IAMBaseActor(base.AWSBaseActor):
 
         self.log.info(f"Pushing policy {policy_name} to {self.entity_name} {name}")
         try:
-            ret = await self.api_call(
+            ret = await self.api_call_with_governor(
                 self.put_entity_policy,
+                "iam",
+                entity=name,
                 **{
                     self.entity_kwarg_name: name,
                     "PolicyName": policy_name,
@@ -316,6 +687,7 @@ class IAMBaseActor(base.AWSBaseActor):
                 },
             )
             self.log.debug(f"Policy {policy_name} pushed: {ret}")
+            IAM_SNAPSHOT.put_policy(self.snapshot_type, name, policy_name, policy_doc)
         except ClientError as e:
             raise exceptions.RecoverableActorFailure(
                 f"An unexpected API error occurred: {e}"
@@ -333,6 +705,9 @@ class IAMBaseActor(base.AWSBaseActor):
 
         self.log.debug(f"Searching for {self.entity_name} {name}")
 
+        if self._use_snapshot():
+            return await IAM_SNAPSHOT.get_entity(self, self.snapshot_type, name)
+
         try:
             ret = await self.api_call(self.get_entity, **{self.entity_kwarg_name: name})
         except ClientError as e:
@@ -397,6 +772,7 @@ class IAMBaseActor(base.AWSBaseActor):
             ) from e
 
         self.log.info(f"{self.entity_name} {ret[self.entity_name]['Arn']} created")
+        IAM_SNAPSHOT.add_entity(self.snapshot_type, name, ret[self.entity_name])
 
     async def _delete_entity(self, name):
         """Deletes and IAM Entity.
@@ -422,6 +798,7 @@ class IAMBaseActor(base.AWSBaseActor):
             # Now delete the entity
             await self.api_call(self.delete_entity, **{self.entity_kwarg_name: name})
             self.log.info(f"{self.entity_name} {name} deleted")
+            IAM_SNAPSHOT.delete_entity(self.snapshot_type, name)
         except ClientError as e:
             if "NoSuchEntity" in str(e):
                 self.log.warning(f"{self.entity_name} {name} doesn't exist")
@@ -447,6 +824,7 @@ class IAMBaseActor(base.AWSBaseActor):
             await self.api_call(
                 self.iam_conn.add_user_to_group, GroupName=group, UserName=name
             )
+            IAM_SNAPSHOT.add_user_to_group(name, group)
         except ClientError as e:
             raise exceptions.RecoverableActorFailure(
                 f"An unexpected API error occurred: {e}"
@@ -469,6 +847,7 @@ class IAMBaseActor(base.AWSBaseActor):
             await self.api_call(
                 self.iam_conn.remove_user_from_group, GroupName=group, UserName=name
             )
+            IAM_SNAPSHOT.remove_user_from_group(name, group)
         except ClientError as e:
             raise exceptions.RecoverableActorFailure(
                 f"An unexpected API error occurred: {e}"
@@ -545,6 +924,8 @@ class User(IAMBaseActor):
         super().__init__(*args, **kwargs)
 
         self.entity_name = "User"
+        self.snapshot_type = "User"
+        IAM_SNAPSHOT.managed.add(("User", self.option("name")))
         self.create_entity = self.iam_conn.create_user
         self.delete_entity = self.iam_conn.delete_user
         self.delete_entity_policy = self.iam_conn.delete_user_policy
@@ -556,31 +937,48 @@ class User(IAMBaseActor):
         # Parse the supplied inline policies
         self._parse_inline_policies(self.option("inline_policies"))
 
-    async def _ensure_groups(self, name, groups):
-        """Ensure that this user is a member of specific groups.
+    async def _get_user_groups(self, name: str) -> set[str]:
+        """Returns the names of the groups that a user is a member of.
 
         Args:
-            name: The user we're managing
-            groups: The list (or single) of groups to join be members of
+            name: The user name
         """
+        if self._use_snapshot():
+            entity = await IAM_SNAPSHOT.get_entity(self, "User", name)
+            if entity is None:
+                return set()
+            return set(entity.get("GroupList", []))
 
-        if isinstance(groups, str):
-            groups = [groups]
-
-        current_groups = set()
+        groups = set()
         try:
-            res = await self.api_call(
+            async for res in self.paginate(
                 self.iam_conn.list_groups_for_user, **{self.entity_kwarg_name: name}
-            )
-            current_groups = {g["GroupName"] for g in res.get("Groups", [])}
+            ):
+                groups.update(g["GroupName"] for g in res.get("Groups", []))
         except ClientError as e:
             # If the error is a 404, then the user doesn't exist and we can
-            # assume that the mappings don't exist at all. We leave the
-            # existing_mappings list alone. For any other error, raise.
+            # assume that the mappings don't exist at all. For any other
+            # error, raise.
             if "NoSuchEntity" not in str(e):
                 raise exceptions.RecoverableActorFailure(
                     f"An unexpected API error occurred: {e}"
                 ) from e
+            return set()
+
+        return groups
+
+    async def _ensure_groups(self, name, groups):
+        """Ensure that this user is a member of specific groups.
+
+        Args:
+            name: The user we're managing
+            groups: The list (or single) of groups to join be members of
+        """
+
+        if isinstance(groups, str):
+            groups = [groups]
+
+        current_groups = await self._get_user_groups(name)
 
         # Find any groups that we're not already a member of, and add us
         async with asyncio.TaskGroup() as tg:
@@ -683,6 +1081,8 @@ class Group(IAMBaseActor):
         super().__init__(*args, **kwargs)
 
         self.entity_name = "group"
+        self.snapshot_type = "Group"
+        IAM_SNAPSHOT.managed.add(("Group", self.option("name")))
         self.create_entity = self.iam_conn.create_group
         self.delete_entity = self.iam_conn.delete_group
         self.delete_entity_policy = self.iam_conn.delete_group_policy
@@ -706,10 +1106,10 @@ class Group(IAMBaseActor):
 
         users = []
         try:
-            raw = await self.api_call(
+            async for raw in self.paginate(
                 self.iam_conn.get_group, **{self.entity_kwarg_name: name}
-            )
-            users = [user["UserName"] for user in raw.get("Users", [])]
+            ):
+                users.extend(user["UserName"] for user in raw.get("Users", []))
         except ClientError as e:
             if "NoSuchEntity" not in str(e):
                 raise exceptions.RecoverableActorFailure(
@@ -854,6 +1254,8 @@ class Role(IAMBaseActor):
         super().__init__(*args, **kwargs)
 
         self.entity_name = "Role"
+        self.snapshot_type = "Role"
+        IAM_SNAPSHOT.managed.add(("Role", self.option("name")))
         self.create_entity = self.iam_conn.create_role
         self.delete_entity = self.iam_conn.delete_role
         self.delete_entity_policy = self.iam_conn.delete_role_policy
@@ -877,10 +1279,13 @@ class Role(IAMBaseActor):
             ],
         }
         if self.option("assume_role_policy_document") is not None:
-            self.assume_role_policy_doc = self._parse_json(
-                self.option("assume_role_policy_document")
+            self.assume_role_policy_doc = POLICY_DOCUMENTS.load(
+                self, self.option("assume_role_policy_document")
             )
 
+    def journal_fingerprint(self):
+        return [super().journal_fingerprint(), self.assume_role_policy_doc]
+
     async def _ensure_assume_role_doc(self, name):
         """Ensures that the Assume Role Policy for a Role is up to date.
 
@@ -903,15 +1308,17 @@ class Role(IAMBaseActor):
         exist = entity.get("AssumeRolePolicyDocument", {})
         new = self.assume_role_policy_doc
 
-        # Now diff it against our desired policy. If no diff, then quietly
-        # return.
-        diff = utils.diff_dicts(exist, new)
-        if not diff:
+        # Now compare it against our desired policy. If they match, then
+        # quietly return.
+        if POLICY_DOCUMENTS.digest(exist) == POLICY_DOCUMENTS.digest(new):
             self.log.debug("Assume Role Policy documents match")
             return
 
         self.log.info("Assume Role Policy differs from Amazons:")
-        for line in diff.split("\n"):
+        diff = utils.diff_dicts(
+            POLICY_DOCUMENTS.normalized(exist), POLICY_DOCUMENTS.normalized(new)
+        )
+        for line in (diff or "").splitlines():
             self.log.info(f"Diff: {line}")
 
         if self._dry:
@@ -923,6 +1330,7 @@ class Role(IAMBaseActor):
             self.iam_conn.update_assume_role_policy,
             **{self.entity_kwarg_name: name, "PolicyDocument": json.dumps(new)},
         )
+        IAM_SNAPSHOT.set_assume_role_policy(name, new)
 
     async def _create_entity(self, name):
         """Creates an IAM Role.
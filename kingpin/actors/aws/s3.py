@@ -3,16 +3,19 @@
 ^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 """
 
+import asyncio
 import json
 import logging
+import time
 
 import jsonpickle
 from botocore.exceptions import ClientError, ParamValidationError
 from inflection import camelize
 
 from kingpin import utils
-from kingpin.actors import exceptions
+from kingpin.actors import exceptions, profiler
 from kingpin.actors.aws import base
+from kingpin.actors.aws.settings import KINGPIN_S3_INVENTORY_TTL
 from kingpin.actors.utils import dry
 from kingpin.constants import REQUIRED, STATE, SchemaCompareBase
 
@@ -399,6 +402,82 @@ class TaggingConfig(SchemaCompareBase):
     valid = '[ { "key": "<key name>", "value": "<tag value>" } ]'
 
 
+class _BucketInventory:
+    """A shared, short-lived copy of the list of buckets in the account.
+
+    `list_buckets` returns every bucket in the account, so rather than having
+    each :py:class:`Bucket` actor list them all just to find its own, the
+    listing is loaded once and shared by every actor until it is older than
+    `KINGPIN_S3_INVENTORY_TTL` seconds. Buckets that Kingpin itself creates or
+    deletes are updated in place.
+    """
+
+    def __init__(self):
+        # Names of the buckets managed by Bucket actors in this process.
+        self.managed = set()
+
+        self._names = None
+        self._regions = {}
+        self._loaded_at = None
+        self._loading = None
+
+    def is_fresh(self) -> bool:
+        if self._names is None:
+            return False
+        return time.monotonic() - self._loaded_at < KINGPIN_S3_INVENTORY_TTL
+
+    async def exists(self, actor, name: str) -> bool:
+        """Returns whether the named bucket exists in the account.
+
+        Args:
+            actor: The Bucket actor asking, used for its client.
+            name: Bucket name
+        """
+        if not self.is_fresh():
+            # Concurrent callers all wait on the same listing.
+            loading = self._loading
+            if loading is None:
+                loading = self._loading = asyncio.ensure_future(self._load(actor))
+            try:
+                await asyncio.shield(loading)
+            finally:
+                if self._loading is loading and loading.done():
+                    self._loading = None
+
+        return name in self._names
+
+    def region(self, name: str) -> str | None:
+        """Returns the region of the named bucket, if Amazon reported it."""
+        return self._regions.get(name)
+
+    def add(self, name: str, region: str) -> None:
+        if self._names is not None:
+            self._names.add(name)
+            self._regions[name] = region
+
+    def discard(self, name: str) -> None:
+        if self._names is not None:
+            self._names.discard(name)
+            self._regions.pop(name, None)
+
+    async def _load(self, actor):
+        names = set()
+        regions = {}
+        async for ret in actor.paginate(actor.s3_conn.list_buckets):
+            for bucket in ret["Buckets"]:
+                names.add(bucket["Name"])
+                if "BucketRegion" in bucket:
+                    regions[bucket["Name"]] = bucket["BucketRegion"]
+
+        log.debug(f"Loaded an inventory of {len(names)} S3 buckets")
+        self._names = names
+        self._regions = regions
+        self._loaded_at = time.monotonic()
+
+
+BUCKET_INVENTORY = _BucketInventory()
+
+
 class Bucket(base.EnsurableAWSBaseActor):
     """Manage the state of a single S3 Bucket.
 
@@ -418,7 +497,19 @@ class Bucket(base.EnsurableAWSBaseActor):
     we could recursively search for all files in the bucket and then delete
     them, this is a wildly dangerous thing to do inside the confines of this
     actor. Instead, we raise an exception and alert the you to the fact that
-    they need to delete the files themselves.
+    they need to delete the files themselves. Old object versions and delete
+    markers count as files too.
+
+    If you really do want the bucket emptied along with it, set the `purge`
+    option. Every object version and delete marker in the bucket will then be
+    deleted, in batches of 1000, before the bucket itself is deleted.
+
+    **Finding Existing Buckets**
+
+    All of the Bucket actors in a script share a single listing of the
+    buckets in the account, which is refreshed once it is older than
+    ``KINGPIN_S3_INVENTORY_TTL`` seconds (default: 300). When a script only
+    manages a single bucket, a `HEAD` request on that bucket is used instead.
 
     **Options**
 
@@ -494,6 +585,11 @@ class Bucket(base.EnsurableAWSBaseActor):
       (bool, None): Whether or not to enable Versioning on the bucket. If
       "None", then we don't manage versioning either way. Default: None
 
+    :purge:
+      (bool) When the state is "absent", delete every object in the bucket
+      (including old versions and delete markers) before deleting the bucket.
+      Default: False
+
     :notification_configuration:
       (:py:class:`NotificationConfiguration`, None)
 
@@ -586,9 +682,31 @@ class Bucket(base.EnsurableAWSBaseActor):
             ("Desired state of versioning on the bucket: true/false"),
         ),
         "notification_configuration": (NotificationConfiguration, None, ""),
+        "purge": (
+            bool,
+            False,
+            "Delete all of the objects in the bucket before deleting it",
+        ),
     }
 
-    unmanaged_options = ["name", "region"]
+    unmanaged_options = ["name", "region", "purge"]
+
+    # Number of delete_objects calls (of up to 1000 keys each) that are allowed
+    # to be in flight while purging a bucket.
+    purge_concurrency = 8
+
+    # Each piece of the bucket configuration is a separate API call, so fetch
+    # them all at once. The public access block must be settled before the
+    # policy (a public policy is rejected while it is blocked), but the rest
+    # can be pushed concurrently.
+    prefetch_getters = True
+    independent_options = [
+        "lifecycle",
+        "logging",
+        "tags",
+        "versioning",
+        "notification_configuration",
+    ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -623,6 +741,12 @@ class Bucket(base.EnsurableAWSBaseActor):
         # will populate this with True if the bucket does exist.
         self._bucket_exists = False
 
+        BUCKET_INVENTORY.managed.add(self.option("name"))
+
+    def journal_fingerprint(self):
+        # The policy file can change without its name changing.
+        return self.policy
+
     def _snake_to_camel(self, data):
         """Converts a snake_case dict to CamelCase.
 
@@ -697,10 +821,39 @@ class Bucket(base.EnsurableAWSBaseActor):
         # This allows the rest of the getter-methods to know whether or not the
         # bucket exists and not make bogus API calls when the bucket doesn't
         # exist.
-        buckets = await self.api_call(self.s3_conn.list_buckets)
-        matching = [b for b in buckets["Buckets"] if b["Name"] == self.option("name")]
-        if len(matching) == 1:
-            self._bucket_exists = True
+        #
+        # When this is the only bucket we manage, a single HEAD request is much
+        # cheaper than listing every bucket in the account.
+        if len(BUCKET_INVENTORY.managed) <= 1 and not BUCKET_INVENTORY.is_fresh():
+            exists = await self._head_bucket()
+            if exists is not None:
+                self._bucket_exists = exists
+                return
+
+        name = self.option("name")
+        self._bucket_exists = await BUCKET_INVENTORY.exists(self, name)
+
+        region = BUCKET_INVENTORY.region(name)
+        if self._bucket_exists and region and region != self.option("region"):
+            self.log.warning(
+                f"Bucket is in {region}, not {self.option('region')} as configured"
+            )
+
+    async def _head_bucket(self) -> bool | None:
+        """Checks for the bucket with a single HEAD request.
+
+        Returns:
+            True/False, or None if the answer was inconclusive (ie, the bucket
+            exists but belongs to somebody else).
+        """
+        try:
+            await self.api_call(self.s3_conn.head_bucket, Bucket=self.option("name"))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchBucket"):
+                return False
+            return None
+
+        return True
 
     async def _get_state(self) -> str:
         if not self._bucket_exists:
@@ -710,7 +863,10 @@ class Bucket(base.EnsurableAWSBaseActor):
 
     async def _set_state(self):
         if self.option("state") == "absent":
-            await self._verify_can_delete_bucket()
+            if self.option("purge"):
+                await self._purge_bucket()
+            else:
+                await self._verify_can_delete_bucket()
             await self._delete_bucket()
         else:
             await self._create_bucket()
@@ -731,21 +887,80 @@ class Bucket(base.EnsurableAWSBaseActor):
 
         self.log.info("Creating bucket")
         await self.api_call(self.s3_conn.create_bucket, **params)
+        BUCKET_INVENTORY.add(self.option("name"), self.option("region"))
 
     async def _verify_can_delete_bucket(self):
         # Find out if there are any files in the bucket before we go to delete
         # it. We cannot delete a bucket with files in it -- nor do we want to.
+        #
+        # We only need to know whether there is at least one, so ask for no
+        # more than that. Old versions and delete markers block the deletion
+        # just the same, so check for those as well.
         bucket = self.option("name")
-        keys = await self.api_call(self.s3_conn.list_objects, Bucket=bucket)
-
-        if "Contents" not in keys:
-            return
+        keys = await self.api_call(
+            self.s3_conn.list_objects_v2, Bucket=bucket, MaxKeys=1
+        )
+        if keys.get("KeyCount", 0) > 0:
+            raise exceptions.RecoverableActorFailure(
+                "Cannot delete bucket with keys: files found"
+            )
 
-        if len(keys["Contents"]) > 0:
+        versions = await self.api_call(
+            self.s3_conn.list_object_versions, Bucket=bucket, MaxKeys=1
+        )
+        if versions.get("Versions") or versions.get("DeleteMarkers"):
             raise exceptions.RecoverableActorFailure(
-                f"Cannot delete bucket with keys: {len(keys)} files found"
+                "Cannot delete bucket with keys: object versions or delete "
+                "markers found"
             )
 
+    @dry("Would have deleted all of the objects in the bucket")
+    async def _purge_bucket(self):
+        """Deletes every object version and delete marker in the bucket.
+
+        Pages through the bucket 1000 versions at a time, handing each page to
+        a `delete_objects` call while the next page is being listed. No more
+        than `purge_concurrency` deletions are in flight at once.
+        """
+        bucket = self.option("name")
+        self.log.warning(f"Deleting all of the objects in bucket {bucket}")
+
+        semaphore = asyncio.Semaphore(self.purge_concurrency)
+        deleted = []
+
+        async def _delete(objects):
+            try:
+                ret = await self.api_call(
+                    self.s3_conn.delete_objects,
+                    Bucket=bucket,
+                    Delete={"Objects": objects, "Quiet": True},
+                )
+            finally:
+                semaphore.release()
+
+            if ret.get("Errors"):
+                error = ret["Errors"][0]
+                raise exceptions.RecoverableActorFailure(
+                    f"Failed to delete {len(ret['Errors'])} objects, "
+                    f"ie: {error.get('Key')}: {error.get('Message')}"
+                )
+            deleted.append(len(objects))
+
+        pages = self.paginate(
+            self.s3_conn.list_object_versions, Bucket=bucket, MaxKeys=1000
+        )
+        async with asyncio.TaskGroup() as tg:
+            async for page in pages:
+                objects = [
+                    {"Key": v["Key"], "VersionId": v["VersionId"]}
+                    for v in page.get("Versions", []) + page.get("DeleteMarkers", [])
+                ]
+                if objects:
+                    await semaphore.acquire()
+                    tg.create_task(_delete(objects))
+
+        self.log.info(f"Deleted {sum(deleted)} objects")
+
     @dry("Would have deleted bucket")
     async def _delete_bucket(self):
         bucket = self.option("name")
@@ -756,6 +971,7 @@ class Bucket(base.EnsurableAWSBaseActor):
             raise exceptions.RecoverableActorFailure(
                 f"Cannot delete bucket: {str(e)}"
             ) from e
+        BUCKET_INVENTORY.discard(bucket)
 
     async def _get_policy(self) -> dict | str | None:
         if not self._bucket_exists:
@@ -779,7 +995,7 @@ class Bucket(base.EnsurableAWSBaseActor):
             self.log.debug("Not managing policy")
             return True
 
-        exist = await self._get_policy()
+        exist = await self._get_current("policy")
 
         # Now, diff our new policy from the existing policy. If there is no
         # difference, then we bail out of the method.
@@ -953,7 +1169,7 @@ class Bucket(base.EnsurableAWSBaseActor):
         return raw["Rules"]
 
     async def _compare_lifecycle(self):
-        existing = await self._get_lifecycle()
+        existing = await self._get_current("lifecycle")
         new = self.lifecycle
 
         if new is None:
@@ -1049,7 +1265,7 @@ class Bucket(base.EnsurableAWSBaseActor):
             raise InvalidBucketConfig(f"Invalid Public Access Block Config: {e}") from e
 
     async def _compare_public_access_block_configuration(self):
-        existing = await self._get_public_access_block_configuration()
+        existing = await self._get_current("public_access_block_configuration")
         new = self.access_block
 
         if new is None:
@@ -1103,7 +1319,7 @@ class Bucket(base.EnsurableAWSBaseActor):
             self.log.debug("Not managing Tags")
             return True
 
-        exist = await self._get_tags()
+        exist = await self._get_current("tags")
 
         diff = utils.diff_dicts(exist, new)
         if not diff:
@@ -1160,7 +1376,7 @@ class Bucket(base.EnsurableAWSBaseActor):
             self.log.debug("No Notification Configuration")
             return True
 
-        exist = await self._get_notification_configuration()
+        exist = await self._get_current("notification_configuration")
         diff = utils.diff_dicts(exist, new)
 
         if not diff:
@@ -1185,3 +1401,151 @@ class Bucket(base.EnsurableAWSBaseActor):
             Bucket=self.option("name"),
             NotificationConfiguration=self.notification_configuration,
         )
+
+
+class BucketsConfig(SchemaCompareBase):
+    """Provides JSON-Schema based validation of the Buckets `buckets` option.
+
+    Each entry is the set of options of a single :py:class:`Bucket`, and must
+    at least include a `name`. The remaining options are validated by the
+    Bucket itself.
+
+    .. code-block:: json
+
+        [ { "name": "my-bucket", "versioning": true } ]
+
+    """
+
+    SCHEMA = {
+        "type": "array",
+        "minItems": 1,
+        "items": {
+            "type": "object",
+            "required": ["name"],
+            "properties": {"name": {"type": "string"}},
+        },
+    }
+
+
+class _RateLimiter:
+    """Spaces out callers so that no more than `rate` start every second.
+
+    A `rate` of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate else 0
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        if not self._interval:
+            return
+
+        now = time.monotonic()
+        start = max(now, self._next)
+        self._next = start + self._interval
+        if start > now:
+            profiler.record_queue_wait(start - now)
+            await asyncio.sleep(start - now)
+
+
+class _BucketsMember(base.FanOutMember, Bucket):
+    """A single bucket managed by a :py:class:`Buckets` actor.
+
+    Behaves exactly like a :py:class:`Bucket`, but borrows the boto3 clients
+    of its Buckets actor and sends its API calls through the shared rate
+    limiter.
+    """
+
+    async def api_call(self, api_function, *args, **kwargs):
+        await self._owner._rate_limiter.wait()
+        return await super().api_call(api_function, *args, **kwargs)
+
+
+class Buckets(base.FanOutAWSBaseActor):
+    """Manage the state of many S3 Buckets at once.
+
+    Takes a list of bucket definitions, each made up of the same options as
+    :py:class:`Bucket`, and ensures each of them exactly like a Bucket actor
+    would.
+
+    Compared to a `group.Async` of individual `Bucket` actors, the boto3
+    clients are created once per region rather than once per bucket, the
+    number of buckets being worked on at once is bounded, and the API calls
+    of all of the buckets can be paced by a shared rate limit to stay clear
+    of S3 throttling. As with individual Bucket actors, the configuration of
+    each bucket is fetched concurrently before it is compared.
+
+    **Options**
+
+    :buckets:
+      (:py:class:`BucketsConfig`) A list of dictionaries, each holding the
+      options of one :py:class:`Bucket`.
+
+    :region:
+      AWS region (or zone) name used for buckets that do not specify their
+      own `region`.
+
+    :concurrency:
+      (int) Maximum number of buckets to work on at once. Default: 20
+
+    :rate_limit:
+      (float) Maximum number of S3 API calls to start per second, across all
+      of the buckets. 0 means unlimited. Default: 0
+
+    **Examples**
+
+    .. code-block:: json
+
+       {
+         "actor": "aws.s3.Buckets",
+         "options": {
+           "region": "us-west-2",
+           "concurrency": 50,
+           "rate_limit": 100,
+           "buckets": [
+             { "name": "logs.myco.com", "versioning": false },
+             {
+               "name": "assets.myco.com",
+               "region": "us-east-1",
+               "policy": "./examples/aws.s3/amazon_put.json"
+             }
+           ]
+         }
+       }
+
+    **Dry Mode**
+
+    Every bucket behaves as described for :py:class:`Bucket`.
+    """
+
+    member_noun = "buckets"
+
+    all_options = {
+        "buckets": (BucketsConfig, REQUIRED, "List of Bucket options"),
+        "region": (str, REQUIRED, "Default AWS region (or zone) for the buckets"),
+        "concurrency": (int, 20, "Max number of buckets to work on at once"),
+        "rate_limit": ((int, float), 0, "Max S3 API calls per second (0: no limit)"),
+    }
+
+    desc = "S3 Buckets"
+
+    def __init__(self, *args, **kwargs):
+        """Build each of the buckets."""
+        super().__init__(*args, **kwargs)
+
+        self._rate_limiter = _RateLimiter(self.option("rate_limit"))
+        for config in self.option("buckets"):
+            options = dict({"region": self.option("region")}, **config)
+            self._add_member(
+                _BucketsMember(
+                    self,
+                    desc=f"S3 Bucket {options['name']}",
+                    options=options,
+                    dry=self._dry,
+                )
+            )
+
+    async def _execute(self):
+        self.log.info(f"Ensuring {len(self._members)} buckets")
+        await self._execute_members(self.option("concurrency"))
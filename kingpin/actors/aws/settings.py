@@ -30,3 +30,23 @@ KINGPIN_CFN_HASH_OUTPUT_KEY = os.getenv("KINGPIN_CFN_HASH_OUTPUT_KEY", "KingpinC
 # Instead of specifying the role_arn in each CloudFormation actor, you can set a
 # default role.
 KINGPIN_CFN_DEFAULT_ROLE_ARN = os.getenv("KINGPIN_CFN_DEFAULT_ROLE_ARN", None)
+
+# Optional path to a JSON file used to remember which CloudFormation templates
+# (by hash) have already passed validation, so that the preflight check can
+# skip them on subsequent runs. Unset (the default) disables the on-disk cache.
+KINGPIN_CFN_VALIDATION_CACHE = os.getenv("KINGPIN_CFN_VALIDATION_CACHE", None)
+
+# Number of seconds that the shared list of S3 buckets in the account (used by
+# aws.s3.Bucket to find out whether its bucket exists) is trusted before it is
+# fetched again.
+KINGPIN_S3_INVENTORY_TTL = int(os.getenv("KINGPIN_S3_INVENTORY_TTL", 300))
+
+# Once a run manages at least this many IAM Users, Groups and Roles, they all
+# share a single account-wide snapshot (from get_account_authorization_details)
+# rather than looking each entity up individually. Set to 0 to disable.
+KINGPIN_IAM_SNAPSHOT_THRESHOLD = int(os.getenv("KINGPIN_IAM_SNAPSHOT_THRESHOLD", 10))
+
+# Maximum number of concurrent API calls that actors fan out to a single AWS
+# service (ie, fetching or pushing many IAM inline policies at once), shared by
+# all of the actors in a run. Set to 0 to disable the limit.
+KINGPIN_AWS_SERVICE_CONCURRENCY = int(os.getenv("KINGPIN_AWS_SERVICE_CONCURRENCY", 8))
@@ -1,3 +1,4 @@
+import asyncio
 import importlib
 import logging
 import unittest
@@ -12,6 +13,16 @@ from kingpin.actors.aws import base, settings
 
 log = logging.getLogger(__name__)
 
+
+def mock_paginator(client, operation, pages):
+    """Makes the boto3 paginator of a mocked client hand out `pages`."""
+    method = getattr(client, operation)
+    method.__self__, method.__name__ = client, operation
+    paginator = client.get_paginator.return_value
+    paginator.paginate.return_value = pages
+    return paginator
+
+
 # STATIC VALUES FOR TESTS
 TARGET_GROUP_RESPONSE = {
     "ResponseMetadata": {
@@ -85,3 +96,137 @@ class TestBase(unittest.IsolatedAsyncioTestCase):
         actor = base.AWSBaseActor("Unit Test Action", {})
         ret = actor._parse_json(None)
         self.assertEqual(ret, None)
+
+    async def test_api_call_with_governor(self):
+        actor = base.AWSBaseActor("Unit Test Action", {})
+        release = asyncio.Event()
+        in_flight = []
+
+        async def fake_api_call(func, *args, **kwargs):
+            in_flight.append(kwargs)
+            await release.wait()
+            return kwargs
+
+        actor.api_call = fake_api_call
+        with mock.patch.object(settings, "KINGPIN_AWS_SERVICE_CONCURRENCY", 3):
+            tasks = [
+                asyncio.ensure_future(
+                    actor.api_call_with_governor(
+                        mock.MagicMock(), "iam", entity="a", N=i
+                    )
+                )
+                for i in range(10)
+            ]
+            await asyncio.sleep(0.01)
+
+        # The governor is shared by every actor talking to the service
+        self.assertEqual(len(in_flight), 3)
+        self.assertEqual(base.SERVICE_GOVERNORS["iam"].limit, 3)
+
+        release.set()
+        ret = await asyncio.gather(*tasks)
+        self.assertEqual(ret, [{"N": i} for i in range(10)])
+
+    async def test_paginate(self):
+        actor = base.AWSBaseActor("Unit Test Action", {})
+        stubber = stub.Stubber(actor.iam_conn)
+        stubber.add_response(
+            "list_roles", {"Roles": [], "IsTruncated": True, "Marker": "2"}, {}
+        )
+        stubber.add_response(
+            "list_roles",
+            {"Roles": [], "IsTruncated": True, "Marker": "3"},
+            {"Marker": "2"},
+        )
+        stubber.add_response(
+            "list_roles", {"Roles": [], "IsTruncated": False}, {"Marker": "3"}
+        )
+        stubber.activate()
+
+        pages = [p async for p in actor.paginate(actor.iam_conn.list_roles)]
+        self.assertEqual(len(pages), 3)
+        stubber.assert_no_pending_responses()
+
+    def _stub_list_roles(self, actor, pages=3):
+        stubber = stub.Stubber(actor.iam_conn)
+        for page in range(1, pages + 1):
+            response = {"Roles": [], "IsTruncated": page < pages}
+            if page < pages:
+                response["Marker"] = str(page + 1)
+            params = {"Marker": str(page)} if page > 1 else {}
+            stubber.add_response("list_roles", response, params)
+        stubber.activate()
+        return stubber
+
+    async def test_paginate_with_queueing(self):
+        actor = base.AWSBaseActor("Unit Test Action", {})
+        stubber = self._stub_list_roles(actor)
+        actor.api_call_with_queueing = mock.AsyncMock(
+            side_effect=lambda f, queue_name, **kw: f(**kw)
+        )
+
+        pages = [
+            p async for p in actor.paginate(actor.iam_conn.list_roles, queue_name="q")
+        ]
+        self.assertEqual(len(pages), 3)
+        stubber.assert_no_pending_responses()
+        for call in actor.api_call_with_queueing.call_args_list:
+            self.assertEqual(call.kwargs["queue_name"], "q")
+            self.assertEqual(call.args[0].__name__, "list_roles")
+
+    async def test_paginate_retried_page(self):
+        actor = base.AWSBaseActor("Unit Test Action", {})
+        stubber = stub.Stubber(actor.iam_conn)
+        stubber.add_response(
+            "list_roles", {"Roles": [], "IsTruncated": True, "Marker": "2"}, {}
+        )
+        stubber.add_client_error("list_roles", "Throttling")
+        # After a failure the pages start over, skipping those handed out.
+        stubber.add_response(
+            "list_roles", {"Roles": [], "IsTruncated": True, "Marker": "2"}, {}
+        )
+        stubber.add_response(
+            "list_roles", {"Roles": [], "IsTruncated": False}, {"Marker": "2"}
+        )
+        stubber.activate()
+
+        async def fake_queue(func, queue_name, **kwargs):
+            try:
+                return func(**kwargs)
+            except botocore.exceptions.ClientError:
+                return func(**kwargs)
+
+        actor.api_call_with_queueing = fake_queue
+        pages = [
+            p async for p in actor.paginate(actor.iam_conn.list_roles, queue_name="q")
+        ]
+        self.assertEqual([p["IsTruncated"] for p in pages], [True, False])
+        stubber.assert_no_pending_responses()
+
+    async def test_paginate_not_pageable(self):
+        actor = base.AWSBaseActor("Unit Test Action", {})
+        func = mock.MagicMock(return_value={"NextToken": "ignored"})
+        pages = [p async for p in actor.paginate(func, Foo="bar")]
+        self.assertEqual(pages, [{"NextToken": "ignored"}])
+        func.assert_called_once_with(Foo="bar")
+
+    async def test_paginate_prefetches_one_page(self):
+        actor = base.AWSBaseActor("Unit Test Action", {})
+        self._stub_list_roles(actor, pages=5)
+        release = asyncio.Event()
+        calls = []
+
+        async def fake_api_call(func, **kwargs):
+            calls.append(kwargs)
+            if len(calls) > 1:
+                await release.wait()
+            return func(**kwargs)
+
+        actor.api_call = fake_api_call
+        pages = actor.paginate(actor.iam_conn.list_roles)
+        await anext(pages)
+        await asyncio.sleep(0)
+
+        # The second page is already in flight, but nothing beyond it.
+        self.assertEqual(len(calls), 2)
+        await pages.aclose()
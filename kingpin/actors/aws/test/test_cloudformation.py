@@ -1,7 +1,10 @@
+import asyncio
 import datetime
 import importlib
 import json
 import logging
+import os
+import tempfile
 import unittest
 from unittest import mock
 from unittest.mock import AsyncMock
@@ -9,6 +12,7 @@ from unittest.mock import AsyncMock
 import boto3
 from botocore.exceptions import ClientError
 
+from kingpin.actors import journal
 from kingpin.actors.aws import base, cloudformation, settings
 
 log = logging.getLogger(__name__)
@@ -166,6 +170,74 @@ class TestCloudFormationBaseActor(unittest.IsolatedAsyncioTestCase):
         with self.assertRaises(cloudformation.InvalidTemplate):
             await self.actor._validate_template(body="junk")
 
+    async def test_validate_template_cached(self):
+        await self.actor._validate_template(body="test body")
+        await self.actor._validate_template(body="test body")
+        self.assertEqual(self.actor.cfn_conn.validate_template.call_count, 1)
+
+    async def test_preflight(self):
+        actors = []
+        for body in ("one", "one", "two"):
+            actor = cloudformation.CloudFormationBaseActor(
+                "unittest", {"region": "us-east-1"}
+            )
+            actor.cfn_conn = mock.MagicMock(name="cfn_conn")
+            actor._template_body = body
+            actor._template_url = None
+            actors.append(actor)
+
+        # Non-CloudFormation actors are ignored
+        actors.append(mock.MagicMock(name="other_actor"))
+
+        await cloudformation.preflight(actors)
+
+        # Duplicate templates are only validated once
+        actors[0].cfn_conn.validate_template.assert_called_once_with(TemplateBody="one")
+        self.assertFalse(actors[1].cfn_conn.validate_template.called)
+        actors[2].cfn_conn.validate_template.assert_called_once_with(TemplateBody="two")
+
+        # ... and the actors themselves skip validation later on
+        await actors[1]._validate_template(body="one")
+        self.assertFalse(actors[1].cfn_conn.validate_template.called)
+
+    async def test_preflight_invalid(self):
+        fake_exc = {
+            "Error": {
+                "Message": "Template format error: JSON not well-formed",
+                "Code": "ValidationError",
+            },
+        }
+        self.actor.cfn_conn.validate_template.side_effect = ClientError(
+            fake_exc, "FakeOperation"
+        )
+        self.actor._template_body = "junk"
+        self.actor._template_url = "https://bucket.s3.amazonaws.com/junk.json"
+
+        with self.assertRaises(cloudformation.InvalidTemplate):
+            await cloudformation.preflight([self.actor])
+
+        self.actor.cfn_conn.validate_template.assert_called_once_with(
+            TemplateURL="https://bucket.s3.amazonaws.com/junk.json"
+        )
+        self.assertEqual(cloudformation.VALIDATED_TEMPLATES, set())
+
+    async def test_preflight_cache_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = f"{tmpdir}/cache.json"
+            self.actor._template_body = "body"
+            self.actor._template_url = None
+
+            with mock.patch.object(
+                cloudformation, "KINGPIN_CFN_VALIDATION_CACHE", path
+            ):
+                await cloudformation.preflight([self.actor])
+                self.assertEqual(self.actor.cfn_conn.validate_template.call_count, 1)
+
+                # A fresh process reads the cache and skips the API call
+                cloudformation.VALIDATED_TEMPLATES.clear()
+                await cloudformation.preflight([self.actor])
+                self.assertEqual(self.actor.cfn_conn.validate_template.call_count, 1)
+
     def test_create_parameters(self):
         params = {
             "Key1": "Value1",
@@ -786,6 +858,41 @@ class TestStack(unittest.IsolatedAsyncioTestCase):
         self.actor.cfn_conn = mock.MagicMock(name="cfn_conn")
         self.actor.s3_conn = mock.MagicMock(name="s3_conn")
 
+    async def test_resume_after_template_changed(self):
+        run_journal = journal.RunJournal()
+        self.addCleanup(run_journal.close)
+        patcher = mock.patch.object(journal, "JOURNAL", run_journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            template = f"{tmpdir}/cfn.json"
+            path = f"{tmpdir}/journal"
+
+            def run(body):
+                with open(template, "w") as f:
+                    f.write(body)
+                run_journal.open(path, resume=os.path.exists(path))
+                stack = cloudformation.Stack(
+                    options={
+                        "name": "unit-test-cfn",
+                        "region": "us-west-2",
+                        "template": template,
+                    }
+                )
+                return stack.execute()
+
+            with mock.patch.object(
+                cloudformation.Stack, "_execute", new_callable=AsyncMock
+            ) as execute:
+                await run('{"Description": "one"}')
+                await run('{"Description": "one"}')
+                self.assertEqual(execute.await_count, 1)
+
+                # Same options, but the template has changed since
+                await run('{"Description": "two"}')
+                self.assertEqual(execute.await_count, 2)
+
     def test_diff_params_safely(self):
         self.actor = cloudformation.Stack(
             options={
@@ -1042,6 +1149,65 @@ class TestStack(unittest.IsolatedAsyncioTestCase):
         self.assertFalse(self.actor._create_change_set.called)
         self.assertFalse(self.actor._wait_until_change_set_ready.called)
 
+    async def test_ensure_template_hash_matches(self):
+        self.actor._create_change_set = AsyncMock(name="_create_change")
+        self.actor._get_stack_template = AsyncMock(name="_get_stack_template")
+        fake_stack = create_fake_stack("fake", "UPDATE_COMPLETE")
+        fake_stack["Outputs"] = [
+            {
+                "OutputKey": "KingpinCfnHash",
+                "OutputValue": self.actor._template_hash(),
+            }
+        ]
+
+        ret = await self.actor._ensure_template(fake_stack)
+        self.assertEqual(None, ret)
+
+        # The live template should never have been downloaded
+        self.assertFalse(self.actor._get_stack_template.called)
+        self.assertFalse(self.actor._create_change_set.called)
+
+    async def test_ensure_template_hash_mismatch(self):
+        self.actor._create_change_set = AsyncMock(name="_create_change")
+        fake_stack = create_fake_stack("fake", "UPDATE_COMPLETE")
+        fake_stack["Outputs"] = [
+            {"OutputKey": "KingpinCfnHash", "OutputValue": "stale"},
+        ]
+
+        template = json.loads(self.actor._template_body)
+        get_temp_mock = AsyncMock(name="_get_stack_template")
+        self.actor._get_stack_template = get_temp_mock
+        self.actor._get_stack_template.return_value = template
+
+        await self.actor._ensure_template(fake_stack)
+
+        # Falls back to the full diff, which finds no changes
+        get_temp_mock.assert_called_once_with(fake_stack["StackId"])
+        self.assertFalse(self.actor._create_change_set.called)
+
+    def test_template_hash_matches_feature_disabled(self):
+        settings.KINGPIN_CFN_HASH_OUTPUT_KEY = ""
+        importlib.reload(cloudformation)
+        self.actor = cloudformation.Stack(
+            options={
+                "name": "unit-test-cfn",
+                "state": "present",
+                "region": "us-west-2",
+                "template": "examples/test/aws.cloudformation/cfn.unittest.json",
+            }
+        )
+        fake_stack = create_fake_stack("fake", "UPDATE_COMPLETE")
+        fake_stack["Outputs"] = [
+            {"OutputKey": "", "OutputValue": self.actor._template_hash()},
+        ]
+        self.assertFalse(self.actor._template_hash_matches(fake_stack))
+
+    def test_template_body_with_hash(self):
+        ret = json.loads(self.actor._template_body_with_hash())
+        self.assertEqual(
+            ret["Outputs"]["KingpinCfnHash"]["Value"], self.actor._template_hash()
+        )
+
     async def test_ensure_template_different(self):
         self.actor._create_change_set = AsyncMock(name="_create_change")
         self.actor._create_change_set.return_value = {"Id": "abcd"}
@@ -1083,6 +1249,87 @@ class TestStack(unittest.IsolatedAsyncioTestCase):
             [mock.call(ChangeSetName="abcd")]
         )
 
+    async def test_ensure_template_keeps_dry_change_set(self):
+        cloudformation.KEEP_DRY_CHANGE_SETS = True
+        self.actor._dry = True
+        self.actor._create_change_set = AsyncMock(return_value={"Id": "abcd"})
+        self.actor._wait_until_change_set_ready = AsyncMock(
+            return_value={"Changes": []}
+        )
+        self.actor._get_stack_template = AsyncMock(return_value={"Fake": "Stack"})
+        fake_stack = create_fake_stack("fake", "CREATE_COMPLETE")
+
+        await self.actor._ensure_template(fake_stack)
+
+        self.assertFalse(self.actor.cfn_conn.delete_change_set.called)
+        self.assertEqual(
+            cloudformation.DRY_CHANGE_SETS,
+            {self.actor._change_set_key(fake_stack): (self.actor, "abcd")},
+        )
+
+        # Unused change sets get cleaned up
+        await cloudformation.delete_dry_change_sets()
+        self.actor.cfn_conn.delete_change_set.assert_called_once_with(
+            ChangeSetName="abcd"
+        )
+        self.assertEqual(cloudformation.DRY_CHANGE_SETS, {})
+
+    async def test_ensure_template_reuses_dry_change_set(self):
+        fake_stack = create_fake_stack("fake", "CREATE_COMPLETE")
+        dry_actor = mock.MagicMock(name="dry_actor")
+        key = self.actor._change_set_key(fake_stack)
+        cloudformation.DRY_CHANGE_SETS[key] = (dry_actor, "abcd")
+
+        self.actor.cfn_conn.describe_change_set.return_value = {
+            "ChangeSetId": "abcd",
+            "Status": "CREATE_COMPLETE",
+            "ExecutionStatus": "AVAILABLE",
+            "Changes": [],
+        }
+        self.actor._create_change_set = AsyncMock(name="_create_change")
+        self.actor._execute_change_set = AsyncMock(name="_execute_change")
+        self.actor._get_stack_template = AsyncMock(return_value={"Fake": "Stack"})
+
+        await self.actor._ensure_template(fake_stack)
+
+        self.assertFalse(self.actor._create_change_set.called)
+        self.actor._execute_change_set.assert_called_once_with(change_set_name="abcd")
+        self.assertEqual(cloudformation.DRY_CHANGE_SETS, {})
+
+    async def test_ensure_template_obsolete_dry_change_set(self):
+        fake_stack = create_fake_stack("fake", "CREATE_COMPLETE")
+        dry_actor = mock.MagicMock(name="dry_actor")
+        key = self.actor._change_set_key(fake_stack)
+        cloudformation.DRY_CHANGE_SETS[key] = (dry_actor, "abcd")
+
+        self.actor.cfn_conn.describe_change_set.return_value = {
+            "ChangeSetId": "abcd",
+            "Status": "CREATE_COMPLETE",
+            "ExecutionStatus": "OBSOLETE",
+        }
+        self.actor._create_change_set = AsyncMock(return_value={"Id": "efgh"})
+        self.actor._wait_until_change_set_ready = AsyncMock(
+            return_value={"Changes": []}
+        )
+        self.actor._execute_change_set = AsyncMock(name="_execute_change")
+        self.actor._get_stack_template = AsyncMock(return_value={"Fake": "Stack"})
+
+        await self.actor._ensure_template(fake_stack)
+
+        self.actor.cfn_conn.delete_change_set.assert_called_once_with(
+            ChangeSetName="abcd"
+        )
+        self.actor._execute_change_set.assert_called_once_with(change_set_name="efgh")
+
+    def test_change_set_key(self):
+        fake_stack = create_fake_stack("fake", "CREATE_COMPLETE")
+        key = self.actor._change_set_key(fake_stack)
+        self.assertEqual(key[0], fake_stack["StackId"])
+        self.assertEqual(key[1], self.actor._template_hash())
+
+        self.actor._parameters = self.actor._create_parameters({"key1": "new"})
+        self.assertNotEqual(key, self.actor._change_set_key(fake_stack))
+
     async def test_ensure_template_exc(self):
         self.actor._create_change_set = AsyncMock(name="_create_change")
         self.actor._create_change_set.return_value = {"Id": "abcd"}
@@ -1468,3 +1715,231 @@ class TestStack(unittest.IsolatedAsyncioTestCase):
         self.actor._validate_template = AsyncMock(return_value=None)
         self.actor._ensure_stack = AsyncMock(return_value=None)
         await self.actor._execute()
+
+
+class TestStackSet(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        settings.AWS_ACCESS_KEY_ID = "unit-test"
+        settings.AWS_SECRET_ACCESS_KEY = "unit-test"
+        settings.AWS_SESSION_TOKEN = "unit-test"
+        settings.KINGPIN_CFN_HASH_OUTPUT_KEY = "KingpinCfnHash"
+        settings.KINGPIN_CFN_DEFAULT_ROLE_ARN = None
+        importlib.reload(cloudformation)
+        base.NAMED_API_CALL_QUEUES = {}
+
+        self.actor = self._build(
+            stacks=[
+                {"name": "one"},
+                {"name": "two", "parameters": {"key1": "two"}},
+                {"name": "three", "region": "us-west-2"},
+            ]
+        )
+
+    def _build(self, dry=False, **options):
+        options = dict(
+            {
+                "region": "us-east-1",
+                "template": "examples/test/aws.cloudformation/cfn.unittest.json",
+                "parameters": {"key1": "value1"},
+            },
+            **options,
+        )
+        with mock.patch.object(boto3, "client") as client:
+            client.side_effect = lambda **kwargs: mock.MagicMock(**kwargs)
+            actor = cloudformation.StackSet(options=options, dry=dry)
+        self.boto3_client = client
+        return actor
+
+    def test_init(self):
+        one, two, three = self.actor._members
+        self.assertEqual(one.option("name"), "one")
+        self.assertEqual(one.option("region"), "us-east-1")
+        self.assertEqual(three.option("region"), "us-west-2")
+        self.assertEqual(
+            one._parameters, [{"ParameterKey": "key1", "ParameterValue": "value1"}]
+        )
+        self.assertEqual(
+            two._parameters, [{"ParameterKey": "key1", "ParameterValue": "two"}]
+        )
+        self.assertEqual(one._template_body, self.actor._template_body)
+        self.assertEqual(len(self.actor.get_actors()), 4)
+        self.assertEqual(len(self.actor.get_orgchart()), 4)
+
+    def test_init_duplicate_stacks(self):
+        with self.assertRaises(cloudformation.exceptions.InvalidOptions):
+            self._build(stacks=[{"name": "one"}, {"name": "one"}])
+        with self.assertRaises(cloudformation.exceptions.InvalidOptions):
+            self._build(
+                stacks=[
+                    {"name": "one", "region": "us-east-1"},
+                    {"name": "one"},
+                ]
+            )
+
+        # The same name is fine in another region.
+        actor = self._build(
+            stacks=[{"name": "one"}, {"name": "one", "region": "us-west-2"}]
+        )
+        self.assertEqual(len(actor._members), 2)
+
+    def test_init_shares_clients(self):
+        one, two, three = self.actor._members
+        self.assertIs(one.cfn_conn, self.actor.cfn_conn)
+        self.assertIs(two.cfn_conn, self.actor.cfn_conn)
+        self.assertIsNot(three.cfn_conn, self.actor.cfn_conn)
+        self.assertIs(three.iam_conn, self.actor.iam_conn)
+
+        # iam, plus ecs/cfn/sqs/s3 in each of the two regions.
+        self.assertEqual(self.boto3_client.call_count, 9)
+
+    def test_template_hash_shared(self):
+        one, two, _ = self.actor._members
+        with mock.patch.object(
+            cloudformation.Stack, "_template_hash", return_value="hash"
+        ) as template_hash:
+            self.assertEqual(one._template_hash(), "hash")
+            self.assertEqual(two._template_hash(), "hash")
+        self.assertEqual(template_hash.call_count, 1)
+
+    def _describe_by_name(self, statuses):
+        """A describe_stacks that knows the stacks in `statuses` by name."""
+
+        def describe_stacks(StackName):
+            if StackName not in statuses:
+                raise ClientError(
+                    {"Error": {"Code": "ValidationError", "Message": "does not exist"}},
+                    "DescribeStacks",
+                )
+            status = statuses[StackName]
+            if isinstance(status, list):
+                status = status.pop(0)
+            return {"Stacks": [create_fake_stack(StackName, status)]}
+
+        return describe_stacks
+
+    async def test_get_stack_shares_snapshot(self):
+        one, two, _ = self.actor._members
+        self.actor.cfn_conn.describe_stacks.side_effect = self._describe_by_name(
+            {"one": "CREATE_COMPLETE", "two": "UPDATE_COMPLETE"}
+        )
+
+        ret = await asyncio.gather(one._get_stack("one"), two._get_stack("two"))
+
+        self.assertEqual(ret[0]["StackStatus"], "CREATE_COMPLETE")
+        self.assertEqual(ret[1]["StackStatus"], "UPDATE_COMPLETE")
+        # Only our own stacks are described, once each, for both lookups
+        self.actor.cfn_conn.describe_stacks.assert_has_calls(
+            [mock.call(StackName="one"), mock.call(StackName="two")], any_order=True
+        )
+        self.assertEqual(self.actor.cfn_conn.describe_stacks.call_count, 2)
+
+    async def test_get_stack_lists_many_stacks(self):
+        one, two, _ = self.actor._members
+        self.actor._poller.list_threshold = 1
+        self.actor.cfn_conn.describe_stacks.side_effect = [
+            {
+                "Stacks": [
+                    create_fake_stack("one", "CREATE_COMPLETE"),
+                    create_fake_stack("not-ours", "CREATE_COMPLETE"),
+                ],
+                "NextToken": "next",
+            },
+            {"Stacks": [create_fake_stack("two", "UPDATE_COMPLETE")]},
+        ]
+
+        ret = await asyncio.gather(one._get_stack("one"), two._get_stack("two"))
+
+        self.assertEqual(ret[0]["StackStatus"], "CREATE_COMPLETE")
+        self.assertEqual(ret[1]["StackStatus"], "UPDATE_COMPLETE")
+        self.assertEqual(self.actor.cfn_conn.describe_stacks.call_count, 2)
+        _, snapshot = self.actor._poller._snapshots["us-east-1"]
+        self.assertNotIn("not-ours", snapshot)
+
+    async def test_get_stack_falls_back_when_missing(self):
+        one = self.actor._members[0]
+        self.actor.cfn_conn.describe_stacks.side_effect = self._describe_by_name(
+            {"stack-id": "DELETE_COMPLETE"}
+        )
+
+        ret = await one._get_stack("stack-id")
+
+        self.assertEqual(ret["StackStatus"], "DELETE_COMPLETE")
+        self.actor.cfn_conn.describe_stacks.assert_called_with(StackName="stack-id")
+
+    async def test_wait_until_state_refreshes_snapshot(self):
+        one = self.actor._members[0]
+        self.actor.cfn_conn.describe_stacks.side_effect = self._describe_by_name(
+            {"one": ["CREATE_COMPLETE", "UPDATE_COMPLETE"], "two": "CREATE_COMPLETE"}
+        )
+
+        await one._get_stack("one")
+        # A snapshot taken before the wait began must not be reused.
+        await one._wait_until_state("one", cloudformation.COMPLETE, sleep=0)
+
+        self.assertEqual(
+            self.actor.cfn_conn.describe_stacks.call_args_list.count(
+                mock.call(StackName="one")
+            ),
+            2,
+        )
+
+    async def test_execute(self):
+        self.actor._validate_template = AsyncMock()
+        for stack in self.actor._members:
+            stack.execute = AsyncMock()
+
+        await self.actor._execute()
+
+        self.actor._validate_template.assert_called_once()
+        for stack in self.actor._members:
+            stack.execute.assert_called_once()
+
+    async def test_execute_too_many_failures(self):
+        actor = self._build(
+            concurrency=1,
+            stacks=[{"name": "one"}, {"name": "two"}, {"name": "three"}],
+        )
+        actor._validate_template = AsyncMock()
+        for stack in actor._members:
+            stack.execute = AsyncMock(side_effect=cloudformation.StackFailed("bad"))
+
+        with self.assertRaises(cloudformation.exceptions.RecoverableActorFailure):
+            await actor._execute()
+
+        # The first failure stops any further stacks from being started.
+        actor._members[0].execute.assert_called_once()
+        actor._members[1].execute.assert_not_called()
+        actor._members[2].execute.assert_not_called()
+
+    async def test_execute_tolerated_failures(self):
+        actor = self._build(
+            concurrency=1,
+            max_failures=1,
+            stacks=[{"name": "one"}, {"name": "two"}, {"name": "three"}],
+        )
+        actor._validate_template = AsyncMock()
+        for stack in actor._members:
+            stack.execute = AsyncMock()
+        actor._members[0].execute.side_effect = cloudformation.InvalidTemplate("bad")
+
+        await actor._execute()
+
+        for stack in actor._members:
+            stack.execute.assert_called_once()
+
+    async def test_execute_dry_runs_everything(self):
+        actor = self._build(
+            dry=True,
+            concurrency=1,
+            stacks=[{"name": "one"}, {"name": "two"}],
+        )
+        actor._validate_template = AsyncMock()
+        for stack in actor._members:
+            stack.execute = AsyncMock(side_effect=cloudformation.InvalidTemplate("bad"))
+
+        with self.assertRaises(cloudformation.exceptions.UnrecoverableActorFailure):
+            await actor._execute()
+
+        for stack in actor._members:
+            stack.execute.assert_called_once()
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import unittest
+
+from kingpin.actors.aws import governor
+
+log = logging.getLogger(__name__)
+
+
+class TestServiceGovernor(unittest.IsolatedAsyncioTestCase):
+    async def _hold(self, gov, entity, started, release):
+        async with gov.slot(entity):
+            started.append(entity)
+            await release.wait()
+
+    async def test_limit(self):
+        gov = governor.ServiceGovernor(2)
+        started = []
+        release = asyncio.Event()
+        tasks = [
+            asyncio.ensure_future(self._hold(gov, "a", started, release))
+            for _ in range(5)
+        ]
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(started), 2)
+        self.assertEqual(gov.active, 2)
+
+        release.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(len(started), 5)
+        self.assertEqual(gov.active, 0)
+
+    async def test_round_robin_between_entities(self):
+        gov = governor.ServiceGovernor(1)
+        order = []
+
+        async def call(entity):
+            async with gov.slot(entity):
+                order.append(entity)
+                await asyncio.sleep(0)
+
+        # One huge entity queues up first, then a small one.
+        tasks = [asyncio.ensure_future(call("big")) for _ in range(4)]
+        tasks.append(asyncio.ensure_future(call("small")))
+        await asyncio.gather(*tasks)
+
+        # The small entity is served right after the first big call rather
+        # than waiting for all of them.
+        self.assertEqual(order, ["big", "big", "small", "big", "big"])
+
+    async def test_cancelled_waiter(self):
+        gov = governor.ServiceGovernor(1)
+        started = []
+        release = asyncio.Event()
+        first = asyncio.ensure_future(self._hold(gov, "a", started, release))
+        second = asyncio.ensure_future(self._hold(gov, "b", started, release))
+        await asyncio.sleep(0.01)
+
+        second.cancel()
+        await asyncio.sleep(0)
+        self.assertEqual(gov._waiters, {})
+
+        release.set()
+        await first
+        self.assertEqual(started, ["a"])
+        self.assertEqual(gov.active, 0)
+
+    async def test_disabled(self):
+        gov = governor.ServiceGovernor(0)
+        started = []
+        release = asyncio.Event()
+        tasks = [
+            asyncio.ensure_future(self._hold(gov, "a", started, release))
+            for _ in range(20)
+        ]
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(started), 20)
+        release.set()
+        await asyncio.gather(*tasks)
@@ -1,3 +1,4 @@
+import asyncio
 import importlib
 import json
 import logging
@@ -10,6 +11,7 @@ from botocore.stub import Stubber
 
 from kingpin.actors import exceptions
 from kingpin.actors.aws import iam, settings
+from kingpin.actors.aws.test.test_base import mock_paginator
 
 log = logging.getLogger(__name__)
 
@@ -142,6 +144,28 @@ class TestIAMBaseActor(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(ret["test2"], policy_dict)
         self.assertEqual(ret["test3"], policy_dict)
 
+    async def test_get_entity_policies_paginated(self):
+        self.iam_stubber.add_response(
+            "list_user_policies",
+            {"PolicyNames": ["test1"], "IsTruncated": True, "Marker": "page2"},
+            {"UserName": "test"},
+        )
+        self.iam_stubber.add_response(
+            "list_user_policies",
+            {"PolicyNames": ["test2"], "IsTruncated": False},
+            {"UserName": "test", "Marker": "page2"},
+        )
+        for pol in ("test1", "test2"):
+            self.iam_stubber.add_response(
+                "get_user_policy",
+                {"UserName": "test", "PolicyName": pol, "PolicyDocument": "{}"},
+            )
+
+        self.iam_stubber.activate()
+        ret = await self.actor._get_entity_policies("test")
+        self.assertEqual(sorted(ret), ["test1", "test2"])
+        self.iam_stubber.assert_no_pending_responses()
+
     def test_parse_inline_policies(self):
         parsed_policy = self.actor.inline_policies["examples-aws.iam.user-s3_example"]
         self.assertEqual(parsed_policy["Version"], "2012-10-17")
@@ -181,6 +205,30 @@ class TestIAMBaseActor(unittest.IsolatedAsyncioTestCase):
             any_order=True,
         )
 
+    async def test_ensure_inline_policies_equivalent(self):
+        # IAM hands back the same policy written slightly differently. That
+        # must not trigger a write.
+        fake_pol = {
+            "examples-aws.iam.user-s3_example": {
+                "Version": "2012-10-17",
+                "Statement": {
+                    "Resource": [
+                        "arn:aws:s3:::example.bucket.com*",
+                        "arn:aws:s3:::example.bucket.com*/*",
+                    ],
+                    "Action": ["s3:Put*", "s3:List*", "s3:Create*", "s3:Get*"],
+                    "Effect": "Allow",
+                },
+            }
+        }
+        self.actor._get_entity_policies = AsyncMock(return_value=fake_pol)
+        self.actor._put_entity_policy = AsyncMock()
+        self.actor._delete_entity_policy = AsyncMock()
+
+        await self.actor._ensure_inline_policies("test")
+        self.actor._put_entity_policy.assert_not_called()
+        self.actor._delete_entity_policy.assert_not_called()
+
     async def test_ensure_inline_policies_updated(self):
         # First, pretend like there are a few policies in place and we're not
         # passing any in, however we are purging policies we don't manage.
@@ -525,6 +573,33 @@ class TestUser(unittest.IsolatedAsyncioTestCase):
         await self.actor._ensure_groups("test", "ng1")
         self.iam_stubber.assert_no_pending_responses()
 
+    async def test_get_user_groups_paginated(self):
+        group = {
+            "Path": "/",
+            "GroupId": "................",
+            "Arn": "....................",
+            "CreateDate": datetime(2015, 1, 1),
+        }
+        self.iam_stubber.add_response(
+            "list_groups_for_user",
+            {
+                "Groups": [dict(group, GroupName="test-group-1")],
+                "IsTruncated": True,
+                "Marker": "page2",
+            },
+            {"UserName": "test"},
+        )
+        self.iam_stubber.add_response(
+            "list_groups_for_user",
+            {"Groups": [dict(group, GroupName="test-group-2")]},
+            {"UserName": "test", "Marker": "page2"},
+        )
+
+        self.iam_stubber.activate()
+        ret = await self.actor._get_user_groups("test")
+        self.assertEqual(ret, {"test-group-1", "test-group-2"})
+        self.iam_stubber.assert_no_pending_responses()
+
     async def test_ensure_groups_with_not_yet_created_user(self):
         # Create mocks for the add/remove user group methods
         self.actor._add_user_to_group = AsyncMock(return_value=None)
@@ -810,6 +885,13 @@ class TestRole(unittest.IsolatedAsyncioTestCase):
 
         self.iam_stubber = Stubber(self.actor.iam_conn)
 
+    def test_journal_fingerprint(self):
+        self.assertEqual(
+            self.actor.journal_fingerprint(),
+            [self.actor.inline_policies, self.actor.assume_role_policy_doc],
+        )
+        self.assertIn("examples-aws.iam.user-s3_example", self.actor.inline_policies)
+
     async def test_ensure_assume_role_doc_no_entity(self):
         fake_entity = None
         self.actor._get_entity = AsyncMock()
@@ -932,6 +1014,16 @@ class TestRole(unittest.IsolatedAsyncioTestCase):
         await self.actor._ensure_assume_role_doc("test")
         self.iam_stubber.assert_no_pending_responses()
 
+    async def test_ensure_assume_role_doc_mismatch_without_diff(self):
+        # The digests differ, but diff_dicts() finds nothing to report.
+        self.actor._dry = True
+        self.actor._get_entity = AsyncMock(
+            return_value={"AssumeRolePolicyDocument": {"Version": "1"}}
+        )
+        self.actor.assume_role_policy_doc = {"Version": "2"}
+        with mock.patch.object(iam.utils, "diff_dicts", return_value=None):
+            await self.actor._ensure_assume_role_doc("test")
+
     async def test_execute_absent(self):
         self.actor._options["state"] = "absent"
         self.actor._ensure_entity = AsyncMock()
@@ -1301,3 +1393,269 @@ class TestInstanceProfile(unittest.IsolatedAsyncioTestCase):
         await self.actor._execute()
         self.assertTrue(self.actor._ensure_entity.called)
         self.assertFalse(self.actor._ensure_role.called)
+
+
+class TestIAMSnapshot(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        settings.AWS_ACCESS_KEY_ID = "unit-test"
+        settings.AWS_SECRET_ACCESS_KEY = "unit-test"
+        settings.AWS_SESSION_TOKEN = "unit-test"
+        importlib.reload(iam)
+
+        self.iam_conn = mock.MagicMock(name="iam_conn")
+        with mock.patch.object(iam.base.boto3, "client", return_value=self.iam_conn):
+            self.role = iam.Role("Unit Test", {"name": "role"})
+            self.user = iam.User("Unit Test", {"name": "user"})
+
+        self.paginator = mock_paginator(
+            self.iam_conn,
+            "get_account_authorization_details",
+            [
+                {
+                    "UserDetailList": [
+                        {
+                            "UserName": "user",
+                            "Arn": "arn:user",
+                            "UserPolicyList": [
+                                {"PolicyName": "p1", "PolicyDocument": {"Version": "1"}}
+                            ],
+                            "GroupList": ["admins"],
+                        }
+                    ],
+                    "IsTruncated": True,
+                    "Marker": "next",
+                },
+                {
+                    "RoleDetailList": [
+                        {
+                            "RoleName": "role",
+                            "Arn": "arn:role",
+                            # Documents may come back URL encoded.
+                            "AssumeRolePolicyDocument": "%7B%22Version%22%3A%20%222%22%7D",
+                            "RolePolicyList": [],
+                        }
+                    ],
+                },
+            ],
+        )
+
+    def test_enabled(self):
+        self.assertEqual(iam.IAM_SNAPSHOT.managed, {("Role", "role"), ("User", "user")})
+
+        # Building the same entities again (say, for the real run after a
+        # rehearsal) doesn't count them twice.
+        with mock.patch.object(iam.base.boto3, "client", return_value=self.iam_conn):
+            iam.Role("Unit Test", {"name": "role"}, dry=True)
+            iam.User("Unit Test", {"name": "user"}, dry=True)
+        self.assertEqual(len(iam.IAM_SNAPSHOT.managed), 2)
+
+        self.assertFalse(iam.IAM_SNAPSHOT.enabled())
+        with mock.patch.object(iam, "KINGPIN_IAM_SNAPSHOT_THRESHOLD", 2):
+            self.assertTrue(iam.IAM_SNAPSHOT.enabled())
+        with mock.patch.object(iam, "KINGPIN_IAM_SNAPSHOT_THRESHOLD", 0):
+            self.assertFalse(iam.IAM_SNAPSHOT.enabled())
+
+    @mock.patch.object(iam, "KINGPIN_IAM_SNAPSHOT_THRESHOLD", 1)
+    async def test_get_entity(self):
+        role, user, missing = await asyncio.gather(
+            self.role._get_entity("role"),
+            self.user._get_entity("user"),
+            self.user._get_entity("missing"),
+        )
+
+        self.assertEqual(role["Arn"], "arn:role")
+        self.assertEqual(role["AssumeRolePolicyDocument"], {"Version": "2"})
+        self.assertEqual(user["Arn"], "arn:user")
+        self.assertIsNone(missing)
+        self.iam_conn.get_paginator.assert_called_once_with(
+            "get_account_authorization_details"
+        )
+        self.paginator.paginate.assert_called_once_with(
+            Filter=["User", "Group", "Role"], MaxItems=iam.MAX_ITEMS
+        )
+        self.iam_conn.get_role.assert_not_called()
+        self.iam_conn.get_user.assert_not_called()
+
+    @mock.patch.object(iam, "KINGPIN_IAM_SNAPSHOT_THRESHOLD", 1)
+    async def test_get_entity_policies(self):
+        self.assertEqual(
+            await self.user._get_entity_policies("user"), {"p1": {"Version": "1"}}
+        )
+        self.assertEqual(await self.role._get_entity_policies("role"), {})
+        self.assertEqual(await self.role._get_entity_policies("missing"), {})
+        self.iam_conn.list_user_policies.assert_not_called()
+        self.iam_conn.get_user_policy.assert_not_called()
+
+    @mock.patch.object(iam, "KINGPIN_IAM_SNAPSHOT_THRESHOLD", 1)
+    async def test_updated_after_writes(self):
+        self.iam_conn.create_role.return_value = {
+            "Role": {"RoleName": "new", "Arn": "arn:new"}
+        }
+
+        # Load the snapshot first, like _ensure_entity() would.
+        await self.user._get_entity("user")
+
+        await self.user._put_entity_policy("user", "p2", {"Version": "2"})
+        await self.user._delete_entity_policy("user", "p1")
+        await self.user._add_user_to_group("user", "devs")
+        await self.user._remove_user_from_group("user", "admins")
+        await self.role._create_entity("new")
+        await self.role._put_entity_policy("new", "p3", {"Version": "3"})
+        await self.role._ensure_assume_role_doc("role")
+
+        self.assertEqual(
+            await self.user._get_entity_policies("user"), {"p2": {"Version": "2"}}
+        )
+        self.assertEqual(await self.user._get_user_groups("user"), {"devs"})
+        self.assertEqual(
+            await self.role._get_entity_policies("new"), {"p3": {"Version": "3"}}
+        )
+        role = await self.role._get_entity("role")
+        self.assertEqual(
+            role["AssumeRolePolicyDocument"], self.role.assume_role_policy_doc
+        )
+
+        # New entities have the same lists as the ones read from Amazon.
+        new = await self.role._get_entity("new")
+        for key in iam.SNAPSHOT_LIST_KEYS["Role"]:
+            self.assertIsInstance(new[key], list)
+
+        await self.role._delete_entity("new")
+        self.assertIsNone(await self.role._get_entity("new"))
+        self.assertEqual(self.paginator.paginate.call_count, 1)
+
+    @mock.patch.object(iam, "KINGPIN_IAM_SNAPSHOT_THRESHOLD", 1)
+    async def test_missing_lists(self):
+        self.paginator.paginate.return_value = [
+            {"UserDetailList": [{"UserName": "user", "Arn": "arn:user"}]}
+        ]
+        self.assertEqual(await self.user._get_user_groups("user"), set())
+        self.assertEqual(await self.user._get_entity_policies("user"), {})
+
+        await self.user._add_user_to_group("user", "devs")
+        await self.user._put_entity_policy("user", "p1", {"Version": "1"})
+        self.assertEqual(await self.user._get_user_groups("user"), {"devs"})
+        self.assertEqual(
+            await self.user._get_entity_policies("user"), {"p1": {"Version": "1"}}
+        )
+
+    @mock.patch.object(iam, "KINGPIN_IAM_SNAPSHOT_THRESHOLD", 1)
+    async def test_forget(self):
+        self.assertIsNotNone(await self.role._get_entity("role"))
+
+        # The role was deleted by someone else in the meantime.
+        self.paginator.paginate.return_value = [{"RoleDetailList": []}]
+        iam.IAM_SNAPSHOT.forget()
+        self.assertIsNone(await self.role._get_entity("role"))
+        self.assertEqual(self.paginator.paginate.call_count, 2)
+
+
+class TestPolicyDocumentCache(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        settings.AWS_ACCESS_KEY_ID = "unit-test"
+        settings.AWS_SECRET_ACCESS_KEY = "unit-test"
+        settings.AWS_SESSION_TOKEN = "unit-test"
+        importlib.reload(iam)
+
+    def _role(self, name, tokens=None):
+        return iam.Role(
+            "Unit Test",
+            {
+                "name": name,
+                "inline_policies": ["examples/aws.iam.user/s3_example.json"],
+                "assume_role_policy_document": "examples/aws.iam.role/lambda.json",
+            },
+            init_tokens=tokens or {},
+        )
+
+    def test_documents_are_shared(self):
+        with mock.patch.object(
+            iam.IAMBaseActor, "_parse_json", autospec=True, side_effect=lambda s, p: {}
+        ) as parse:
+            role1 = self._role("role1")
+            role2 = self._role("role2")
+
+        # One parse per distinct file, not per actor.
+        self.assertEqual(parse.call_count, 2)
+        name = "examples-aws.iam.user-s3_example"
+        self.assertIs(role1.inline_policies[name], role2.inline_policies[name])
+        self.assertIs(role1.assume_role_policy_doc, role2.assume_role_policy_doc)
+
+    def test_documents_are_keyed_by_tokens(self):
+        with mock.patch.object(
+            iam.IAMBaseActor, "_parse_json", autospec=True, side_effect=lambda s, p: {}
+        ) as parse:
+            self._role("role1", {"ENV": "prod"})
+            self._role("role2", {"ENV": "prod"})
+            self._role("role3", {"ENV": "dev"})
+
+            # Tokens that are equal in Python but not once substituted.
+            self._role("role4", {"N": 1})
+            self._role("role5", {"N": True})
+            self._role("role6", {"N": "1"})
+
+        self.assertEqual(parse.call_count, 10)
+
+    def test_digest(self):
+        role = self._role("role")
+        doc = role.assume_role_policy_doc
+        copy = json.loads(json.dumps(doc))
+
+        self.assertEqual(
+            iam.POLICY_DOCUMENTS.digest(doc), iam.POLICY_DOCUMENTS.digest(copy)
+        )
+        self.assertEqual(
+            iam.POLICY_DOCUMENTS.digest({"a": 1, "b": 2}),
+            iam.POLICY_DOCUMENTS.digest({"b": 2, "a": 1}),
+        )
+        self.assertNotEqual(
+            iam.POLICY_DOCUMENTS.digest({"a": 1}),
+            iam.POLICY_DOCUMENTS.digest({"a": 2}),
+        )
+
+    def test_normalize_policy(self):
+        written = {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Principal": {"AWS": "123456789012"},
+                    "Action": "sts:AssumeRole",
+                    "Condition": {"Bool": {"aws:MultiFactorAuthPresent": True}},
+                },
+                {"Effect": "Deny", "Action": ["s3:b", "s3:a"], "Resource": "*"},
+            ],
+        }
+        returned = {
+            "Version": "2012-10-17",
+            "Statement": [
+                {"Effect": "Deny", "Action": ["s3:a", "s3:b"], "Resource": ["*"]},
+                {
+                    "Effect": "Allow",
+                    "Principal": {"AWS": ["arn:aws:iam::123456789012:root"]},
+                    "Action": ["sts:AssumeRole"],
+                    "Condition": {"Bool": {"aws:MultiFactorAuthPresent": "true"}},
+                },
+            ],
+        }
+        self.assertEqual(
+            iam._normalize_policy(written), iam._normalize_policy(returned)
+        )
+        self.assertEqual(
+            iam.POLICY_DOCUMENTS.digest(written), iam.POLICY_DOCUMENTS.digest(returned)
+        )
+
+        # The original document is left alone
+        self.assertEqual(written["Statement"][0]["Action"], "sts:AssumeRole")
+
+        # Real differences still show up
+        returned["Statement"][0]["Action"] = ["s3:a"]
+        self.assertNotEqual(
+            iam.POLICY_DOCUMENTS.digest(written), iam.POLICY_DOCUMENTS.digest(returned)
+        )
+
+    def test_normalize_policy_not_a_policy(self):
+        self.assertEqual(iam._normalize_policy("{}"), "{}")
+        self.assertEqual(iam._normalize_policy({"junk": 1}), {"junk": 1})
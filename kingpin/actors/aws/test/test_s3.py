@@ -1,13 +1,16 @@
+import asyncio
 import importlib
 import logging
 import unittest
 from unittest import mock
 
+import boto3
 from botocore.exceptions import ClientError
 
 from kingpin.actors import exceptions
 from kingpin.actors.aws import s3 as s3_actor
 from kingpin.actors.aws import settings
+from kingpin.actors.aws.test.test_base import mock_paginator
 
 log = logging.getLogger(__name__)
 
@@ -81,6 +84,10 @@ class TestBucket(unittest.IsolatedAsyncioTestCase):
         # Validate that the transition config was built properly too
         self.assertEqual(r["NoncurrentVersionTransitions"][0]["NoncurrentDays"], 14)
 
+    def test_journal_fingerprint(self):
+        self.assertEqual(self.actor.journal_fingerprint(), self.actor.policy)
+        self.assertIn("Statement", self.actor.policy)
+
     def test_snake_to_camel(self):
         snake = {"i_should_be_taller": {"me_too_man": ["not_me"]}}
 
@@ -97,6 +104,67 @@ class TestBucket(unittest.IsolatedAsyncioTestCase):
         await self.actor._precache()
         self.assertTrue(self.actor._bucket_exists)
 
+    async def test_precache_head_bucket(self):
+        await self.actor._precache()
+        self.assertTrue(self.actor._bucket_exists)
+        self.actor.s3_conn.head_bucket.assert_called_once_with(Bucket="test")
+        self.actor.s3_conn.list_buckets.assert_not_called()
+
+    async def test_precache_head_bucket_missing(self):
+        self.actor.s3_conn.head_bucket.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadBucket"
+        )
+        await self.actor._precache()
+        self.assertFalse(self.actor._bucket_exists)
+        self.actor.s3_conn.list_buckets.assert_not_called()
+
+    async def test_precache_head_bucket_forbidden(self):
+        self.actor.s3_conn.head_bucket.side_effect = ClientError(
+            {"Error": {"Code": "403"}}, "HeadBucket"
+        )
+        self.actor.s3_conn.list_buckets.return_value = {"Buckets": []}
+        await self.actor._precache()
+        self.assertFalse(self.actor._bucket_exists)
+        self.actor.s3_conn.list_buckets.assert_called_once()
+
+    async def test_precache_shared_inventory(self):
+        other = s3_actor.Bucket(options={"name": "other", "region": "us-east-1"})
+        other.s3_conn = self.actor.s3_conn
+        paginator = mock_paginator(
+            self.actor.s3_conn,
+            "list_buckets",
+            [
+                {"Buckets": [{"Name": "wrong_bucket"}]},
+                {"Buckets": [{"Name": "test", "BucketRegion": "us-west-2"}]},
+            ],
+        )
+
+        await asyncio.gather(self.actor._precache(), other._precache())
+
+        self.assertTrue(self.actor._bucket_exists)
+        self.assertFalse(other._bucket_exists)
+        self.assertEqual(s3_actor.BUCKET_INVENTORY.region("test"), "us-west-2")
+        self.actor.s3_conn.head_bucket.assert_not_called()
+        self.actor.s3_conn.get_paginator.assert_called_once_with("list_buckets")
+
+        # Buckets we create or delete are reflected without another listing.
+        await other._create_bucket()
+        await self.actor._delete_bucket()
+        await asyncio.gather(self.actor._precache(), other._precache())
+        self.assertFalse(self.actor._bucket_exists)
+        self.assertTrue(other._bucket_exists)
+        self.assertEqual(paginator.paginate.call_count, 1)
+
+    async def test_precache_inventory_expires(self):
+        s3_actor.Bucket(options={"name": "other", "region": "us-east-1"})
+        self.actor.s3_conn.list_buckets.return_value = {"Buckets": []}
+
+        await self.actor._precache()
+        with mock.patch.object(s3_actor, "KINGPIN_S3_INVENTORY_TTL", 0):
+            await self.actor._precache()
+
+        self.assertEqual(self.actor.s3_conn.list_buckets.call_count, 2)
+
     async def test_get_state_absent(self):
         ret = await self.actor._get_state()
         self.assertEqual("absent", ret)
@@ -108,6 +176,8 @@ class TestBucket(unittest.IsolatedAsyncioTestCase):
 
     async def test_set_state_absent(self):
         self.actor._options["state"] = "absent"
+        self.actor.s3_conn.list_objects_v2.return_value = {"KeyCount": 0}
+        self.actor.s3_conn.list_object_versions.return_value = {}
         await self.actor._set_state()
         self.actor.s3_conn.delete_bucket.assert_has_calls([mock.call(Bucket="test")])
 
@@ -128,14 +198,93 @@ class TestBucket(unittest.IsolatedAsyncioTestCase):
         )
 
     async def test_verify_can_delete_bucket(self):
-        self.actor.s3_conn.list_objects.return_value = {"Contents": [1, 2, 3]}
+        self.actor.s3_conn.list_objects_v2.return_value = {"KeyCount": 1}
         with self.assertRaises(exceptions.RecoverableActorFailure):
             await self.actor._verify_can_delete_bucket()
+        self.actor.s3_conn.list_objects_v2.assert_called_with(Bucket="test", MaxKeys=1)
+
+    async def test_verify_can_delete_bucket_versions(self):
+        self.actor.s3_conn.list_objects_v2.return_value = {"KeyCount": 0}
+        self.actor.s3_conn.list_object_versions.return_value = {
+            "DeleteMarkers": [{"Key": "a", "VersionId": "1"}]
+        }
+        with self.assertRaises(exceptions.RecoverableActorFailure):
+            await self.actor._verify_can_delete_bucket()
+        self.actor.s3_conn.list_object_versions.assert_called_with(
+            Bucket="test", MaxKeys=1
+        )
 
     async def test_verify_can_delete_bucket_true(self):
-        self.actor.s3_conn.list_objects.return_value = {}
+        self.actor.s3_conn.list_objects_v2.return_value = {"KeyCount": 0}
+        self.actor.s3_conn.list_object_versions.return_value = {}
         await self.actor._verify_can_delete_bucket()
 
+    async def test_set_state_absent_purge(self):
+        self.actor._options["state"] = "absent"
+        self.actor._options["purge"] = True
+        self.actor._verify_can_delete_bucket = mock.AsyncMock()
+        self.actor._purge_bucket = mock.AsyncMock()
+        await self.actor._set_state()
+        self.actor._purge_bucket.assert_called_once()
+        self.actor._verify_can_delete_bucket.assert_not_called()
+        self.actor.s3_conn.delete_bucket.assert_called_once_with(Bucket="test")
+
+    async def test_purge_bucket(self):
+        self.actor.purge_concurrency = 1
+        paginator = mock_paginator(
+            self.actor.s3_conn,
+            "list_object_versions",
+            [
+                {
+                    "Versions": [{"Key": "a", "VersionId": "1"}],
+                    "DeleteMarkers": [{"Key": "a", "VersionId": "2"}],
+                },
+                {"Versions": [{"Key": "b", "VersionId": "null"}]},
+            ],
+        )
+        self.actor.s3_conn.delete_objects.return_value = {}
+
+        await self.actor._purge_bucket()
+
+        paginator.paginate.assert_called_once_with(Bucket="test", MaxKeys=1000)
+        self.actor.s3_conn.delete_objects.assert_has_calls(
+            [
+                mock.call(
+                    Bucket="test",
+                    Delete={
+                        "Objects": [
+                            {"Key": "a", "VersionId": "1"},
+                            {"Key": "a", "VersionId": "2"},
+                        ],
+                        "Quiet": True,
+                    },
+                ),
+                mock.call(
+                    Bucket="test",
+                    Delete={
+                        "Objects": [{"Key": "b", "VersionId": "null"}],
+                        "Quiet": True,
+                    },
+                ),
+            ]
+        )
+
+    async def test_purge_bucket_errors(self):
+        self.actor.s3_conn.list_object_versions.return_value = {
+            "Versions": [{"Key": "a", "VersionId": "1"}]
+        }
+        self.actor.s3_conn.delete_objects.return_value = {
+            "Errors": [{"Key": "a", "Message": "Access Denied"}]
+        }
+
+        with self.assertRaises(ExceptionGroup):
+            await self.actor._purge_bucket()
+
+    async def test_purge_bucket_dry(self):
+        self.actor._dry = True
+        await self.actor._purge_bucket()
+        self.actor.s3_conn.list_object_versions.assert_not_called()
+
     async def test_delete_bucket(self):
         await self.actor._delete_bucket()
         self.actor.s3_conn.delete_bucket.assert_has_calls([mock.call(Bucket="test")])
@@ -743,3 +892,90 @@ class TestBucket(unittest.IsolatedAsyncioTestCase):
         self.actor.s3_conn.get_bucket_notification_configuration.return_value = {}
         ret = await self.actor._compare_notification_configuration()
         self.assertTrue(ret)
+
+
+class TestBuckets(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        settings.AWS_ACCESS_KEY_ID = "unit-test"
+        settings.AWS_SECRET_ACCESS_KEY = "unit-test"
+        settings.AWS_SESSION_TOKEN = "unit-test"
+        importlib.reload(s3_actor)
+
+        with mock.patch.object(boto3, "client") as client:
+            client.side_effect = lambda **kwargs: mock.MagicMock(**kwargs)
+            self.actor = s3_actor.Buckets(
+                options={
+                    "region": "us-east-1",
+                    "concurrency": 1,
+                    "buckets": [
+                        {"name": "one", "versioning": True},
+                        {"name": "two"},
+                        {"name": "three", "region": "us-west-2"},
+                    ],
+                }
+            )
+        self.boto3_client = client
+
+    def test_init(self):
+        one, two, three = self.actor._members
+        self.assertEqual(one.option("region"), "us-east-1")
+        self.assertTrue(one.option("versioning"))
+        self.assertEqual(three.option("region"), "us-west-2")
+        self.assertIs(one.s3_conn, self.actor.s3_conn)
+        self.assertIs(two.s3_conn, self.actor.s3_conn)
+        self.assertIsNot(three.s3_conn, self.actor.s3_conn)
+
+        # iam, plus ecs/cfn/sqs/s3 in each of the two regions.
+        self.assertEqual(self.boto3_client.call_count, 9)
+        self.assertEqual(len(self.actor.get_actors()), 4)
+        self.assertEqual(len(self.actor.get_orgchart()), 4)
+
+    def test_init_with_bogus_bucket(self):
+        with self.assertRaises(exceptions.InvalidOptions):
+            s3_actor.Buckets(
+                options={
+                    "region": "us-east-1",
+                    "buckets": [{"name": "x", "tags": "junk"}],
+                }
+            )
+
+    async def test_execute(self):
+        running = []
+        max_running = []
+
+        async def _execute():
+            running.append(1)
+            max_running.append(len(running))
+            await asyncio.sleep(0)
+            running.pop()
+
+        for bucket in self.actor._members:
+            bucket.execute = _execute
+
+        await self.actor._execute()
+        self.assertEqual(max(max_running), 1)
+
+    async def test_execute_failures(self):
+        for bucket in self.actor._members:
+            bucket.execute = mock.AsyncMock()
+        self.actor._members[1].execute.side_effect = s3_actor.InvalidBucketConfig("x")
+
+        with self.assertRaises(exceptions.RecoverableActorFailure):
+            await self.actor._execute()
+
+        for bucket in self.actor._members:
+            bucket.execute.assert_called_once()
+
+    async def test_api_call_rate_limit(self):
+        bucket = self.actor._members[0]
+        self.actor._rate_limiter = s3_actor._RateLimiter(100)
+
+        with mock.patch.object(asyncio, "sleep") as sleep:
+            await bucket.api_call(bucket.s3_conn.list_buckets)
+            await bucket.api_call(bucket.s3_conn.list_buckets)
+            await bucket.api_call(bucket.s3_conn.list_buckets)
+
+        self.assertEqual(sleep.call_count, 2)
+        self.assertLessEqual(sleep.call_args[0][0], 0.02)
+        self.assertEqual(bucket.s3_conn.list_buckets.call_count, 3)
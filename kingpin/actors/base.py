@@ -19,20 +19,18 @@ any live changes. It is up to the developer of the Actor to define what
 
 import asyncio
 import base64
-import functools
 import inspect
 import json
 import logging
 import os
 import sys
+import time
 import urllib.error
 import urllib.parse
-import urllib.request
 from collections.abc import Callable
-from concurrent.futures import ThreadPoolExecutor
 
 from kingpin import utils
-from kingpin.actors import exceptions
+from kingpin.actors import exceptions, http_client, journal, metrics, profiler
 from kingpin.actors.utils import timer
 from kingpin.constants import REQUIRED, STATE
 
@@ -52,6 +50,17 @@ if os.getenv("URLLIB_DEBUG", None):
 # environment variable
 DEFAULT_TIMEOUT = os.getenv("DEFAULT_TIMEOUT", 3600)
 
+# Settings for the connection pool shared by all of the HTTP based actors.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 60))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 10))
+
+# After this many consecutive failed requests to a host, further requests to it
+# fail immediately for HTTP_CIRCUIT_BREAKER_RESET seconds. 0 (the default)
+# disables this.
+HTTP_CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("HTTP_CIRCUIT_BREAKER_THRESHOLD", 0))
+HTTP_CIRCUIT_BREAKER_RESET = float(os.getenv("HTTP_CIRCUIT_BREAKER_RESET", 30))
+
 
 class LogAdapter(logging.LoggerAdapter):
     """Simple Actor Logging Adapter.
@@ -103,6 +112,15 @@ class BaseActor:
     # escaped.
     remove_escape_sequence = True
 
+    # Whether the run journal records this actor when it completes, so that a
+    # resumed run can skip it. Actors that only run other actors opt out.
+    journaled = True
+
+    # The actor that built this one, and this actor's position amongst its
+    # siblings. Set by the parent; see _tree_path.
+    _parent = None
+    _position = 0
+
     def __init__(
         self,
         desc: str | None = None,
@@ -434,6 +452,37 @@ class BaseActor:
             }
         ]
 
+    @property
+    def _tree_path(self) -> str:
+        """This actor's position in the tree of actors, ie. ``0/3/1``.
+
+        Made up of the positions of this actor and all of its parents, so it
+        stays the same from one run of a script to the next.
+        """
+        if self._parent is None:
+            return str(self._position)
+        return f"{self._parent._tree_path}/{self._position}"
+
+    def journal_fingerprint(self) -> object:
+        """Returns what this actor works from, besides its options.
+
+        Actors that read files named in their options (templates, policy
+        documents...) return what they read (or a digest of it), so that a
+        resumed run doesn't skip them once those files have changed. Must be
+        JSON serializable.
+        """
+        return None
+
+    def get_actors(self) -> list["BaseActor"]:
+        """Return this actor and every actor nested underneath it.
+
+        Walks the same tree as :py:meth:`get_orgchart`, but returns the actor
+        objects themselves so that callers can inspect them before anything
+        is executed.
+        """
+
+        return [self]
+
     @timer
     async def execute(self) -> object | None:
         """Executes an actor and returns the results when its finished.
@@ -464,57 +513,72 @@ class BaseActor:
             self.log.warning(f"Skipping execution. Condition: {self._condition}")
             return
 
-        try:
-            result = await self.timeout(self._execute)
-        except exceptions.ActorException as e:
-            # If exception is not RecoverableActorFailure
-            # or if warn_on_failure is not set, then escalate.
-            recover = isinstance(e, exceptions.RecoverableActorFailure)
-            if not recover or not self._warn_on_failure:
-                self.log.critical(e)
-                raise
-
-            # Otherwise - flag this failure as a warning, and continue
-            self.log.warning(e)
-            self.log.warning(
-                f"Continuing execution even though a failure was "
-                f"detected (warn_on_failure={self._warn_on_failure})"
-            )
-        except ExceptionGroup as eg:
-            # asyncio.TaskGroup wraps child task exceptions in ExceptionGroup.
-            # Log all errors for full observability, then unwrap and apply the
-            # same recovery logic as the ActorException handler above so that
-            # warn_on_failure is respected.
-            for i, exc in enumerate(eg.exceptions):
-                if i == 0:
-                    self.log.critical(exc)
-                else:
-                    self.log.error(f"Additional concurrent failure: {exc}")
+        if journal.JOURNAL.completed(self):
+            self.log.info("Skipping execution. Completed by a previous run.")
+            return
 
-            first = eg.exceptions[0]
-            recover = isinstance(first, exceptions.RecoverableActorFailure)
-            if recover and self._warn_on_failure:
+        with (
+            profiler.PROFILER.measure(self) as stats,
+            metrics.measure(self) as execution,
+        ):
+            try:
+                result = await self.timeout(self._execute)
+            except exceptions.ActorException as e:
+                # If exception is not RecoverableActorFailure
+                # or if warn_on_failure is not set, then escalate.
+                recover = isinstance(e, exceptions.RecoverableActorFailure)
+                if not recover or not self._warn_on_failure:
+                    self.log.critical(e)
+                    raise
+
+                # Otherwise - flag this failure as a warning, and continue
+                execution.status = "warned"
+                if stats is not None:
+                    stats.status = "warned"
+                self.log.warning(e)
                 self.log.warning(
                     f"Continuing execution even though a failure was "
                     f"detected (warn_on_failure={self._warn_on_failure})"
                 )
+            except ExceptionGroup as eg:
+                # asyncio.TaskGroup wraps child task exceptions in ExceptionGroup.
+                # Log all errors for full observability, then unwrap and apply the
+                # same recovery logic as the ActorException handler above so that
+                # warn_on_failure is respected.
+                for i, exc in enumerate(eg.exceptions):
+                    if i == 0:
+                        self.log.critical(exc)
+                    else:
+                        self.log.error(f"Additional concurrent failure: {exc}")
+
+                first = eg.exceptions[0]
+                recover = isinstance(first, exceptions.RecoverableActorFailure)
+                if recover and self._warn_on_failure:
+                    execution.status = "warned"
+                    if stats is not None:
+                        stats.status = "warned"
+                    self.log.warning(
+                        f"Continuing execution even though a failure was "
+                        f"detected (warn_on_failure={self._warn_on_failure})"
+                    )
+                else:
+                    raise first from eg
+            except Exception as e:
+                # We don't like general exception catch clauses like this, but
+                # because actors can be written by third parties and automatically
+                # imported, its impossible for us to catch every exception
+                # possible. This is a failsafe thats meant to throw a strong
+                # warning.
+                log.critical(
+                    f"Unexpected exception caught! "
+                    f"Please contact the author ({sys.modules[self.__module__].__author__}) and provide them "
+                    f"with this stacktrace"
+                )
+                self.log.exception(e)
+                raise exceptions.ActorException(e) from e
             else:
-                raise first from eg
-        except Exception as e:
-            # We don't like general exception catch clauses like this, but
-            # because actors can be written by third parties and automatically
-            # imported, its impossible for us to catch every exception
-            # possible. This is a failsafe thats meant to throw a strong
-            # warning.
-            log.critical(
-                f"Unexpected exception caught! "
-                f"Please contact the author ({sys.modules[self.__module__].__author__}) and provide them "
-                f"with this stacktrace"
-            )
-            self.log.exception(e)
-            raise exceptions.ActorException(e) from e
-        else:
-            self.log.debug(f"Finished successfully, return value: {result}")
+                self.log.debug(f"Finished successfully, return value: {result}")
+                journal.JOURNAL.record(self)
 
         # If we got here, we're exiting the actor cleanly and moving on.
         return result
@@ -544,6 +608,20 @@ class EnsurableBaseActor(BaseActor):
         :`_precache`: Called before any setters/getters are triggered. Used to optionally populate a cache of data to make the getters faster. For example, if you can make one API call to get all of the data about a resource, then store that data locally for fast access.
         :`_compare_[option]`: Optionally you can write your own comparison method if you're not doing a pure string comparison between the source and destination.
 
+    **Concurrent Getters**
+
+    By default every option is compared (and, if needed, set) one at a time.
+    Actors that set ``prefetch_getters = True`` instead call the getters of all
+    of their managed options concurrently up front, keep the results for the
+    comparers, and compare all of the options at once. Custom comparers should
+    ask :py:meth:`_get_current` for the current value of their option, rather
+    than calling its getter directly, so that they are handed the prefetched
+    result. The setters that
+    are needed then run one at a time in the order of ``all_options``, except
+    for those listed in ``independent_options``, which run concurrently with
+    the rest. Options set to `None` are not prefetched; their getters are only
+    called if a comparer asks for them.
+
     **Examples**
 
     .. code-block:: python
@@ -581,6 +659,14 @@ class EnsurableBaseActor(BaseActor):
     # have parameters that are unmutable ('name').
     unmanaged_options = []
 
+    # Set to True to call all of the getters concurrently before comparing the
+    # options. See "Concurrent Getters" above.
+    prefetch_getters = False
+
+    # Options whose setters do not depend on (or interfere with) any of the
+    # other options, and so may run concurrently when prefetch_getters is set.
+    independent_options = []
+
     def __init__(self, *args, **kwargs):
         # The 'state' parameter is a given, so make sure its set,
         self.all_options["state"] = (
@@ -602,6 +688,10 @@ class EnsurableBaseActor(BaseActor):
         # that provide references to the actual methods for execution later.
         self._gather_methods()
 
+        # Results of the getters called by _prefetch(), by option name: either
+        # the current value, or the exception the getter raised.
+        self._prefetched = {}
+
     def _gather_methods(self):
         """Generates pointers to the Getter and Setter methods.
 
@@ -626,7 +716,7 @@ class EnsurableBaseActor(BaseActor):
             if not self._is_method(comparer):
 
                 async def _comparer(option=option):
-                    existing = await self.getters[option]()
+                    existing = await self._get_current(option)
                     new = self.option(option)
                     return existing == new
 
@@ -690,11 +780,94 @@ class EnsurableBaseActor(BaseActor):
         if self.option("state") == "absent":
             return
 
-        for option in self._ensurable_options:
-            # We've already managed state .. so make sure we skip the state
-            # option and only manage the others.
-            if option != "state":
-                await self._ensure(option)
+        # We've already managed state .. so make sure we skip the state option
+        # and only manage the others.
+        options = [o for o in self._ensurable_options if o != "state"]
+
+        if self.prefetch_getters:
+            await self._ensure_concurrently(options)
+            return
+
+        for option in options:
+            await self._ensure(option)
+
+    async def _get_current(self, option):
+        """Returns the current value of an option.
+
+        Hands back the result that :py:meth:`_prefetch` got for the option (or
+        raises the exception it got) if there is one, and calls the option's
+        getter otherwise.
+
+        Args:
+            option: Option name
+        """
+        if option not in self._prefetched:
+            return await self.getters[option]()
+
+        result = self._prefetched[option]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _prefetch(self, options):
+        """Calls the getters for the supplied options concurrently.
+
+        The results are kept for :py:meth:`_get_current` until
+        :py:meth:`_forget_prefetch` is called.
+
+        Args:
+            options: A list of option names
+        """
+        options = [o for o in options if self.option(o) is not None]
+        results = await asyncio.gather(
+            *[self.getters[o]() for o in options], return_exceptions=True
+        )
+        self._prefetched = dict(zip(options, results, strict=True))
+
+    def _forget_prefetch(self):
+        """Drops the results kept by :py:meth:`_prefetch`."""
+        self._prefetched = {}
+
+    async def _ensure_concurrently(self, options):
+        """Compares all of the supplied options at once, then sets them.
+
+        Args:
+            options: A list of option names, in the order that their setters
+                should be called.
+        """
+        try:
+            await self._compare_and_set(options)
+        except ExceptionGroup as eg:
+            # Like execute(), raise the first failure itself rather than the
+            # ExceptionGroup that asyncio.TaskGroup wraps it in.
+            raise eg.exceptions[0] from eg
+
+    async def _compare_and_set(self, options):
+        try:
+            await self._prefetch(options)
+            async with asyncio.TaskGroup() as tg:
+                tasks = [tg.create_task(self.comparers[o]()) for o in options]
+        finally:
+            self._forget_prefetch()
+
+        changed = []
+        for option, task in zip(options, tasks, strict=True):
+            if task.result():
+                self.log.debug(f'Option "{option}" matches')
+            else:
+                self.log.debug(f'Option "{option}" DOES NOT match, calling setter')
+                changed.append(option)
+
+        async def _set_in_order():
+            for option in changed:
+                if option not in self.independent_options:
+                    await self.setters[option]()
+
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_set_in_order())
+            for option in changed:
+                if option in self.independent_options:
+                    tg.create_task(self.setters[option]())
 
 
 class HTTPBaseActor(BaseActor):
@@ -706,10 +879,34 @@ class HTTPBaseActor(BaseActor):
 
     If you're writing an Actor that uses a remote REST API, this is the
     base class you should subclass from.
+
+    All HTTP actors share a single connection pool, which keeps connections
+    to each host alive between requests. It is tuned through the
+    ``HTTP_CONNECT_TIMEOUT``, ``HTTP_READ_TIMEOUT`` and
+    ``HTTP_MAX_CONNECTIONS_PER_HOST`` environment variables. As with
+    ``urllib``, requests go through the proxies set in the ``http_proxy``,
+    ``https_proxy`` and ``no_proxy`` environment variables.
+
+    Failed requests are retried according to the
+    :py:class:`~kingpin.actors.http_client.RetryPolicy` in ``retry_policy``
+    (by default, they are not). Setting ``HTTP_CIRCUIT_BREAKER_THRESHOLD``
+    (and optionally ``HTTP_CIRCUIT_BREAKER_RESET``) turns on a shared
+    :py:class:`~kingpin.actors.http_client.CircuitBreaker`, which gives hosts
+    that keep failing a rest: requests to them fail right away with a
+    :py:exc:`~kingpin.actors.exceptions.RecoverableActorFailure`.
     """
 
     headers = None
-    _http_executor = ThreadPoolExecutor(10)
+    retry_policy = http_client.RetryPolicy()
+    http_pool = http_client.ConnectionPool(
+        max_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+    )
+    circuit_breaker = http_client.CircuitBreaker(
+        threshold=HTTP_CIRCUIT_BREAKER_THRESHOLD,
+        reset_timeout=HTTP_CIRCUIT_BREAKER_RESET,
+    )
 
     def _get_method(self, post):
         """Returns the appropriate HTTP Method based on the supplied Post data.
@@ -762,6 +959,8 @@ class HTTPBaseActor(BaseActor):
         post: str | None = None,
         auth_username: str | None = None,
         auth_password: str | None = None,
+        headers: dict[str, str] | None = None,
+        retry: http_client.RetryPolicy | None = None,
     ) -> dict:
         """Executes a web request asynchronously and returns the parsed body.
 
@@ -770,31 +969,67 @@ class HTTPBaseActor(BaseActor):
             post: (Str) POST body data to submit (if any)
             auth_username: (str) HTTP auth username
             auth_password: (str) HTTP auth password
+            headers: (Dict) Extra headers for this request only
+            retry: (RetryPolicy) Overrides the actor's `retry_policy`
         """
         self.log.debug(f"Making HTTP request to {url} with data: {post}")
 
         method = self._get_method(post)
         data = post.encode("utf-8") if post else None
-        req = urllib.request.Request(url, data=data, method=method)
 
+        all_headers = {}
+        if data is not None:
+            all_headers["Content-Type"] = "application/x-www-form-urlencoded"
         if self.headers:
-            for k, v in self.headers.items():
-                req.add_header(k, v)
+            all_headers.update(self.headers)
+        if headers:
+            all_headers.update(headers)
 
         if auth_username and auth_password:
             credentials = base64.b64encode(
                 f"{auth_username}:{auth_password}".encode()
             ).decode()
-            req.add_header("Authorization", f"Basic {credentials}")
+            all_headers["Authorization"] = f"Basic {credentials}"
+
+        retry = retry or self.retry_policy
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.circuit_breaker.check(url)
+            except http_client.CircuitOpenError as e:
+                raise exceptions.RecoverableActorFailure(str(e)) from e
+            started = time.monotonic()
+            try:
+                http_response = await self.http_pool.request(
+                    method, url, body=data, headers=all_headers
+                )
+            except urllib.error.URLError as e:
+                profiler.record_api_call(f"http.{method}", time.monotonic() - started)
+                if not retry.is_retryable(e):
+                    # The host is alive, it just didn't like our request.
+                    self.circuit_breaker.success(url)
+                    raise
+
+                self.circuit_breaker.failure(url)
+                if attempt >= retry.max_attempts:
+                    raise
+
+                delay = retry.delay(attempt, e)
+                self.log.warning(
+                    f"Request to {url} failed ({e}), retrying in {delay:.1f}s "
+                    f"(attempt {attempt + 1}/{retry.max_attempts})"
+                )
+                profiler.record_retry()
+                await profiler.sleep(delay)
+                continue
 
-        loop = asyncio.get_event_loop()
-        http_response = await loop.run_in_executor(
-            self._http_executor,
-            functools.partial(urllib.request.urlopen, req),
-        )
+            profiler.record_api_call(f"http.{method}", time.monotonic() - started)
+            self.circuit_breaker.success(url)
+            break
 
         try:
-            body = json.loads(http_response.read())
+            body = json.loads(http_response.body)
         except ValueError as e:
             raise exceptions.UnparseableResponseFromEndpoint(
                 f"Unable to parse response from remote API as JSON: {e}"
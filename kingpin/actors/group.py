@@ -7,10 +7,12 @@ or asynchronous stages.
 """
 
 import asyncio
+import itertools
 import logging
 
+from kingpin import exceptions as kingpin_exceptions
 from kingpin import utils as kp_utils
-from kingpin.actors import base, exceptions, utils
+from kingpin.actors import base, exceptions, macro_loader, utils
 from kingpin.constants import REQUIRED
 
 log = logging.getLogger(__name__)
@@ -42,6 +44,9 @@ class BaseGroupActor(base.BaseActor):
     # the moment that this actor is instantiated.
     strict_init_context = False
 
+    # Our acts are journaled one by one.
+    journaled = False
+
     # Do not remove remove escape sequence from escaped tokens. This will be
     # done later by another actor. Otherwise we risk remove the escapes and
     # failing because the token isn't found by a sub actor.
@@ -69,11 +74,20 @@ class BaseGroupActor(base.BaseActor):
         """
         super().__init__(*args, **kwargs)
 
+        # Number of actors built so far (contexts streamed from a file keep
+        # building more of them as they execute).
+        self._built = 0
+
         # Pre-initialize all of our actions!
         self._actions = self._build_actions()
 
     def get_orgchart(self, parent=""):
-        """Generate an orgchart for all the `acts` specified."""
+        """Generate an orgchart for all the `acts` specified.
+
+        If our contexts are streamed from a JSON Lines or CSV file, only the
+        actors for the first context are included: the rest aren't built
+        until they are about to run.
+        """
 
         ret = super().get_orgchart(parent=parent)
         group_id = str(id(self))
@@ -82,6 +96,20 @@ class BaseGroupActor(base.BaseActor):
 
         return ret
 
+    def get_actors(self):
+        """Return this group and all of the `acts` specified.
+
+        As with :py:meth:`get_orgchart`, only the actors for the first context
+        of a streamed context file are included. So are the only ones checked
+        by ``--preflight``.
+        """
+
+        ret = super().get_actors()
+        for act in self._actions:
+            ret = ret + act.get_actors()
+
+        return ret
+
     def _build_actions(self):
         """Builds either a single set of actions, or multiple sets.
 
@@ -99,6 +127,10 @@ class BaseGroupActor(base.BaseActor):
             into this actors 'init_context' are also passed into the actors that
             we're intantiating.
         """
+        # Every context builds the same acts, with the same tokens, so their
+        # scripts only need to be looked for once.
+        macro_loader.prefetch(self.option("acts"), self._init_tokens)
+
         contexts = self.option("contexts")
         if not contexts:
             return self._build_action_group(self._init_context)
@@ -107,6 +139,11 @@ class BaseGroupActor(base.BaseActor):
         # as is and do nothing to it.
         if isinstance(contexts, list):
             context_data = self.option("contexts")
+        # A JSON Lines or CSV file is read as the actors are executed, one
+        # context at a time. Only the actors for the first context are built
+        # up front, which is enough to make sure that the acts are sound.
+        elif self._streaming:
+            context_data = itertools.islice(self._read_contexts(), 1)
         # If the data passed in is a string, it must be a pointer to a file
         # with contexts in it. We read that file, and we parse it for any
         # missing tokens. We use the "init tokens" that made it into this actor
@@ -120,15 +157,48 @@ class BaseGroupActor(base.BaseActor):
 
         actions = []
         for context in context_data:
-            combined_context = {**self._init_context, **context}
-            self.log.debug(f"Inherited context {self._init_context}")
-            self.log.debug(f"Specified context {context}")
-            self.log.debug(f"Building acts with parameters: {combined_context}")
-            for action in self._build_action_group(context=combined_context):
-                actions.append(action)
+            actions.extend(self._build_context_group(context))
 
         return actions
 
+    @property
+    def _streaming(self):
+        """Whether our contexts are read from the file as we go."""
+        contexts = self.option("contexts")
+        return isinstance(contexts, str) and contexts.lower().endswith(
+            tuple(f".{s}" for s in kp_utils.STREAMING_SUFFIXES)
+        )
+
+    def _read_contexts(self):
+        """Reads the contexts of a JSON Lines or CSV file, one at a time."""
+        try:
+            yield from kp_utils.iter_records_with_tokens(
+                self.option("contexts"), self._init_tokens
+            )
+        except (kingpin_exceptions.InvalidScript, LookupError) as e:
+            raise exceptions.UnrecoverableActorFailure(e) from e
+
+    def _build_context_group(self, context):
+        """Builds the actors for a single context."""
+        combined_context = {**self._init_context, **context}
+        self.log.debug(f"Inherited context {self._init_context}")
+        self.log.debug(f"Specified context {context}")
+        self.log.debug(f"Building acts with parameters: {combined_context}")
+        return self._build_action_group(context=combined_context)
+
+    def _iter_actions(self):
+        """Yields the actors to execute, in order.
+
+        These are the actors built by ``__init__()``, followed -- if our
+        contexts are streamed from a file -- by the actors for every other
+        context in the file, built as they are asked for.
+        """
+        yield from self._actions
+        if not self._streaming:
+            return
+        for context in itertools.islice(self._read_contexts(), 1, None):
+            yield from self._build_context_group(context)
+
     def _build_action_group(self, context=None):
         """Build up all of the actors we need to execute.
 
@@ -145,6 +215,8 @@ class BaseGroupActor(base.BaseActor):
             act["init_context"] = context.copy()
             act["init_tokens"] = self._init_tokens.copy()
             actor = utils.get_actor(act, dry=self._dry)
+            actor._parent, actor._position = self, self._built
+            self._built += 1
             actions.append(actor)
             self.log.debug(f"Actor {actor} built")
         return actions
@@ -179,7 +251,10 @@ class BaseGroupActor(base.BaseActor):
         If an actor execution fails in ``_run_actions()``, then that exception
         is raised up the stack.
         """
-        self.log.info(f"Beginning {len(self._actions)} actions")
+        if self._streaming:
+            self.log.info(f"Beginning actions for each of {self.option('contexts')}")
+        else:
+            self.log.info(f"Beginning {len(self._actions)} actions")
         await self._run_actions()
         return
 
@@ -205,6 +280,13 @@ class Sync(BaseGroupActor):
             each item in the ``contexts`` list.
         * A string that points to a file with a list of contexts, just like the
             above dictionary format.
+        * A string that points to a JSON Lines (``.jsonl``, one context per
+            line) or CSV (``.csv``, one context per row, named by the header
+            row) file. These are read one context at a time, and the actors
+            for each context are built just before they are executed, so the
+            file can hold any number of contexts. Only the first context's
+            actors are built up front, so only they show up in the orgchart
+            and are checked by ``--build-only`` and ``--preflight``.
 
 
     **Timeouts**
@@ -299,8 +381,10 @@ class Sync(BaseGroupActor):
         """
 
         errors = []
+        count = 0
 
-        for act in self._actions:
+        for act in self._iter_actions():
+            count += 1
             self.log.debug(f'Beginning "{act._desc}"..')
             try:
                 await act.execute()
@@ -319,7 +403,7 @@ class Sync(BaseGroupActor):
         if errors:
             ExcType = self._get_exc_type(errors)
             raise ExcType(
-                f'Exceptions raised by {len(errors)} of {len(self._actions)} actors in "{self._desc}".'
+                f'Exceptions raised by {len(errors)} of {count} actors in "{self._desc}".'
             )
 
 
@@ -349,6 +433,13 @@ class Async(BaseGroupActor):
             each item in the ``contexts`` list.
         * A string that points to a file with a list of contexts, just like the
             above dictionary format.
+        * A string that points to a JSON Lines (``.jsonl``, one context per
+            line) or CSV (``.csv``, one context per row, named by the header
+            row) file. These are read one context at a time, and the actors
+            for each context are built just before they are executed, so the
+            file can hold any number of contexts. Only the first context's
+            actors are built up front, so only they show up in the orgchart
+            and are checked by ``--build-only`` and ``--preflight``.
 
     **Timeouts**
 
@@ -413,44 +504,58 @@ class Async(BaseGroupActor):
         failed (False).
         """
 
-        tasks = []
+        concurrency = self.option("concurrency")
+        if concurrency:
+            self.log.info(f"Concurrency set to {concurrency}")
 
-        if self.option("concurrency"):
-            self.log.info(f"Concurrency set to {self.option('concurrency')}")
-
-        for act in self._actions:
-            tasks.append(asyncio.ensure_future(act.execute()))
-
-            if not self.option("concurrency"):
-                # No concurrency limit - continue the loop without checks.
-                continue
-
-            running_tasks = len([t for t in tasks if not t.done()])
+        # Only the tasks that are still running are held on to, and (with a
+        # concurrency limit) the next actor isn't even built until there's
+        # room for it to run. A group streaming its contexts from a file never
+        # has more than `concurrency` of them in memory.
+        pending = set()
+        errors = []
+        count = 0
+
+        def reap(done):
+            # If they've raised an exception, we catch it and log it into a
+            # list for further processing.
+            for t in done:
+                try:
+                    t.result()
+                except exceptions.ActorException as e:
+                    errors.append(e)
 
-            if running_tasks < self.option("concurrency"):
-                # We can queue more tasks, continue the loop to add one more.
-                continue
+        try:
+            for act in self._iter_actions():
+                count += 1
+                pending.add(asyncio.ensure_future(act.execute()))
 
-            self.log.debug("Concurrency saturated. Waiting...")
-            while running_tasks >= self.option("concurrency"):
-                await asyncio.sleep(0)
-                running_tasks = len([t for t in tasks if not t.done()])
+                if not concurrency or len(pending) < concurrency:
+                    # We can queue more tasks, continue the loop to add one more.
+                    continue
 
-            self.log.debug(
-                "Concurrency desaturated: {}<{}. Continuing.".format(
-                    running_tasks, self.option("concurrency")
+                self.log.debug("Concurrency saturated. Waiting...")
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
                 )
-            )
-
-        # Now that we've fired them off, we walk through them one-by-one and
-        # check on their status. If they've raised an exception, we catch it
-        # and log it into a list for further processing.
-        errors = []
-        for t in tasks:
-            try:
-                await t
-            except exceptions.ActorException as e:
-                errors.append(e)
+                reap(done)
+                self.log.debug(
+                    f"Concurrency desaturated: {len(pending)}<{concurrency}. "
+                    "Continuing."
+                )
+        except BaseException:
+            # A context couldn't be read from the file (or we were cancelled).
+            # Stop the actors that are still running, and wait for them to
+            # wind down, rather than leave them running behind our back.
+            for t in pending:
+                t.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise
+
+        # Now that we've fired them off, wait for the rest of them to finish.
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            reap(done)
 
         # Now, if there are exceptions in the list, we generate the appropriate
         # exception type (recoverable vs unrecoverable), and raise it up the
@@ -460,5 +565,5 @@ class Async(BaseGroupActor):
         if errors:
             ExcType = self._get_exc_type(errors)
             raise ExcType(
-                f'Exceptions raised by {len(errors)} of {len(self._actions)} actors in "{self._desc}".'
+                f'Exceptions raised by {len(errors)} of {count} actors in "{self._desc}".'
             )
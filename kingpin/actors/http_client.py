@@ -0,0 +1,568 @@
+"""
+:mod:`kingpin.actors.http_client`
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+A small asyncio-native HTTP/1.1 client used by the
+:py:class:`~kingpin.actors.base.HTTPBaseActor`.
+
+Requests are written and read straight off of asyncio streams (with TLS for
+``https://`` URLs), so any number of them can be in flight on the event loop
+without tying up a thread each. Connections are kept alive and reused per host
+(scheme, host and port), and the number of requests in flight to any one host
+is bounded. Connect and read timeouts are applied separately.
+
+Like ``urllib.request.urlopen``, requests go through the proxies configured
+in the ``http_proxy``/``https_proxy`` environment variables (except for the
+hosts in ``no_proxy``), and send the same ``User-Agent`` header unless the
+caller supplies its own. Failures are reported exactly like ``urlopen``
+reports them: ``urllib.error.HTTPError`` for responses with an error status,
+and ``urllib.error.URLError`` when no response could be had at all.
+"""
+
+import asyncio
+import base64
+import email.utils
+import http.client
+import io
+import logging
+import random
+import ssl
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+log = logging.getLogger(__name__)
+
+# Redirects that are followed, like urllib does.
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+MAX_HEADERS = 100
+
+# The User-Agent that urllib sends, so that servers see no difference.
+USER_AGENT = "Python-urllib/{}.{}".format(*sys.version_info[:2])
+
+# Bytes read at a time from a response body that runs until the connection
+# is closed.
+READ_SIZE = 64 * 1024
+
+# Response statuses worth trying again, by default.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Errors that mean that a request failed, and its connection is unusable.
+CONNECTION_ERRORS = (
+    http.client.HTTPException,
+    OSError,
+    EOFError,
+    ValueError,
+    asyncio.LimitOverrunError,
+)
+
+
+class Response:
+    """A fully read HTTP response."""
+
+    def __init__(self, url: str, status: int, reason: str, headers, body: bytes):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class _Connection:
+    """A single HTTP/1.1 connection to a host.
+
+    Every read (and every wait for the write buffer to drain) on it is
+    limited to `read_timeout` seconds on its own.
+    """
+
+    def __init__(self, reader, writer, read_timeout):
+        self.reader = reader
+        self.writer = writer
+        self.read_timeout = read_timeout
+
+    def is_usable(self):
+        return not (self.reader.at_eof() or self.writer.is_closing())
+
+    def close(self):
+        self.writer.close()
+
+    async def drain(self):
+        async with asyncio.timeout(self.read_timeout):
+            await self.writer.drain()
+
+    async def readline(self):
+        async with asyncio.timeout(self.read_timeout):
+            return await self.reader.readline()
+
+    async def readexactly(self, size):
+        async with asyncio.timeout(self.read_timeout):
+            return await self.reader.readexactly(size)
+
+    async def read_until_eof(self):
+        chunks = []
+        while True:
+            async with asyncio.timeout(self.read_timeout):
+                chunk = await self.reader.read(READ_SIZE)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+
+class ConnectionPool:
+    """
+    Keeps HTTP connections alive between requests, per host.
+
+    Args:
+        max_per_host: Maximum concurrent requests (and so connections) to a
+            single host.
+        connect_timeout: Seconds to wait for a connection (and the TLS
+            handshake, or proxy tunnel) to be established.
+        read_timeout: Seconds to wait on any one read from an established
+            connection. A slow response as a whole may take longer, as long
+            as it keeps arriving.
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = 10,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+    ):
+        self.max_per_host = max_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.ssl_context = ssl.create_default_context()
+
+        # Connections and semaphores belong to an event loop, so they are
+        # thrown away if the loop changes.
+        self._loop = None
+
+        # (scheme, host, port, proxy) -> idle connections
+        self._idle = {}
+
+        # (scheme, host, port, proxy) -> asyncio.Semaphore
+        self._limits = {}
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        body: bytes | None = None,
+        headers: dict | None = None,
+    ) -> Response:
+        """Makes an HTTP request and reads the full response.
+
+        Redirects are followed.
+
+        Args:
+            method: The HTTP method
+            url: The full URL
+            body: Optional request body
+            headers: Optional dictionary of request headers
+
+        Raises:
+            urllib.error.HTTPError: The response had an error status.
+            urllib.error.URLError: The request failed.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            response = await self._request(method, url, body, headers or {})
+            location = response.headers.get("Location")
+            if response.status not in REDIRECT_CODES or not location:
+                break
+
+            # Like urllib, only a GET (or a POST turned into a GET) is
+            # redirected.
+            if method == "POST" and response.status in (301, 302, 303):
+                method, body = "GET", None
+            elif method not in ("GET", "HEAD"):
+                break
+            url = urllib.parse.urljoin(url, location)
+            log.debug(f"Following redirect to {url}")
+
+        if response.status >= 400 or response.status in REDIRECT_CODES:
+            raise urllib.error.HTTPError(
+                url,
+                response.status,
+                response.reason,
+                response.headers,
+                io.BytesIO(response.body),
+            )
+
+        return response
+
+    async def _request(self, method, url, body, headers):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in DEFAULT_PORTS:
+            raise urllib.error.URLError(f"unknown url type: {parsed.scheme}")
+        if not parsed.hostname:
+            raise urllib.error.URLError(f"no host given: {url}")
+
+        port = parsed.port or DEFAULT_PORTS[parsed.scheme]
+        proxy = self._get_proxy(parsed.scheme, parsed.hostname)
+        key = (parsed.scheme, parsed.hostname, port, proxy and proxy.netloc)
+
+        path = urllib.parse.urlunsplit(("", "", parsed.path or "/", parsed.query, ""))
+        if proxy and parsed.scheme == "http":
+            # Plain HTTP goes to the proxy, which is asked for the full URL.
+            path = urllib.parse.urlunsplit(parsed._replace(fragment=""))
+        request = self._build_request(method, parsed, path, body, headers, proxy)
+
+        self._check_loop()
+        if key not in self._limits:
+            self._limits[key] = asyncio.Semaphore(self.max_per_host)
+
+        async with self._limits[key]:
+            # A kept-alive connection may have been closed by the server since
+            # we last used it. If so, try once more on a fresh connection.
+            conn, reused = await self._checkout(key, proxy)
+            try:
+                return await self._send(conn, key, url, method, request)
+            except CONNECTION_ERRORS as e:
+                stale = isinstance(e, (ConnectionResetError, BrokenPipeError))
+                if not reused or not stale:
+                    raise urllib.error.URLError(e) from e
+
+            conn, _ = await self._checkout(key, proxy, fresh=True)
+            try:
+                return await self._send(conn, key, url, method, request)
+            except CONNECTION_ERRORS as e:
+                raise urllib.error.URLError(e) from e
+
+    def _get_proxy(self, scheme, host):
+        """Returns the (split) URL of the proxy to use for a host, if any."""
+        proxy = urllib.request.getproxies().get(scheme)
+        if not proxy or urllib.request.proxy_bypass(host):
+            return None
+        if "://" not in proxy:
+            proxy = f"http://{proxy}"
+        return urllib.parse.urlsplit(proxy)
+
+    def _build_request(self, method, parsed, path, body, headers, proxy=None):
+        host = parsed.hostname
+        if ":" in host:
+            host = f"[{host}]"
+        if parsed.port:
+            host = f"{host}:{parsed.port}"
+
+        all_headers = {
+            "Host": host,
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "identity",
+        }
+        if proxy and parsed.scheme == "http":
+            all_headers.update(self._proxy_headers(proxy))
+        for k, v in headers.items():
+            # Header names are case insensitive, so the caller's replace ours
+            # whatever their case.
+            for existing in [h for h in all_headers if h.lower() == k.lower()]:
+                del all_headers[existing]
+            all_headers[k] = v
+        if body is not None or method in ("POST", "PUT", "PATCH"):
+            all_headers["Content-Length"] = str(len(body or b""))
+
+        return self._encode_head(f"{method} {path} HTTP/1.1", all_headers) + (
+            body or b""
+        )
+
+    def _proxy_headers(self, proxy):
+        if proxy.username is None:
+            return {}
+        credentials = ":".join(
+            urllib.parse.unquote(v) for v in (proxy.username, proxy.password or "")
+        )
+        token = base64.b64encode(credentials.encode()).decode()
+        return {"Proxy-Authorization": f"Basic {token}"}
+
+    def _encode_head(self, request_line, headers):
+        lines = [request_line]
+        for k, v in headers.items():
+            line = f"{k}: {v}"
+            if "\r" in line or "\n" in line:
+                raise ValueError(f"Invalid header {k!r}: {v!r}")
+            lines.append(line)
+        return "\r\n".join(lines).encode("latin-1") + b"\r\n\r\n"
+
+    async def _send(self, conn, key, url, method, request):
+        try:
+            conn.writer.write(request)
+            await conn.drain()
+            status, reason, version, headers = await self._read_head(conn)
+            body, framed = await self._read_body(conn, method, status, headers)
+        except BaseException:
+            # Whatever happened, the connection is now in an unknown state.
+            conn.close()
+            raise
+
+        connection = headers.get("Connection", "").lower()
+        keep_alive = "keep-alive" in connection if version == 10 else True
+        if "close" in connection or not framed:
+            keep_alive = False
+
+        if keep_alive:
+            self._checkin(key, conn)
+        else:
+            conn.close()
+
+        return Response(url, status, reason, headers, body)
+
+    async def _read_head(self, conn):
+        # Skip over any informational (1xx) responses.
+        while True:
+            line = await conn.readline()
+            if not line:
+                raise http.client.RemoteDisconnected(
+                    "Remote end closed connection without response"
+                )
+            try:
+                version, status, *reason = line.decode("latin-1").split(None, 2)
+                status = int(status)
+            except ValueError as e:
+                raise http.client.BadStatusLine(line) from e
+            if not version.startswith("HTTP/1."):
+                raise http.client.BadStatusLine(line)
+
+            lines = []
+            while (header := await conn.readline()) not in (b"\r\n", b"\n", b""):
+                lines.append(header)
+                if len(lines) > MAX_HEADERS:
+                    raise http.client.HTTPException(
+                        f"got more than {MAX_HEADERS} headers"
+                    )
+            headers = http.client.parse_headers(io.BytesIO(b"".join(lines) + b"\r\n"))
+            if status >= 200:
+                reason = reason[0].strip() if reason else ""
+                return status, reason, 10 if version == "HTTP/1.0" else 11, headers
+
+    async def _read_body(self, conn, method, status, headers):
+        """Reads the response body.
+
+        Returns:
+            The body, and whether its end was marked by the response itself.
+            If not, the body ran to the end of the connection, which can then
+            not be reused.
+        """
+        if method == "HEAD" or status in (204, 304):
+            return b"", True
+
+        if "chunked" in headers.get("Transfer-Encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await conn.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Throw away any trailers
+                    while (await conn.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks), True
+                chunks.append(await conn.readexactly(size))
+                await conn.readexactly(2)
+
+        length = headers.get("Content-Length")
+        if length is not None:
+            return await conn.readexactly(int(length)), True
+
+        return await conn.read_until_eof(), False
+
+    async def _checkout(self, key, proxy=None, fresh=False):
+        idle = self._idle.get(key, [])
+        while idle and not fresh:
+            conn = idle.pop()
+            if conn.is_usable():
+                return conn, True
+            conn.close()
+
+        scheme, host, port, _ = key
+        ssl_context = self.ssl_context if scheme == "https" else None
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                if proxy is None:
+                    reader, writer = await asyncio.open_connection(
+                        host,
+                        port,
+                        ssl=ssl_context,
+                        server_hostname=host if ssl_context else None,
+                    )
+                    return _Connection(reader, writer, self.read_timeout), False
+
+                reader, writer = await asyncio.open_connection(
+                    proxy.hostname, proxy.port or DEFAULT_PORTS["http"]
+                )
+                conn = _Connection(reader, writer, self.read_timeout)
+                if ssl_context:
+                    await self._tunnel(conn, host, port, proxy, ssl_context)
+                return conn, False
+        except CONNECTION_ERRORS as e:
+            raise urllib.error.URLError(e) from e
+
+    async def _tunnel(self, conn, host, port, proxy, ssl_context):
+        """Has the proxy open a tunnel to the host, and starts TLS through it."""
+        address = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+        headers = {"Host": address, **self._proxy_headers(proxy)}
+        try:
+            conn.writer.write(self._encode_head(f"CONNECT {address} HTTP/1.1", headers))
+            await conn.drain()
+            status, reason, _, _ = await self._read_head(conn)
+            if status != 200:
+                raise OSError(f"Tunnel connection failed: {status} {reason}")
+            await conn.writer.start_tls(ssl_context, server_hostname=host)
+        except BaseException:
+            conn.close()
+            raise
+
+    def _checkin(self, key, conn):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.max_per_host:
+            idle.append(conn)
+        else:
+            conn.close()
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Connections from a previous (now likely closed) loop can't be
+            # used. Just forget about them.
+            self._loop = loop
+            self._idle = {}
+            self._limits = {}
+
+    def close(self) -> None:
+        """Closes all of the idle connections."""
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class CircuitOpenError(urllib.error.URLError):
+    """Raised instead of making a request to a host that keeps failing."""
+
+
+class RetryPolicy:
+    """
+    Decides whether, and when, a failed HTTP request is tried again.
+
+    Requests that could not be made at all (connection failures, timeouts)
+    and responses with one of the `statuses` are retried, with an exponential
+    backoff and full jitter between the attempts. If the server sent a
+    ``Retry-After`` header, it is honored instead.
+
+    Args:
+        max_attempts: Total number of attempts, including the first one.
+        backoff: Base delay (in seconds) before the first retry. It doubles
+            with every further attempt.
+        max_backoff: Upper limit (in seconds) of any one delay.
+        statuses: Response statuses that are retried.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 1,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        statuses: tuple = RETRY_STATUSES,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Returns whether the request that raised `error` may succeed later."""
+        if isinstance(error, CircuitOpenError):
+            return False
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code in self.statuses
+        return isinstance(error, urllib.error.URLError)
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """Returns how long to wait after failed attempt number `attempt`."""
+        retry_after = self._retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+
+        ceiling = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def _retry_after(self, error):
+        if not isinstance(error, urllib.error.HTTPError) or not error.headers:
+            return None
+
+        value = error.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, when.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to hosts that keep failing.
+
+    After `threshold` consecutive failures, a host's circuit "opens" and
+    every request to it fails right away with a
+    :py:exc:`CircuitOpenError`, rather than tying up a connection slot (and
+    a retry loop) on a dead endpoint. After `reset_timeout` seconds a single
+    trial request is let through; if it succeeds the circuit closes again,
+    otherwise it stays open for another `reset_timeout`.
+
+    A `threshold` of 0 disables the breaker.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        # host -> number of consecutive failures
+        self._failures = {}
+
+        # host -> time.monotonic() at which the circuit was (re)opened
+        self._opened = {}
+
+    def check(self, url: str) -> None:
+        """Raises CircuitOpenError if requests to `url` should not be made."""
+        host = self._host(url)
+        opened = self._opened.get(host)
+        if opened is None:
+            return
+
+        now = time.monotonic()
+        if now - opened < self.reset_timeout:
+            raise CircuitOpenError(
+                f"Too many failed requests to {host}, not trying again for "
+                f"{self.reset_timeout - (now - opened):.0f}s"
+            )
+
+        # Let this one request through as a trial, but keep everyone else
+        # out until we know how it went.
+        self._opened[host] = now
+
+    def success(self, url: str) -> None:
+        host = self._host(url)
+        self._failures.pop(host, None)
+        self._opened.pop(host, None)
+
+    def failure(self, url: str) -> None:
+        if not self.threshold:
+            return
+
+        host = self._host(url)
+        self._failures[host] = self._failures.get(host, 0) + 1
+        if self._failures[host] >= self.threshold:
+            if host not in self._opened:
+                log.warning(f"Too many failed requests to {host}, backing off")
+            self._opened[host] = time.monotonic()
+
+    def _host(self, url):
+        return urllib.parse.urlsplit(url).netloc
@@ -0,0 +1,131 @@
+"""
+:mod:`kingpin.actors.journal`
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+A record of the actors that have finished successfully, so that a run that
+died part of the way through can be resumed where it left off.
+
+The journal is a JSON Lines file with one entry per actor that completed
+successfully, written (and flushed to disk) as each one finishes. An actor is
+identified by its position in the tree of actors (see
+:py:attr:`~kingpin.actors.base.BaseActor._tree_path`) and a hash of its class,
+its options and the contents of any files it read (see
+:py:meth:`~kingpin.actors.base.BaseActor.journal_fingerprint`). When a run is
+resumed from a journal, actors with an entry in it are skipped -- as long as
+they haven't been moved, and neither their options nor their files have
+changed since.
+
+Only the actors that do the actual work are recorded: group actors and
+Macros are always executed, and skip the actors inside of them that have
+already completed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+# Where the journal is written when the --journal flag is not given a path.
+DEFAULT_JOURNAL = ".kingpin.journal"
+
+
+class RunJournal:
+    """Records (and remembers) which actors finished successfully.
+
+    Does nothing until :py:meth:`open` is called.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._file = None
+
+        # (tree path, config hash) of the actors completed by previous runs
+        self._completed = set()
+
+    def open(self, path: str, resume: bool = False) -> None:
+        """Starts recording completed actors to a journal file.
+
+        Args:
+            path: Path of the journal file.
+            resume: Skip the actors that the journal already holds. Otherwise
+                the journal is started afresh.
+        """
+        self.close()
+        self._completed = set()
+
+        if resume:
+            self._completed = self._read(path)
+            log.info(
+                f"Resuming from {path}: {len(self._completed)} actors have "
+                f"already completed"
+            )
+
+        self.path = path
+        self._file = open(path, "a" if resume else "w")
+
+    def close(self) -> None:
+        """Stops recording."""
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self.path = None
+        self._completed = set()
+
+    def completed(self, actor) -> bool:
+        """Whether an actor completed successfully in a previous run."""
+        if not self._completed or not actor.journaled:
+            return False
+        return self.key(actor) in self._completed
+
+    def record(self, actor) -> None:
+        """Records an actor as having completed successfully.
+
+        Dry runs are never recorded.
+        """
+        if self._file is None or actor._dry or not actor.journaled:
+            return
+
+        path, config_hash = self.key(actor)
+        entry = {
+            "path": path,
+            "hash": config_hash,
+            "actor": actor._type,
+            "desc": str(actor._desc),
+            "finished": time.time(),
+        }
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    @staticmethod
+    def key(actor) -> tuple[str, str]:
+        """Returns the (tree path, config hash) that identify an actor."""
+        config = json.dumps(
+            [actor._type, actor._options, actor.journal_fingerprint()],
+            sort_keys=True,
+            default=str,
+        )
+        return actor._tree_path, hashlib.sha256(config.encode()).hexdigest()
+
+    @staticmethod
+    def _read(path):
+        completed = set()
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        completed.add((entry["path"], entry["hash"]))
+                    except (ValueError, KeyError, TypeError):
+                        # Most likely the last line, cut short when the
+                        # previous run died.
+                        log.debug(f"Ignoring journal entry: {line!r}")
+        except FileNotFoundError:
+            log.warning(f"No journal found at {path}, starting from scratch")
+        return completed
+
+
+JOURNAL = RunJournal()
@@ -0,0 +1,419 @@
+"""
+:mod:`kingpin.actors.macro_loader`
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+Loading of the scripts that :py:class:`~kingpin.actors.misc.Macro` actors
+point to.
+
+Remote (``http://`` and ``https://``) macros are downloaded once per process,
+however many Macro actors (or dry and real runs) refer to them, and are kept
+in an on-disk cache between runs. A cached macro is only downloaded again if
+the server says it has changed, by way of a conditional GET with the
+``ETag`` and ``Last-Modified`` headers it sent the last time.
+
+The cache lives in ``~/.cache/kingpin/macros`` by default. Set the
+``KINGPIN_MACRO_CACHE_DIR`` environment variable to move it, or to an empty
+string to turn it off.
+
+Scripts are also parsed ahead of time. As soon as a group actor knows which
+Macro actors it is about to build, their scripts are read, have their tokens
+swapped in and are parsed in a pool of worker processes -- and so are the
+scripts *those* scripts point to, all the way down the tree. The actors are
+still built one by one, in order, from the parsed results; a script that
+could not be parsed ahead of time is simply parsed again when its actor is
+built, so that any error is raised by that actor, exactly as it would have
+been. Set ``KINGPIN_MACRO_PARSE_WORKERS`` to the number of worker processes
+to use, or to ``0`` to parse every script in-process, as it is needed.
+
+Starting worker processes isn't free, so a group only has its scripts parsed
+ahead of time if it has at least ``KINGPIN_MACRO_PARSE_THRESHOLD`` (default 4)
+of them. The workers are shut down again as soon as there is nothing left for
+them to parse.
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+import urllib.parse
+
+from kingpin import utils
+from kingpin.actors import base, http_client
+
+log = logging.getLogger(__name__)
+
+MACRO_CACHE_DIR = os.getenv(
+    "KINGPIN_MACRO_CACHE_DIR", os.path.expanduser("~/.cache/kingpin/macros")
+)
+
+MACRO_PARSE_WORKERS = int(
+    os.getenv("KINGPIN_MACRO_PARSE_WORKERS", min(4, os.cpu_count() or 1))
+)
+
+MACRO_PARSE_THRESHOLD = int(os.getenv("KINGPIN_MACRO_PARSE_THRESHOLD", 4))
+
+REMOTE = ("http://", "https://")
+
+MACRO_ACTORS = ("misc.Macro", "kingpin.actors.misc.Macro")
+
+
+class _RemoteMacroCache:
+    """Downloads remote macros, each one at most once per process.
+
+    Macros are built synchronously (in the actors' constructors), while the
+    downloads themselves are asynchronous. So the downloads run on an event
+    loop of their own, in a background thread: any number of them can be in
+    flight at once, and concurrent requests for the same URL share a single
+    download.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+
+        # url -> concurrent.futures.Future of the macro contents
+        self._futures = {}
+
+        # Created on the background loop, which its connections belong to.
+        self._pool = None
+
+    def get(self, url: str) -> str:
+        """Returns the contents of a remote macro, downloading it if needed.
+
+        Raises:
+            urllib.error.URLError: If the macro could not be downloaded.
+        """
+        future = self._submit(url)
+        try:
+            return future.result()
+        except Exception:
+            # Don't remember failures; the next caller gets to try again.
+            with self._lock:
+                if self._futures.get(url) is future:
+                    del self._futures[url]
+            raise
+
+    async def fetch(self, url: str) -> str:
+        """Async version of :py:meth:`get`."""
+        return await asyncio.wrap_future(self._submit(url))
+
+    def prefetch(self, urls) -> None:
+        """Starts downloading a number of macros, without waiting on them."""
+        for url in urls:
+            self._submit(url)
+
+    def _submit(self, url):
+        with self._lock:
+            if url not in self._futures:
+                self._futures[url] = asyncio.run_coroutine_threadsafe(
+                    self._download(url), self._get_loop()
+                )
+            return self._futures[url]
+
+    def _get_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=self._loop.run_forever, name="macro-loader", daemon=True
+            ).start()
+        return self._loop
+
+    async def _download(self, url):
+        if self._pool is None:
+            self._pool = http_client.ConnectionPool(
+                max_per_host=base.HTTP_MAX_CONNECTIONS_PER_HOST,
+                connect_timeout=base.HTTP_CONNECT_TIMEOUT,
+                read_timeout=base.HTTP_READ_TIMEOUT,
+            )
+
+        meta, body = self._read_cache(url)
+        headers = {}
+        if body is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        log.debug(f"Downloading {url}")
+        response = await self._pool.request("GET", url, headers=headers)
+        if response.status == 304 and body is not None:
+            log.debug(f"{url} has not changed, using the cached copy")
+            return body
+
+        body = response.body.decode("utf-8")
+        self._write_cache(
+            url,
+            {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            },
+            body,
+        )
+        return body
+
+    def _cache_path(self, url):
+        if not MACRO_CACHE_DIR:
+            return None
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(MACRO_CACHE_DIR, name)
+
+    def _read_cache(self, url):
+        path = self._cache_path(url)
+        if path is None:
+            return {}, None
+        try:
+            with open(f"{path}.json") as f:
+                meta = json.load(f)
+            with open(f"{path}.body", encoding="utf-8") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return {}, None
+
+    def _write_cache(self, url, meta, body):
+        path = self._cache_path(url)
+        if path is None or not (meta["etag"] or meta["last_modified"]):
+            return
+        try:
+            os.makedirs(MACRO_CACHE_DIR, exist_ok=True)
+            # Write the body first, so that the metadata never points at a
+            # stale one.
+            for suffix, data in ((".body", body), (".json", json.dumps(meta))):
+                with open(f"{path}{suffix}.tmp", "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(f"{path}{suffix}.tmp", f"{path}{suffix}")
+        except OSError as e:
+            log.warning(f"Unable to cache {url} in {MACRO_CACHE_DIR}: {e}")
+
+
+REMOTE_MACROS = _RemoteMacroCache()
+
+
+def _find_macros(config, tokens):
+    """Yields the Macro actors that building an actor config will create.
+
+    Walks down through group actors, but not into the Macro actors themselves:
+    their scripts have yet to be parsed.
+
+    Macro actors whose options still hold a ``{context}`` value are skipped,
+    since their final options aren't known until their group builds them.
+
+    Args:
+        config: An actor config dictionary, or a list of them.
+        tokens: The init tokens that the config's actor will be given.
+
+    Yields:
+        (macro, tokens) tuples: The script and the init tokens of each Macro.
+    """
+    if isinstance(config, list):
+        for act in config:
+            yield from _find_macros(act, tokens)
+        return
+
+    if not isinstance(config, dict) or not isinstance(config.get("options"), dict):
+        return
+
+    options = config["options"]
+    if config.get("actor") in MACRO_ACTORS:
+        macro = options.get("macro")
+        macro_tokens = options.get("tokens", {})
+        if not isinstance(macro, str) or not isinstance(macro_tokens, dict):
+            return
+        values = (macro, *macro_tokens.values())
+        if any("{" in v for v in values if isinstance(v, str)):
+            return
+        yield macro, {**tokens, **macro_tokens}
+    elif isinstance(options.get("acts"), list):
+        yield from _find_macros(options["acts"], tokens)
+
+
+def _parse_script(name, contents, tokens):
+    """Parses a script in a worker process.
+
+    Args:
+        name: Path to the script. Its suffix decides how it's parsed.
+        contents: The script itself, or None to read it from `name`.
+        tokens: Tokens to swap into the script.
+
+    Returns:
+        The pickled script, and the (macro, tokens) of the Macro actors that
+        it will create.
+    """
+    if contents is not None:
+        script = io.StringIO(contents)
+        script.name = name
+    else:
+        script = name
+    config = utils.load_json_with_tokens(file_path=script, tokens=tokens)
+
+    # A script that holds a list of actors is built into a group.Sync that
+    # isn't handed any init tokens, so there's no telling ahead of time what
+    # tokens its Macro actors will end up with. Leave them to the group.
+    children = [] if isinstance(config, list) else list(_find_macros(config, tokens))
+    return pickle.dumps(config), children
+
+
+class _ScriptCache:
+    """Parses macro scripts ahead of time, in a pool of worker processes.
+
+    Parsed scripts are remembered by their path (and, for local scripts,
+    their modification time and size) and the tokens they were parsed with,
+    for the life of the process. So the real run reuses the parsing done for
+    the dry run, unless a script was changed in between. Each caller gets its
+    own copy of the parsed script, which is free to modify.
+
+    The pool of worker processes is started when there is work for it, and
+    shut down once every script submitted to it has been parsed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+
+        # Number of scripts submitted that are yet to be parsed.
+        self._pending = 0
+
+        # (macro, version, tokens digest) -> concurrent.futures.Future of the
+        # result of _parse_script()
+        self._futures = {}
+
+    def get(self, macro: str, tokens: dict) -> dict | list | None:
+        """Returns a script that was parsed ahead of time.
+
+        Waits for the script to finish parsing if need be.
+
+        Args:
+            macro: Path or URL of the script.
+            tokens: Tokens that the script is to be parsed with.
+
+        Returns:
+            The parsed script, or None if it wasn't parsed ahead of time (or
+            it failed to parse, in which case the caller should try again
+            itself, and deal with the error).
+        """
+        future = self._futures.get(self._key(macro, tokens))
+        if future is None:
+            return None
+        try:
+            pickled, _ = future.result()
+        except Exception as e:
+            log.debug(f"Parsing {macro} ahead of time failed: {e}")
+            return None
+        return pickle.loads(pickled)
+
+    def prefetch(self, macros) -> None:
+        """Starts parsing a number of scripts, without waiting on them.
+
+        Only done if there are at least `MACRO_PARSE_THRESHOLD` scripts;
+        fewer than that are quicker parsed by their actors as they are built.
+
+        Args:
+            macros: (macro, tokens) tuples.
+        """
+        macros = list(macros)
+        if not MACRO_PARSE_WORKERS or len(macros) < MACRO_PARSE_THRESHOLD:
+            return
+        for macro, tokens in macros:
+            self._submit(macro, tokens)
+
+    def _key(self, macro, tokens):
+        dump = json.dumps(tokens, sort_keys=True, default=str)
+        return macro, self._version(macro), hashlib.sha256(dump.encode()).hexdigest()
+
+    def _version(self, macro):
+        # A local script that has changed since it was parsed must be parsed
+        # again.
+        if macro.startswith(REMOTE):
+            return None
+        try:
+            stat = os.stat(macro)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _submit(self, macro, tokens):
+        key = self._key(macro, tokens)
+        with self._lock:
+            if key in self._futures:
+                return
+            future = self._futures[key] = concurrent.futures.Future()
+            self._pending += 1
+        future.add_done_callback(self._settled)
+
+        if not macro.startswith(REMOTE):
+            self._parse(future, macro, None, tokens)
+            return
+
+        def downloaded(download):
+            try:
+                contents = download.result()
+            except Exception as e:
+                future.set_exception(e)
+                return
+            name = urllib.parse.urlparse(macro).path
+            self._parse(future, name, contents, tokens)
+
+        REMOTE_MACROS._submit(macro).add_done_callback(downloaded)
+
+    def _parse(self, future, name, contents, tokens):
+        try:
+            work = self._get_pool().submit(_parse_script, name, contents, tokens)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        work.add_done_callback(lambda work: self._parsed(future, work))
+
+    def _parsed(self, future, work):
+        try:
+            result = work.result()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        # Submit the scripts this one points to first, so that the pool isn't
+        # shut down only to be started again for them.
+        self.prefetch(result[1])
+        future.set_result(result)
+
+    def _settled(self, future):
+        with self._lock:
+            self._pending -= 1
+            if self._pending or self._pool is None:
+                return
+            pool, self._pool = self._pool, None
+        pool.shutdown(wait=False)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Not forked: the parent has threads of its own (this one,
+                # for a start), and forking those is asking for deadlocks.
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=MACRO_PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+
+SCRIPTS = _ScriptCache()
+
+
+def prefetch(acts: list, tokens: dict) -> None:
+    """Starts loading the scripts of the Macro actors in a list of actors.
+
+    Group actors call this before building their actors, so that sibling
+    Macro actors download and parse their scripts in parallel rather than one
+    by one.
+
+    Args:
+        acts: List of actor configuration dictionaries.
+        tokens: The init tokens that the actors will be given.
+    """
+    macros = list(_find_macros(acts, tokens))
+    REMOTE_MACROS.prefetch(sorted({m for m, _ in macros if m.startswith(REMOTE)}))
+    SCRIPTS.prefetch(macros)
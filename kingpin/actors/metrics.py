@@ -0,0 +1,340 @@
+"""
+:mod:`kingpin.actors.metrics`
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+Live metrics about a run, for watching it while it happens.
+
+Kingpin reports:
+
+* ``actors.running``: Actors executing right now (a gauge), and
+  ``actors.completed``, ``actors.warned`` and ``actors.failed``: actors that
+  have finished (counters). All of them by actor ``class``, and whether it's a
+  ``dry`` run.
+* ``api_queue.depth`` and ``api_queue.delay``: The number of calls waiting in
+  each serialized AWS API call ``queue``, and the current delay (in seconds)
+  between its calls. ``api_queue.throttles`` counts the calls that AWS
+  throttled.
+* ``executor.in_flight`` and ``executor.saturation``: Calls handed to each
+  thread pool ``executor`` that haven't finished yet, as a number and as a
+  fraction of its threads. A saturation over 1 means calls are waiting for a
+  thread.
+* ``poll.iterations``: Times that actors (by ``class``) have checked on a
+  resource that they are waiting on.
+
+Metrics are sent to wherever the ``KINGPIN_METRICS`` environment variable (or
+the ``--metrics`` flag) says:
+
+* ``statsd://host:port``: A StatsD server, over UDP, with the labels sent as
+  DogStatsD style tags.
+* ``prometheus:///path/to/kingpin.prom``: A file in the Prometheus text
+  format, for the node exporter's textfile collector.
+* ``prometheus://host:port``: An HTTP server, for Prometheus to scrape.
+
+By default, metrics go nowhere.
+"""
+
+import collections
+import contextlib
+import http.server
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.parse
+
+log = logging.getLogger(__name__)
+
+KINGPIN_METRICS = os.getenv("KINGPIN_METRICS", "")
+
+STATSD_PORT = 8125
+
+# Minimum number of seconds between rewrites of a Prometheus textfile.
+TEXTFILE_INTERVAL = 1.0
+
+
+class NullExporter:
+    """Sends metrics nowhere. The base class of every exporter."""
+
+    def increment(self, name: str, value: int = 1, labels: dict | None = None) -> None:
+        """Adds `value` to a counter."""
+
+    def gauge(self, name: str, value: float, labels: dict | None = None) -> None:
+        """Sets a gauge to `value`."""
+
+    def close(self) -> None:
+        """Sends off anything not yet sent, and releases any resources."""
+
+
+class StatsdExporter(NullExporter):
+    """Sends metrics to a StatsD server, over UDP.
+
+    Each metric is sent as soon as it's recorded. Labels are sent as
+    DogStatsD style tags (``|#key:value``). Nothing is done if the server
+    can't be reached -- that's UDP for you.
+
+    Args:
+        host: Host name or address of the StatsD server.
+        port: Port of the StatsD server.
+        prefix: Prefix of every metric name.
+    """
+
+    def __init__(self, host: str, port: int = STATSD_PORT, prefix: str = "kingpin"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def increment(self, name, value=1, labels=None):
+        self._send(name, value, "c", labels)
+
+    def gauge(self, name, value, labels=None):
+        self._send(name, value, "g", labels)
+
+    def close(self):
+        self._socket.close()
+
+    def _send(self, name, value, kind, labels):
+        line = f"{self.prefix}.{name}:{_format(value)}|{kind}"
+        if labels:
+            line += "|#" + ",".join(f"{k}:{v}" for k, v in sorted(labels.items()))
+        try:
+            self._socket.sendto(line.encode(), self.address)
+        except OSError as e:
+            log.debug(f"Unable to send metric to {self.address}: {e}")
+
+
+class PrometheusExporter(NullExporter):
+    """Keeps metrics in memory, for Prometheus.
+
+    The metrics are written to a file in the Prometheus text format (for the
+    node exporter's textfile collector), served over HTTP (for Prometheus to
+    scrape), or both. The file is rewritten at most every
+    ``TEXTFILE_INTERVAL`` seconds while metrics are being recorded, and once
+    more when the exporter is closed.
+
+    Args:
+        path: Path of the file to write the metrics into.
+        address: (host, port) to serve the metrics on. Port 0 picks a free
+            port; see `url` for the one that was picked.
+        prefix: Prefix of every metric name.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        address: tuple | None = None,
+        prefix: str = "kingpin",
+    ):
+        self.path = path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)
+        self._gauges = {}
+        self._written = 0.0
+
+        self._server = None
+        self.url = None
+        if address is not None:
+            self._serve(address)
+
+    def increment(self, name, value=1, labels=None):
+        with self._lock:
+            self._counters[(name, _labels(labels))] += value
+        self._maybe_write()
+
+    def gauge(self, name, value, labels=None):
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+        self._maybe_write()
+
+    def close(self):
+        if self.path:
+            self._write()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def render(self) -> str:
+        """Returns the metrics, in the Prometheus text format."""
+        with self._lock:
+            metrics = [
+                (f"{name}_total", "counter", labels, value)
+                for (name, labels), value in self._counters.items()
+            ] + [
+                (name, "gauge", labels, value)
+                for (name, labels), value in self._gauges.items()
+            ]
+
+        lines = []
+        typed = set()
+        for name, kind, labels, value in sorted(metrics):
+            name = f"{self.prefix}_{name}".replace(".", "_")
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+            if labels:
+                pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                name = f"{name}{{{pairs}}}"
+            lines.append(f"{name} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _maybe_write(self):
+        if self.path and time.monotonic() - self._written >= TEXTFILE_INTERVAL:
+            self._write()
+
+    def _write(self):
+        self._written = time.monotonic()
+        # Written aside and moved into place, so that the collector never
+        # reads half a file.
+        try:
+            with open(f"{self.path}.tmp", "w") as f:
+                f.write(self.render())
+            os.replace(f"{self.path}.tmp", self.path)
+        except OSError as e:
+            log.warning(f"Unable to write metrics into {self.path}: {e}")
+
+    def _serve(self, address):
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = http.server.ThreadingHTTPServer(address, Handler)
+        host, port = self._server.server_address[:2]
+        self.url = f"http://{host}:{port}/metrics"
+        threading.Thread(
+            target=self._server.serve_forever, name="kingpin-metrics", daemon=True
+        ).start()
+        log.info(f"Serving metrics on {self.url}")
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(round(value, 6))
+    return str(int(value))
+
+
+METRICS = NullExporter()
+
+
+def configure(url: str) -> NullExporter:
+    """Sets up the exporter that metrics are sent to, from a URL.
+
+    Args:
+        url: ``statsd://host:port``, ``prometheus:///path/to/file`` or
+            ``prometheus://host:port``. Anything false sends metrics nowhere.
+
+    Raises:
+        ValueError: If the URL isn't one of the above.
+
+    Returns:
+        The new exporter.
+    """
+    global METRICS
+
+    parsed = urllib.parse.urlparse(url or "")
+    if not url:
+        exporter = NullExporter()
+    elif parsed.scheme == "statsd" and parsed.hostname:
+        exporter = StatsdExporter(parsed.hostname, parsed.port or STATSD_PORT)
+    elif parsed.scheme == "prometheus" and not parsed.netloc and parsed.path:
+        exporter = PrometheusExporter(path=parsed.path)
+    elif parsed.scheme == "prometheus" and parsed.port is not None:
+        exporter = PrometheusExporter(address=(parsed.hostname or "", parsed.port))
+    else:
+        raise ValueError(f"Invalid metrics URL: {url}")
+
+    METRICS.close()
+    METRICS = exporter
+    return exporter
+
+
+class _Execution:
+    """The outcome of an actor's execution, as far as metrics are concerned."""
+
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = None
+
+
+# Actors executing right now, by their labels.
+_RUNNING = collections.Counter()
+
+
+@contextlib.contextmanager
+def measure(actor):
+    """Counts the execution of an actor, for the duration of the block.
+
+    Yields:
+        An object whose ``status`` the caller sets to ``"warned"`` if the
+        actor failed, but only warned about it.
+    """
+    labels = {"class": actor.__class__.__name__, "dry": str(actor._dry).lower()}
+    key = _labels(labels)
+    _RUNNING[key] += 1
+    METRICS.gauge("actors.running", _RUNNING[key], labels)
+
+    execution = _Execution()
+    try:
+        yield execution
+    except BaseException:
+        METRICS.increment("actors.failed", labels=labels)
+        raise
+    else:
+        if execution.status == "warned":
+            METRICS.increment("actors.warned", labels=labels)
+        else:
+            METRICS.increment("actors.completed", labels=labels)
+    finally:
+        _RUNNING[key] -= 1
+        METRICS.gauge("actors.running", _RUNNING[key], labels)
+
+
+# Calls handed to each executor that haven't finished yet.
+_IN_FLIGHT = collections.Counter()
+
+
+@contextlib.contextmanager
+def executor_call(executor):
+    """Counts a call handed to a thread pool, for the duration of the block."""
+    name = getattr(executor, "_thread_name_prefix", None) or "executor"
+    _IN_FLIGHT[name] += 1
+    try:
+        _report_executor(executor, name)
+        yield
+    finally:
+        _IN_FLIGHT[name] -= 1
+        _report_executor(executor, name)
+
+
+def _report_executor(executor, name):
+    labels = {"executor": name}
+    METRICS.gauge("executor.in_flight", _IN_FLIGHT[name], labels)
+    size = getattr(executor, "_max_workers", None)
+    if size:
+        METRICS.gauge("executor.saturation", _IN_FLIGHT[name] / size, labels)
+
+
+def poll(actor) -> None:
+    """Counts one check on a resource that an actor is waiting on."""
+    METRICS.increment("poll.iterations", labels={"class": actor.__class__.__name__})
@@ -16,17 +16,22 @@ dedicated packages. Things like sleep timers, loggers, etc.
         This is very insecure as headers/cookies/etc. are exposed*
 """
 
-import asyncio
 import io
 import json
 import logging
 import urllib.error
 import urllib.parse
-import urllib.request
 
 from kingpin import exceptions as kingpin_exceptions
 from kingpin import schema, utils
-from kingpin.actors import base, exceptions, group
+from kingpin.actors import (
+    base,
+    exceptions,
+    group,
+    http_client,
+    macro_loader,
+    profiler,
+)
 from kingpin.actors import utils as actor_utils
 from kingpin.constants import REQUIRED
 
@@ -115,6 +120,9 @@ class Macro(base.BaseActor):
     # JSON.
     default_timeout = None
 
+    # The actors inside of the macro are journaled one by one.
+    journaled = False
+
     all_options = {
         "macro": (
             str,
@@ -148,11 +156,14 @@ class Macro(base.BaseActor):
         # any conflicts.
         self._init_tokens.update(self.option("tokens"))
 
-        # Copy the tmp file / download a remote macro
-        macro_file = self._get_macro()
+        # Our parent group may have had the script parsed ahead of time.
+        config = macro_loader.SCRIPTS.get(self.option("macro"), self._init_tokens)
+        if config is None:
+            # Copy the tmp file / download a remote macro
+            macro_file = self._get_macro()
 
-        # Parse script, and insert tokens.
-        config = self._get_config_from_script(macro_file)
+            # Parse script, and insert tokens.
+            config = self._get_config_from_script(macro_file)
 
         # Check schema for compatibility
         self._check_schema(config)
@@ -170,6 +181,8 @@ class Macro(base.BaseActor):
 
             self.initial_actor = actor_utils.get_actor(config, dry=self._dry)
 
+        self.initial_actor._parent = self
+
     def _check_macro(self):
         """For now we are limiting the functionality."""
 
@@ -186,15 +199,16 @@ class Macro(base.BaseActor):
         open the local file and return a buffer to that file.
         """
 
-        remote = ("http://", "https://")
-        if self.option("macro").startswith(remote):
+        if self.option("macro").startswith(macro_loader.REMOTE):
             try:
-                response = urllib.request.urlopen(self.option("macro"))
+                contents = macro_loader.REMOTE_MACROS.get(self.option("macro"))
             except Exception as e:
                 raise exceptions.UnrecoverableActorFailure(e) from e
             buf = io.StringIO()
             buf.__repr__ = lambda: (f"In-memory file from: {self.option('macro')}")
-            buf.write(response.read().decode("utf-8"))
+            # The suffix of the name decides how the script is parsed.
+            buf.name = urllib.parse.urlparse(self.option("macro")).path
+            buf.write(contents)
             buf.seek(0)
             return buf
 
@@ -249,6 +263,10 @@ class Macro(base.BaseActor):
         macro = self.initial_actor.get_orgchart(parent=str(id(self)))
         return ret + macro
 
+    def get_actors(self):
+        """Return this macro and the actors inside of the macro file."""
+        return super().get_actors() + self.initial_actor.get_actors()
+
     async def _execute(self):
         # initial_actor is configured with same dry parameter as this actor.
         # Just execute it and the rest will be handled internally.
@@ -296,7 +314,7 @@ class Sleep(base.BaseActor):
             sleep = float(sleep)
 
         if not self._dry:
-            await asyncio.sleep(sleep)
+            await profiler.sleep(sleep)
 
 
 class GenericHTTP(base.HTTPBaseActor):
@@ -323,6 +341,16 @@ class GenericHTTP(base.HTTPBaseActor):
     :password:
       Optional for HTTPAuth.
 
+    :retries:
+      Number of times to try again if the request fails to connect, times out
+      or gets a 429 or 5xx response. Retries back off exponentially (or wait
+      as long as a ``Retry-After`` header asks). Default: 0
+
+    :idempotency-key:
+      Optional value sent in an ``Idempotency-Key`` header with every attempt,
+      so that an endpoint which supports it can safely ignore a retried
+      request that it already handled.
+
     **Examples**
 
     .. code-block:: json
@@ -336,6 +364,18 @@ class GenericHTTP(base.HTTPBaseActor):
          }
        }
 
+    .. code-block:: json
+
+       { "actor": "misc.GenericHTTP",
+         "desc": "Tell the world, even if it takes a few tries",
+         "options": {
+           "url": "http://example.com/rest/api/v1/notify",
+           "data-json": {"release": "%RELEASE%"},
+           "retries": 3,
+           "idempotency-key": "notify-%RELEASE%"
+         }
+       }
+
     **Dry Mode**
 
     Will not do anything in dry mode except print a log statement.
@@ -347,6 +387,8 @@ class GenericHTTP(base.HTTPBaseActor):
         "data-json": (dict, {}, "JSON data to attach as POST query"),
         "username": (str, "", "HTTPAuth username"),
         "password": (str, "", "HTTPAuth password"),
+        "retries": (int, 0, "Number of times to retry a failed request"),
+        "idempotency-key": (str, "", "Idempotency-Key header sent with requests"),
     }
 
     async def _execute_dry(self):
@@ -369,12 +411,18 @@ class GenericHTTP(base.HTTPBaseActor):
 
         escaped_post = urllib.parse.urlencode(self.option("data")) or datajson or None
 
+        headers = {}
+        if self.option("idempotency-key"):
+            headers["Idempotency-Key"] = self.option("idempotency-key")
+
         try:
             await self._fetch(
                 self.option("url"),
                 post=escaped_post,
                 auth_username=self.option("username"),
                 auth_password=self.option("password"),
+                headers=headers,
+                retry=http_client.RetryPolicy(max_attempts=self.option("retries") + 1),
             )
         except urllib.error.HTTPError as e:
             if e.code == 401:
@@ -0,0 +1,509 @@
+"""
+:mod:`kingpin.actors.profiler`
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+Records where each actor spends its time, for the ``--profile`` report.
+
+While profiling is enabled, every actor that executes gets an
+:py:class:`ActorStats` record. Time spent by an actor is broken down into:
+
+* ``queue_wait``: waiting for its turn to make an API call (in an
+  ``ApiCallQueue``, a service governor, a rate limiter or for a free thread).
+* ``api_time``: making API calls, broken down into ``api_calls`` by operation.
+* ``sleep``: sleeping, whether between polls of a resource or before a retry.
+
+Along with the number of ``retries`` and ``throttles`` it ran into. Each of
+these is recorded against the actor that is executing at the time (nested
+actors have records of their own), via a context variable, so that the code
+making the calls needn't know about actors at all.
+
+:py:meth:`RunProfiler.report` arranges the records into a tree of actors that
+matches :py:meth:`~kingpin.actors.base.BaseActor.get_orgchart`.
+
+:py:meth:`RunProfiler.trace` lays the same records out on a timeline instead,
+in the `Chrome trace event format`_, which can be opened in
+``chrome://tracing``, `Perfetto <https://ui.perfetto.dev>`_ or
+`speedscope <https://www.speedscope.app>`_. Every actor is drawn as a bar,
+with its API calls, queue waits and sleeps nested under it, and actors that
+ran in parallel are drawn on lanes of their own. Above them all is the
+critical path of the run (see :py:meth:`RunProfiler.critical_path`): the
+chain of actors that the run had to wait for, one after the other, from
+start to finish. Making anything else faster won't make the run any shorter.
+
+.. _Chrome trace event format:
+   https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+"""
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# The ActorStats of the actor that's executing.
+CURRENT = contextvars.ContextVar("kingpin_actor_stats", default=None)
+
+
+class ActorStats:
+    """The timings of a single execution of an actor."""
+
+    def __init__(self, actor, parent=None):
+        self.id = str(id(actor))
+        self.desc = str(actor._desc)
+        self.actor_class = actor.__class__.__name__
+        self.dry = actor._dry
+        self.parent = parent
+
+        self.started = time.time()
+        self.finished = None
+        self.status = None
+
+        self.queue_wait = 0.0
+        self.api_time = 0.0
+        self.sleep = 0.0
+        self.api_calls = collections.Counter()
+        self.retries = 0
+        self.throttles = 0
+
+        # (category, name, started, finished) of each API call, queue wait
+        # and sleep, for the timeline.
+        self.spans = []
+
+    def add_span(self, category: str, name: str, seconds: float) -> None:
+        """Records something that took `seconds`, and has just finished."""
+        if seconds <= 0:
+            return
+        finished = time.time()
+        self.spans.append((category, name, finished - seconds, finished))
+
+    @property
+    def wall(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    def as_dict(self) -> dict:
+        return {
+            "started": self.started,
+            "finished": self.finished,
+            "status": self.status,
+            "wall": round(self.wall, 6),
+            "queue_wait": round(self.queue_wait, 6),
+            "api_time": round(self.api_time, 6),
+            "sleep": round(self.sleep, 6),
+            "api_calls": dict(sorted(self.api_calls.items())),
+            "retries": self.retries,
+            "throttles": self.throttles,
+        }
+
+
+class RunProfiler:
+    """Collects the ActorStats of every actor executed while it's enabled."""
+
+    def __init__(self):
+        self.enabled = False
+        self._records = []
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def reset(self) -> None:
+        """Forgets everything recorded so far."""
+        self._records = []
+
+    @contextlib.contextmanager
+    def measure(self, actor):
+        """Records the execution of an actor, for the duration of the block.
+
+        Yields:
+            The actor's ActorStats, or None if profiling is disabled.
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        stats = ActorStats(actor, parent=CURRENT.get())
+        self._records.append(stats)
+        token = CURRENT.set(stats)
+        try:
+            yield stats
+        except BaseException:
+            stats.status = "failed"
+            raise
+        else:
+            # Unless the actor said otherwise (ie, it failed but only warned)
+            stats.status = stats.status or "ok"
+        finally:
+            stats.finished = time.time()
+            CURRENT.reset(token)
+
+    def report(self, actor) -> dict:
+        """Returns the profile of a run, as a tree of actors.
+
+        The tree is built from ``actor.get_orgchart()``, with the ActorStats
+        of each actor in the ``stats`` of its node (or None, if it never
+        executed). Actors that were built during the run (ie, by a group
+        streaming its contexts) are added under the actor that ran them.
+
+        Args:
+            actor: The actor at the root of the run.
+        """
+        chart = actor.get_orgchart()
+        nodes = {}
+        for entry in chart:
+            nodes[entry["id"]] = dict(entry, stats=None, children=[])
+
+        records = self._records_of(actor)
+
+        # The node of every record, and the records that have no node of
+        # their own in the orgchart.
+        placed = {}
+        extra = []
+        for record in records:
+            node = nodes.get(record.id)
+            if node is None or node["stats"] is not None:
+                node = {
+                    "id": record.id,
+                    "desc": record.desc,
+                    "class": record.actor_class,
+                    "parent_id": record.parent.id if record.parent else "",
+                    "stats": None,
+                    "children": [],
+                }
+                extra.append((record, node))
+            node["stats"] = record.as_dict()
+            placed[record] = node
+
+        roots = []
+        for entry in chart:
+            parent = nodes.get(entry["parent_id"])
+            (parent["children"] if parent else roots).append(nodes[entry["id"]])
+        for record, node in extra:
+            parent = placed.get(record.parent) or nodes.get(node["parent_id"])
+            (parent["children"] if parent else roots).append(node)
+
+        totals = {
+            "wall": round(max((r.wall for r in records), default=0), 6),
+            "queue_wait": round(sum(r.queue_wait for r in records), 6),
+            "api_time": round(sum(r.api_time for r in records), 6),
+            "sleep": round(sum(r.sleep for r in records), 6),
+            "api_calls": dict(
+                sorted(
+                    sum((r.api_calls for r in records), collections.Counter()).items()
+                )
+            ),
+            "retries": sum(r.retries for r in records),
+            "throttles": sum(r.throttles for r in records),
+            "actors": len(records),
+        }
+        return {"totals": totals, "actors": roots}
+
+    def critical_path(self, actor) -> list:
+        """Returns the critical path of a run.
+
+        Starting from the end of the run, walks back through the actors that
+        each group had to wait for before it could finish: the child that
+        finished last, then the child that finished last before *that* one
+        started, and so on, all the way down the tree. For a `group.Sync`
+        that's every one of its actors; for a `group.Async` it's the slowest
+        of them.
+
+        Args:
+            actor: The actor at the root of the run.
+
+        Returns:
+            The ActorStats of the actors on the critical path, in the order
+            they ran. Groups are replaced by the actors on their own critical
+            path.
+        """
+        records = self._records_of(actor)
+        children = collections.defaultdict(list)
+        for record in records:
+            children[record.parent].append(record)
+
+        def walk(record):
+            kids = children.get(record)
+            if not kids:
+                return [record]
+
+            chain = []
+            until = self._finished(record)
+            while True:
+                earlier = [k for k in kids if self._finished(k) <= until]
+                if not earlier:
+                    break
+                last = max(earlier, key=self._finished)
+                chain.insert(0, last)
+                until = last.started
+                kids = [k for k in kids if k is not last]
+            return [leaf for record in chain for leaf in walk(record)]
+
+        roots = [r for r in records if r.parent not in records]
+        if not roots:
+            return []
+        return walk(max(roots, key=self._finished))
+
+    def trace(self, actor) -> dict:
+        """Returns the timeline of a run, in the Chrome trace event format.
+
+        Args:
+            actor: The actor at the root of the run.
+        """
+        records = self._records_of(actor)
+        if not records:
+            return {"traceEvents": [], "displayTimeUnit": "ms"}
+
+        origin = min(r.started for r in records)
+        critical = self.critical_path(actor)
+
+        def event(name, category, started, finished, lane, args=None):
+            # In microseconds. Both ends are rounded the same way, so that
+            # nested events never poke out of the ones they're nested in.
+            ts = round((started - origin) * 1e6)
+            return {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": ts,
+                "dur": round((finished - origin) * 1e6) - ts,
+                "pid": 1,
+                "tid": lane,
+                "args": args or {},
+            }
+
+        # Lane 0 holds the critical path, the actors are laid out below it.
+        events = []
+        for record in critical:
+            events.append(
+                event(
+                    record.desc,
+                    "critical",
+                    record.started,
+                    self._finished(record),
+                    0,
+                    {"class": record.actor_class, "id": record.id},
+                )
+            )
+
+        on_path = {id(r) for r in critical}
+        lanes = []
+        for item in self._timeline(records):
+            record = item["record"]
+            lane = self._place(lanes, item) + 1
+            if item["span"] is None:
+                args = {
+                    "class": record.actor_class,
+                    "id": record.id,
+                    "status": record.status,
+                    "critical": id(record) in on_path,
+                }
+                events.append(
+                    event(
+                        record.desc,
+                        "actor",
+                        item["started"],
+                        item["finished"],
+                        lane,
+                        args,
+                    )
+                )
+            else:
+                category, name = item["span"]
+                events.append(
+                    event(name, category, item["started"], item["finished"], lane)
+                )
+
+        names = ["critical path"] + [f"lane {n}" for n in range(1, len(lanes) + 1)]
+        for lane, name in enumerate(names):
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": lane,
+                    "args": {"name": name},
+                }
+            )
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": 1,
+                "args": {"name": f"kingpin: {actor._desc}"},
+            }
+        )
+
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "criticalPath": [
+                {
+                    "id": r.id,
+                    "desc": r.desc,
+                    "class": r.actor_class,
+                    "wall": round(r.wall, 6),
+                }
+                for r in critical
+            ],
+        }
+
+    def _timeline(self, records):
+        """Returns the actors and their spans, in the order they started."""
+        items = {}
+        for record in records:
+            finished = self._finished(record)
+            items[record] = {
+                "record": record,
+                "span": None,
+                "started": record.started,
+                "finished": finished,
+                "parent": items.get(record.parent),
+            }
+
+        timeline = list(items.values())
+        for record in records:
+            for category, name, started, finished in record.spans:
+                # Clamped to the actor, so that they nest neatly under it.
+                started = max(started, record.started)
+                finished = min(finished, self._finished(record))
+                timeline.append(
+                    {
+                        "record": record,
+                        "span": (category, name),
+                        "started": started,
+                        "finished": max(started, finished),
+                        "parent": items[record],
+                    }
+                )
+
+        # Parents are placed before the children that started with them.
+        def depth(item):
+            n = 0
+            while item["parent"] is not None:
+                item = item["parent"]
+                n += 1
+            return n
+
+        timeline.sort(key=lambda i: (i["started"], -i["finished"], depth(i)))
+        return timeline
+
+    @staticmethod
+    def _place(lanes, item):
+        """Puts an item on a lane, where it nests neatly under its parent.
+
+        Each lane is the stack of items on it that haven't finished yet.
+        Items go on the lane of their parent when they can (the actors of a
+        `group.Sync`, one after the other) and on a free lane otherwise (the
+        actors of a `group.Async`, side by side).
+
+        Returns:
+            The index of the lane the item was put on.
+        """
+        free = None
+        for index, stack in enumerate(lanes):
+            while stack and stack[-1]["finished"] <= item["started"]:
+                stack.pop()
+            if stack and stack[-1] is item["parent"]:
+                stack.append(item)
+                return index
+            if not stack and free is None:
+                free = index
+
+        if free is None:
+            lanes.append([])
+            free = len(lanes) - 1
+        lanes[free].append(item)
+        return free
+
+    def _records_of(self, actor):
+        """Returns the executions of an actor, and of the actors under it."""
+        root = str(id(actor))
+        return [r for r in self._records if self._descends_from(r, root)]
+
+    @staticmethod
+    def _finished(record):
+        return record.finished or time.time()
+
+    @staticmethod
+    def _descends_from(record, root_id):
+        while record is not None:
+            if record.id == root_id:
+                return True
+            record = record.parent
+        return False
+
+
+PROFILER = RunProfiler()
+
+
+@contextlib.contextmanager
+def attribute(stats):
+    """Records anything that happens in the block against `stats`.
+
+    For work done on behalf of an actor outside of its own task (ie, by the
+    consumer of an ApiCallQueue).
+    """
+    token = CURRENT.set(stats)
+    try:
+        yield
+    finally:
+        CURRENT.reset(token)
+
+
+def record_api_call(operation: str, seconds: float) -> None:
+    """Records an API call made by the current actor."""
+    stats = CURRENT.get()
+    if stats is not None:
+        stats.api_calls[operation] += 1
+        stats.api_time += seconds
+        stats.add_span("api", operation, seconds)
+
+
+def record_queue_wait(seconds: float) -> None:
+    """Records time the current actor spent waiting for its turn."""
+    stats = CURRENT.get()
+    if stats is not None:
+        stats.queue_wait += seconds
+        stats.add_span("queue", "queue wait", seconds)
+
+
+def record_retry() -> None:
+    stats = CURRENT.get()
+    if stats is not None:
+        stats.retries += 1
+
+
+def record_throttle() -> None:
+    stats = CURRENT.get()
+    if stats is not None:
+        stats.throttles += 1
+
+
+async def sleep(seconds: float) -> None:
+    """`asyncio.sleep`, recording the time against the current actor."""
+    stats = CURRENT.get()
+    if stats is None:
+        await asyncio.sleep(seconds)
+        return
+
+    start = time.monotonic()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        slept = time.monotonic() - start
+        stats.sleep += slept
+        stats.add_span("sleep", "sleep", slept)
+
+
+def operation_name(api_function) -> str:
+    """Returns a name for an API call, ie. ``cloudformation.describe_stacks``."""
+    name = getattr(api_function, "__name__", None)
+    if not isinstance(name, str):
+        name = type(api_function).__name__
+    client = getattr(api_function, "__self__", None)
+    model = getattr(getattr(client, "meta", None), "service_model", None)
+    service = getattr(model, "service_name", None)
+    if isinstance(service, str):
+        return f"{service}.{name}"
+    return name
@@ -0,0 +1,37 @@
+"""Fake actors shared by the tests of the run-wide actor machinery."""
+
+from kingpin.actors import base, exceptions, profiler
+
+
+class FakeActor(base.BaseActor):
+    """Fake Actor for Tests
+
+    Records its name in `runs`, sleeps, pretends to make an API call (that
+    took half a second, and was retried once) and then fails if asked to.
+    """
+
+    all_options = {
+        "name": (str, "", "Name"),
+        "fail": (bool, False, "Fail?"),
+        "sleep": ((int, float), 0.01, "Seconds to sleep"),
+    }
+
+    runs = []
+
+    async def _execute(self):
+        FakeActor.runs.append(self.option("name"))
+        await profiler.sleep(self.option("sleep"))
+        profiler.record_api_call("unit.call", 0.5)
+        profiler.record_retry()
+        if self.option("fail"):
+            raise exceptions.RecoverableActorFailure("failed")
+
+
+def fake(name, fail=False, sleep=0.01, **params):
+    """Returns the config of a FakeActor, with `name` as its description."""
+    return {
+        "actor": "kingpin.actors.test.helper.FakeActor",
+        "desc": name,
+        "options": {"name": name, "fail": fail, "sleep": sleep},
+        **params,
+    }
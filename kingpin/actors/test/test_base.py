@@ -6,6 +6,7 @@ import asyncio
 import json
 import logging
 import os
+import urllib.error
 from importlib import reload
 from unittest import mock
 
@@ -18,7 +19,8 @@ from kingpin.actors import base
 reload(base)
 from unittest.mock import AsyncMock
 
-from kingpin.actors import exceptions
+from kingpin.actors import exceptions, http_client
+from kingpin.actors.test.test_http_client import LocalHTTPServer
 from kingpin.constants import REQUIRED, STATE
 
 
@@ -67,7 +69,7 @@ class FakeEnsurableBaseActor(base.EnsurableBaseActor):
         return self.name
 
     async def _compare_name(self):
-        exist = await self._get_name()
+        exist = await self._get_current("name")
         new = self.option("name")
         return exist == new
 
@@ -412,6 +414,74 @@ class TestEnsurableBaseActor(unittest.IsolatedAsyncioTestCase):
         self.assertFalse(self.actor.set_state_called)
         self.assertFalse(self.actor.set_name_called)
 
+    def _build(self, actor_class):
+        return actor_class("Unit Test Actor", dict(self.actor._options))
+
+    async def test_execute_prefetch(self):
+        class CountingActor(FakeEnsurableBaseActor):
+            prefetch_getters = True
+            get_name_calls = 0
+
+            async def _get_name(self):
+                self.get_name_calls += 1
+                return await super()._get_name()
+
+        self.actor._options["description"] = "New description"
+        actor = self._build(CountingActor)
+
+        await actor._execute()
+
+        # The custom _compare_name() got the prefetched result.
+        self.assertEqual(actor.get_name_calls, 1)
+        self.assertTrue(actor.set_state_called)
+        self.assertTrue(actor.set_name_called)
+        self.assertTrue(actor.set_description_called)
+
+        # The getters themselves were left alone, and the prefetched results
+        # are forgotten afterwards.
+        self.assertEqual(actor.getters["name"], actor._get_name)
+        self.assertNotIn("_get_name", vars(actor))
+        self.assertEqual(await actor._get_current("name"), "new name")
+        self.assertEqual(actor.get_name_calls, 2)
+
+    async def test_execute_prefetch_getter_failure(self):
+        class FailingActor(FakeEnsurableBaseActor):
+            prefetch_getters = True
+
+            async def _get_name(self):
+                raise exceptions.RecoverableActorFailure("failed")
+
+        actor = self._build(FailingActor)
+
+        with self.assertRaises(exceptions.RecoverableActorFailure):
+            await actor._execute()
+
+        self.assertFalse(actor.set_name_called)
+        self.assertFalse(actor.set_description_called)
+
+    async def test_ensure_concurrently_setter_order(self):
+        order = []
+        event = asyncio.Event()
+
+        async def _set_name():
+            # Would deadlock if the independent setter were not concurrent.
+            await event.wait()
+            order.append("name")
+
+        async def _set_description():
+            order.append("description")
+            event.set()
+
+        await self.actor._precache()
+        self.actor.setters = {"name": _set_name, "description": _set_description}
+        self.actor.independent_options = ["description"]
+        self.actor.prefetch_getters = True
+        self.actor._options["description"] = "New description"
+
+        await self.actor._ensure_concurrently(["name", "description"])
+
+        self.assertEqual(order, ["description", "name"])
+
     def test_gather_methods_throws_exception(self):
         # Mock out the set_name method by replacing it with an attribute
         self.actor._set_name = False
@@ -448,38 +518,97 @@ class TestHTTPBaseActor(unittest.IsolatedAsyncioTestCase):
         self.assertEqual("http://unittest?foo=bar+baz&xyz=abc", result)
 
     async def test_fetch(self):
-        response_dict = {"foo": "asdf"}
-        response_body = json.dumps(response_dict).encode()
-
-        mock_response = mock.Mock()
-        mock_response.read.return_value = response_body
+        server = LocalHTTPServer()
+        self.addCleanup(server.stop)
+        server.routes["/good"] = (200, {}, json.dumps({"foo": "asdf"}).encode())
+        server.routes["/bad"] = (200, {}, b"Something bad happened")
 
-        with mock.patch("urllib.request.urlopen", return_value=mock_response):
-            response = await self.actor._fetch("http://example.com/")
-            self.assertEqual(response_dict, response)
+        response = await self.actor._fetch(f"{server.url}/good")
+        self.assertEqual({"foo": "asdf"}, response)
 
-        mock_response.read.return_value = b"Something bad happened"
-
-        with mock.patch("urllib.request.urlopen", return_value=mock_response):
-            with self.assertRaises(exceptions.UnparseableResponseFromEndpoint):
-                await self.actor._fetch("http://example.com/")
+        with self.assertRaises(exceptions.UnparseableResponseFromEndpoint):
+            await self.actor._fetch(f"{server.url}/bad")
 
     async def test_fetch_with_auth(self):
-        response_dict = {"foo": "asdf"}
-        response_body = json.dumps(response_dict).encode()
+        server = LocalHTTPServer()
+        self.addCleanup(server.stop)
+        server.routes["/"] = (200, {}, b"{}")
+
+        self.actor.headers = {"X-Unit": "test"}
+        await self.actor._fetch(
+            f"{server.url}/",
+            post="a=b",
+            auth_username="foo",
+            auth_password="bar",
+        )
+        req = server.requests[0]
+        self.assertEqual(req["method"], "POST")
+        self.assertEqual(req["body"], b"a=b")
+        self.assertEqual(req["headers"]["X-Unit"], "test")
+        self.assertTrue(req["headers"]["Authorization"].startswith("Basic "))
+
+    async def test_fetch_retries(self):
+        server = LocalHTTPServer()
+        self.addCleanup(server.stop)
+        responses = [
+            (503, {"Retry-After": "0"}, b"{}"),
+            (500, {}, b"{}"),
+            (200, {}, b'{"ok": 1}'),
+        ]
+        server.routes["/flaky"] = lambda handler: responses.pop(0)
+
+        policy = http_client.RetryPolicy(max_attempts=3, backoff=0.01)
+        ret = await self.actor._fetch(
+            f"{server.url}/flaky", headers={"Idempotency-Key": "abc"}, retry=policy
+        )
+        self.assertEqual(ret, {"ok": 1})
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(
+            {r["headers"]["Idempotency-Key"] for r in server.requests}, {"abc"}
+        )
 
-        mock_response = mock.Mock()
-        mock_response.read.return_value = response_body
+    async def test_fetch_gives_up(self):
+        server = LocalHTTPServer()
+        self.addCleanup(server.stop)
+        server.routes["/down"] = (503, {}, b"{}")
+        server.routes["/missing"] = (404, {}, b"{}")
+
+        policy = http_client.RetryPolicy(max_attempts=2, backoff=0.01)
+        with self.assertRaises(urllib.error.HTTPError):
+            await self.actor._fetch(f"{server.url}/down", retry=policy)
+        self.assertEqual(len(server.requests), 2)
+
+        # Requests that can't get any better are not retried
+        with self.assertRaises(urllib.error.HTTPError):
+            await self.actor._fetch(f"{server.url}/missing", retry=policy)
+        self.assertEqual(len(server.requests), 3)
+
+    async def test_fetch_circuit_breaker(self):
+        server = LocalHTTPServer()
+        self.addCleanup(server.stop)
+        server.routes["/down"] = (503, {}, b"{}")
+        self.actor.circuit_breaker = http_client.CircuitBreaker(threshold=2)
+
+        policy = http_client.RetryPolicy(max_attempts=5, backoff=0.01)
+        with self.assertRaises(exceptions.RecoverableActorFailure) as e:
+            await self.actor._fetch(f"{server.url}/down", retry=policy)
+        self.assertIsInstance(e.exception.__cause__, http_client.CircuitOpenError)
+        self.assertEqual(len(server.requests), 2)
 
-        with mock.patch("urllib.request.urlopen", return_value=mock_response) as m:
-            await self.actor._fetch(
-                "http://example.com/",
-                auth_username="foo",
-                auth_password="bar",
-            )
-            req = m.call_args[0][0]
-            self.assertIn("Authorization", req.headers)
-            self.assertTrue(req.headers["Authorization"].startswith("Basic "))
+        with self.assertRaises(exceptions.RecoverableActorFailure):
+            await self.actor._fetch(f"{server.url}/down")
+        self.assertEqual(len(server.requests), 2)
+
+    async def test_fetch_circuit_breaker_off_by_default(self):
+        server = LocalHTTPServer()
+        self.addCleanup(server.stop)
+        server.routes["/down"] = (503, {}, b"{}")
+
+        self.assertEqual(self.actor.circuit_breaker.threshold, 0)
+        for _ in range(10):
+            with self.assertRaises(urllib.error.HTTPError):
+                await self.actor._fetch(f"{server.url}/down")
+        self.assertEqual(len(server.requests), 10)
 
 
 class TestActualEnsurableBaseActor(unittest.IsolatedAsyncioTestCase):
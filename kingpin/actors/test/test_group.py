@@ -1,5 +1,7 @@
 import asyncio
 import logging
+import os
+import tempfile
 import time
 import unittest
 from unittest import mock
@@ -51,6 +53,29 @@ class FakeActorPopulate(base.BaseActor):
         return None
 
 
+class FakeActorTracksMemory(base.BaseActor):
+    """Fake Actor for Tests"""
+
+    all_options = {"value": (object, True, "Value to record")}
+
+    # Every actor that has been built but hasn't finished executing
+    alive = set()
+    peak = 0
+    order = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        FakeActorTracksMemory.alive.add(self)
+        FakeActorTracksMemory.peak = max(
+            FakeActorTracksMemory.peak, len(FakeActorTracksMemory.alive)
+        )
+
+    async def _execute(self):
+        await asyncio.sleep(0.01)
+        FakeActorTracksMemory.order.append(self.option("value"))
+        FakeActorTracksMemory.alive.discard(self)
+
+
 class TestGroupActorBaseClass(unittest.IsolatedAsyncioTestCase):
     def setUp(self, *args, **kwargs):
         super().setUp(*args, **kwargs)
@@ -405,3 +430,91 @@ class TestAsyncGroupActor(TestGroupActorBaseClass):
 
         with self.assertRaises(exceptions.UnrecoverableActorFailure):
             await actor._run_actions()
+
+
+class TestStreamingContexts(TestGroupActorBaseClass):
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        FakeActorTracksMemory.alive = set()
+        FakeActorTracksMemory.peak = 0
+        FakeActorTracksMemory.order = []
+        self.tracker = {
+            "desc": "track {ROW}",
+            "actor": "kingpin.actors.test.test_group.FakeActorTracksMemory",
+            "options": {"value": "{ROW}"},
+        }
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def _write(self, name, lines):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    async def test_sync_jsonl(self):
+        path = self._write("rows.jsonl", [f'{{"ROW": "{i}"}}' for i in range(20)])
+        actor = group.Sync("Unit Test", {"acts": [self.tracker], "contexts": path})
+
+        # Only the first context is built up front
+        self.assertEqual(len(actor._actions), 1)
+
+        await actor.execute()
+        self.assertEqual(FakeActorTracksMemory.order, [str(i) for i in range(20)])
+        self.assertEqual(FakeActorTracksMemory.peak, 1)
+
+    async def test_async_csv_concurrency(self):
+        path = self._write("rows.csv", ["ROW"] + [str(i) for i in range(50)])
+        actor = group.Async(
+            "Unit Test",
+            {"acts": [self.tracker], "contexts": path, "concurrency": 5},
+        )
+
+        start = time.time()
+        await actor.execute()
+        self.assertLess(time.time() - start, 0.5)
+
+        self.assertEqual(
+            sorted(FakeActorTracksMemory.order, key=int), [str(i) for i in range(50)]
+        )
+        self.assertEqual(FakeActorTracksMemory.peak, 5)
+
+    async def test_bad_row(self):
+        path = self._write("rows.jsonl", ['{"ROW": "0"}', '{"ROW": "1"}', "junk"])
+        actor = group.Async(
+            "Unit Test",
+            {"acts": [self.tracker], "contexts": path, "concurrency": 5},
+        )
+
+        with self.assertRaisesRegex(exceptions.UnrecoverableActorFailure, "line 3"):
+            await actor.execute()
+
+        # The actors that had already started were stopped, and nothing is
+        # left running behind the group's back.
+        self.assertEqual(FakeActorTracksMemory.order, [])
+        self.assertEqual(asyncio.all_tasks(), {asyncio.current_task()})
+
+    async def test_macros_prefetched_once(self):
+        path = self._write("rows.jsonl", [f'{{"ROW": "{i}"}}' for i in range(3)])
+        with mock.patch.object(group.macro_loader, "prefetch") as prefetch:
+            actor = group.Sync("Unit Test", {"acts": [self.tracker], "contexts": path})
+            await actor.execute()
+            group.Async(
+                "Unit Test",
+                {"acts": [self.tracker], "contexts": [{"ROW": "a"}, {"ROW": "b"}]},
+            )
+
+        self.assertEqual(prefetch.call_count, 2)
+
+    async def test_failures_are_counted(self):
+        path = self._write("rows.jsonl", ['{"ROW": "0"}', '{"ROW": "1"}'])
+        actor = group.Sync(
+            "Unit Test",
+            {"acts": [self.actor_raises_recoverable_exception], "contexts": path},
+            dry=True,
+        )
+        with self.assertRaisesRegex(
+            exceptions.RecoverableActorFailure, "raised by 2 of 2 actors"
+        ):
+            await actor.execute()
@@ -0,0 +1,399 @@
+import asyncio
+import email.utils
+import http.server
+import json
+import logging
+import os
+import ssl
+import threading
+import time
+import unittest
+import urllib.error
+from unittest import mock
+
+from kingpin.actors import http_client
+
+log = logging.getLogger(__name__)
+
+
+class LocalHTTPServer:
+    """A throwaway HTTP/1.1 server on localhost, running in a thread.
+
+    Responses are looked up in `routes` by path: either a (status, headers,
+    body) tuple, or a callable that takes the request handler and returns
+    one (or None, if it wrote the response itself). Every request is recorded
+    in `requests`, along with the client port it arrived on, so that
+    connection reuse can be checked.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                server.requests.append(
+                    {
+                        "method": self.command,
+                        "path": self.path,
+                        "headers": self.headers,
+                        "body": body,
+                        "port": self.client_address[1],
+                    }
+                )
+
+                route = server.routes.get(self.path.split("?")[0])
+                if route is None:
+                    route = (404, {}, b'{"error": "not found"}')
+                if callable(route):
+                    route = route(self)
+                if route is None:
+                    return
+                status, headers, payload = route
+
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _respond
+            do_POST = _respond
+            do_CONNECT = _respond
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, args=(0.01,), daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestConnectionPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = LocalHTTPServer()
+        self.server.routes["/json"] = (200, {}, b'{"ok": true}')
+        self.pool = http_client.ConnectionPool(
+            max_per_host=2, connect_timeout=1, read_timeout=0.5
+        )
+
+        # No proxies, unless a test sets them up.
+        environ = mock.patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+        for name in list(os.environ):
+            if name.lower().endswith("_proxy"):
+                del os.environ[name]
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+        super().tearDown()
+
+    async def test_request(self):
+        ret = await self.pool.request(
+            "POST", f"{self.server.url}/json?a=b", body=b"x=y", headers={"X-Foo": "1"}
+        )
+        self.assertEqual(ret.status, 200)
+        self.assertEqual(json.loads(ret.body), {"ok": True})
+
+        req = self.server.requests[0]
+        self.assertEqual(req["method"], "POST")
+        self.assertEqual(req["path"], "/json?a=b")
+        self.assertEqual(req["headers"]["X-Foo"], "1")
+        self.assertEqual(req["body"], b"x=y")
+
+    async def test_keep_alive(self):
+        for _ in range(5):
+            await self.pool.request("GET", f"{self.server.url}/json")
+
+        ports = {r["port"] for r in self.server.requests}
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(len(ports), 1)
+
+    async def test_stale_connection_is_replaced(self):
+        def hang_up(handler):
+            # Close the connection afterwards without telling the client
+            handler.close_connection = True
+            return (200, {}, b"{}")
+
+        self.server.routes["/hangup"] = hang_up
+        await self.pool.request("GET", f"{self.server.url}/hangup")
+        await asyncio.sleep(0.1)
+
+        ret = await self.pool.request("GET", f"{self.server.url}/json")
+        self.assertEqual(ret.status, 200)
+        self.assertEqual(len({r["port"] for r in self.server.requests}), 2)
+
+    async def test_max_per_host(self):
+        in_flight = []
+        peak = []
+
+        def slow(handler):
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            time.sleep(0.1)
+            in_flight.pop()
+            return (200, {}, b"{}")
+
+        self.server.routes["/slow"] = slow
+        await asyncio.gather(
+            *[self.pool.request("GET", f"{self.server.url}/slow") for _ in range(6)]
+        )
+        self.assertEqual(max(peak), 2)
+
+    async def test_read_timeout(self):
+        def hang(handler):
+            time.sleep(1)
+            return (200, {}, b"{}")
+
+        self.server.routes["/hang"] = hang
+        with self.assertRaises(urllib.error.URLError):
+            await self.pool.request("GET", f"{self.server.url}/hang")
+
+    async def test_read_timeout_is_per_read(self):
+        def trickle(handler):
+            handler.wfile.write(
+                b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            )
+            for _ in range(4):
+                time.sleep(0.2)
+                handler.wfile.write(b"1\r\n.\r\n")
+            handler.wfile.write(b"0\r\n\r\n")
+
+        # Longer than the read timeout in all, but never silent for as long.
+        self.server.routes["/trickle"] = trickle
+        ret = await self.pool.request("GET", f"{self.server.url}/trickle")
+        self.assertEqual(ret.body, b"....")
+
+    async def test_user_agent(self):
+        await self.pool.request("GET", f"{self.server.url}/json")
+        await self.pool.request(
+            "GET", f"{self.server.url}/json", headers={"user-agent": "unit"}
+        )
+
+        first, second = self.server.requests
+        self.assertEqual(first["headers"]["User-Agent"], http_client.USER_AGENT)
+        self.assertEqual(second["headers"].get_all("User-Agent"), ["unit"])
+
+    async def test_http_proxy(self):
+        proxy = self.server.url.replace("://", "://user:p%40ss@")
+        os.environ["http_proxy"] = proxy
+        self.server.routes["http://example.invalid/json"] = (200, {}, b"{}")
+
+        ret = await self.pool.request("GET", "http://example.invalid/json?a=b")
+        self.assertEqual(ret.status, 200)
+
+        req = self.server.requests[0]
+        self.assertEqual(req["path"], "http://example.invalid/json?a=b")
+        self.assertEqual(req["headers"]["Host"], "example.invalid")
+        self.assertEqual(req["headers"]["Proxy-Authorization"], "Basic dXNlcjpwQHNz")
+
+        # Hosts in no_proxy are reached directly.
+        os.environ["no_proxy"] = "127.0.0.1"
+        await self.pool.request("GET", f"{self.server.url}/json")
+        self.assertEqual(self.server.requests[1]["path"], "/json")
+
+    async def test_https_proxy_tunnel(self):
+        os.environ["https_proxy"] = self.server.url
+        self.server.routes["example.invalid:443"] = (407, {}, b"")
+
+        with self.assertRaises(urllib.error.URLError) as e:
+            await self.pool.request("GET", "https://example.invalid/json")
+        self.assertIn("Tunnel connection failed: 407", str(e.exception))
+
+        req = self.server.requests[0]
+        self.assertEqual(req["method"], "CONNECT")
+        self.assertEqual(req["headers"]["Host"], "example.invalid:443")
+
+        # Once the tunnel is up, TLS is started through it. Leave that out,
+        # so that the same local server answers the request itself.
+        self.server.routes["example.invalid:443"] = (200, {}, b"")
+        with mock.patch.object(
+            asyncio.StreamWriter, "start_tls", autospec=True
+        ) as start_tls:
+            ret = await self.pool.request("GET", "https://example.invalid/json")
+
+        self.assertEqual(json.loads(ret.body), {"ok": True})
+        start_tls.assert_awaited_once_with(
+            mock.ANY, self.pool.ssl_context, server_hostname="example.invalid"
+        )
+        self.assertEqual(
+            [r["path"] for r in self.server.requests[1:]],
+            ["example.invalid:443", "/json"],
+        )
+
+    async def test_error_status(self):
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            await self.pool.request("GET", f"{self.server.url}/missing")
+        self.assertEqual(e.exception.code, 404)
+        self.assertEqual(e.exception.read(), b'{"error": "not found"}')
+
+    async def test_redirect(self):
+        self.server.routes["/old"] = (302, {"Location": "/json"}, b"")
+        ret = await self.pool.request("POST", f"{self.server.url}/old", body=b"x")
+        self.assertEqual(json.loads(ret.body), {"ok": True})
+        self.assertEqual(self.server.requests[-1]["method"], "GET")
+
+    async def test_connection_refused(self):
+        url = self.server.url
+        self.server.stop()
+        with self.assertRaises(urllib.error.URLError):
+            await self.pool.request("GET", f"{url}/json")
+
+    async def test_bad_scheme(self):
+        with self.assertRaises(urllib.error.URLError):
+            await self.pool.request("GET", "ftp://example.com/")
+
+    async def test_many_concurrent_requests(self):
+        self.pool.max_per_host = 50
+        # Plenty of time, for when the machine running the tests is busy
+        self.pool.read_timeout = 10
+        rets = await asyncio.gather(
+            *[self.pool.request("GET", f"{self.server.url}/json") for _ in range(300)]
+        )
+        self.assertEqual({r.status for r in rets}, {200})
+        self.assertLessEqual(len({r["port"] for r in self.server.requests}), 50)
+
+    async def test_chunked_response(self):
+        def chunked(handler):
+            handler.wfile.write(
+                b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b'5;ext=1\r\n{"a":\r\n3\r\n 1}\r\n0\r\nX-Trailer: 1\r\n\r\n'
+            )
+
+        self.server.routes["/chunked"] = chunked
+        ret = await self.pool.request("GET", f"{self.server.url}/chunked")
+        self.assertEqual(json.loads(ret.body), {"a": 1})
+
+        # The connection is still good for another request
+        await self.pool.request("GET", f"{self.server.url}/json")
+        self.assertEqual(len({r["port"] for r in self.server.requests}), 1)
+
+    async def test_response_until_close(self):
+        def http10(handler):
+            handler.close_connection = True
+            handler.wfile.write(b"HTTP/1.0 200 OK\r\n\r\n{}")
+
+        self.server.routes["/http10"] = http10
+        ret = await self.pool.request("GET", f"{self.server.url}/http10")
+        self.assertEqual(ret.body, b"{}")
+        self.assertEqual(self.pool._idle, {})
+
+    async def test_header_injection(self):
+        with self.assertRaises(ValueError):
+            await self.pool.request(
+                "GET", f"{self.server.url}/json", headers={"X": "a\r\nY: b"}
+            )
+
+    async def test_https_uses_tls(self):
+        with mock.patch.object(
+            asyncio, "open_connection", side_effect=ssl.SSLError("nope")
+        ) as open_connection:
+            with self.assertRaises(urllib.error.URLError):
+                await self.pool.request("GET", "https://example.com/")
+
+        open_connection.assert_called_with(
+            "example.com",
+            443,
+            ssl=self.pool.ssl_context,
+            server_hostname="example.com",
+        )
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def _http_error(self, code, headers=None):
+        return urllib.error.HTTPError("http://unit", code, "", headers or {}, None)
+
+    def test_is_retryable(self):
+        policy = http_client.RetryPolicy(max_attempts=3)
+        self.assertTrue(policy.is_retryable(urllib.error.URLError("refused")))
+        self.assertTrue(policy.is_retryable(self._http_error(503)))
+        self.assertTrue(policy.is_retryable(self._http_error(429)))
+        self.assertFalse(policy.is_retryable(self._http_error(404)))
+        self.assertFalse(policy.is_retryable(http_client.CircuitOpenError("open")))
+        self.assertFalse(policy.is_retryable(ValueError()))
+
+    def test_delay_backs_off_with_jitter(self):
+        policy = http_client.RetryPolicy(backoff=1, max_backoff=5)
+        error = urllib.error.URLError("refused")
+        for attempt, ceiling in ((1, 1), (2, 2), (3, 4), (4, 5), (10, 5)):
+            delays = [policy.delay(attempt, error) for _ in range(50)]
+            self.assertTrue(all(0 <= d <= ceiling for d in delays))
+            self.assertGreater(len(set(delays)), 1)
+
+    def test_delay_retry_after(self):
+        policy = http_client.RetryPolicy(backoff=1, max_backoff=60)
+        self.assertEqual(
+            policy.delay(1, self._http_error(503, {"Retry-After": "7"})), 7
+        )
+        self.assertEqual(
+            policy.delay(1, self._http_error(503, {"Retry-After": "600"})), 60
+        )
+
+        when = email.utils.formatdate(time.time() + 30, usegmt=True)
+        delay = policy.delay(1, self._http_error(429, {"Retry-After": when}))
+        self.assertTrue(25 < delay <= 30)
+
+        # Garbage is ignored
+        delay = policy.delay(1, self._http_error(429, {"Retry-After": "soon"}))
+        self.assertLessEqual(delay, 1)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = http_client.CircuitBreaker(threshold=3, reset_timeout=30)
+        for _ in range(2):
+            breaker.failure("http://bad:80/a")
+        breaker.check("http://bad:80/a")
+
+        breaker.failure("http://bad:80/b")
+        with self.assertRaises(http_client.CircuitOpenError):
+            breaker.check("http://bad:80/c")
+
+        # Other hosts don't care
+        breaker.check("http://good/")
+
+    def test_success_resets(self):
+        breaker = http_client.CircuitBreaker(threshold=2, reset_timeout=30)
+        breaker.failure("http://host/")
+        breaker.success("http://host/")
+        breaker.failure("http://host/")
+        breaker.check("http://host/")
+
+    def test_trial_request(self):
+        breaker = http_client.CircuitBreaker(threshold=1, reset_timeout=30)
+        with mock.patch.object(http_client.time, "monotonic", return_value=100):
+            breaker.failure("http://host/")
+            with self.assertRaises(http_client.CircuitOpenError):
+                breaker.check("http://host/")
+
+        with mock.patch.object(http_client.time, "monotonic", return_value=131):
+            # One trial request is let through...
+            breaker.check("http://host/")
+            # ... but nobody else until we hear back from it.
+            with self.assertRaises(http_client.CircuitOpenError):
+                breaker.check("http://host/")
+
+            breaker.success("http://host/")
+            breaker.check("http://host/")
+
+    def test_disabled(self):
+        breaker = http_client.CircuitBreaker(threshold=0)
+        for _ in range(100):
+            breaker.failure("http://host/")
+        breaker.check("http://host/")
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from kingpin.actors import base, exceptions, group, journal
+from kingpin.actors.test.helper import FakeActor, fake
+
+log = logging.getLogger(__name__)
+
+
+class TestRunJournal(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        FakeActor.runs = []
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "journal")
+
+        self.journal = journal.RunJournal()
+        self.addCleanup(self.journal.close)
+        self.enterContext(mock.patch.object(journal, "JOURNAL", self.journal))
+
+    def _read(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    async def test_resume(self):
+        self.journal.open(self.path)
+        actor = group.Sync("Group", {"acts": [fake("a"), fake("b", fail=True)]})
+        with self.assertRaises(exceptions.RecoverableActorFailure):
+            await actor.execute()
+        self.assertEqual(FakeActor.runs, ["a", "b"])
+
+        # Only the actor that succeeded was recorded
+        entries = self._read()
+        self.assertEqual([e["path"] for e in entries], ["0/0"])
+        self.assertEqual(entries[0]["actor"], "kingpin.actors.test.helper.FakeActor")
+
+        # The second run picks up where the first one failed
+        FakeActor.runs = []
+        self.journal.open(self.path, resume=True)
+        actor = group.Sync("Group", {"acts": [fake("a"), fake("b")]})
+        await actor.execute()
+        self.assertEqual(FakeActor.runs, ["b"])
+        self.assertEqual([e["path"] for e in self._read()], ["0/0", "0/1"])
+
+        # And a third run has nothing left to do
+        FakeActor.runs = []
+        self.journal.open(self.path, resume=True)
+        await group.Sync("Group", {"acts": [fake("a"), fake("b")]}).execute()
+        self.assertEqual(FakeActor.runs, [])
+
+    async def test_changed_actors_run_again(self):
+        self.journal.open(self.path)
+        await group.Sync("Group", {"acts": [fake("a"), fake("b")]}).execute()
+
+        self.journal.open(self.path, resume=True)
+        # "b" changed, "a" moved
+        await group.Sync("Group", {"acts": [fake("c"), fake("a"), fake("B")]}).execute()
+        self.assertEqual(FakeActor.runs, ["a", "b", "c", "a", "B"])
+
+    async def test_without_resume_starts_afresh(self):
+        self.journal.open(self.path)
+        await group.Sync("Group", {"acts": [fake("a")]}).execute()
+
+        self.journal.open(self.path)
+        self.assertEqual(self._read(), [])
+        await group.Sync("Group", {"acts": [fake("a")]}).execute()
+        self.assertEqual(FakeActor.runs, ["a", "a"])
+
+    async def test_dry_runs_are_not_recorded(self):
+        self.journal.open(self.path)
+        await group.Sync("Group", {"acts": [fake("a")]}, dry=True).execute()
+        self.assertEqual(self._read(), [])
+
+    async def test_not_open(self):
+        await group.Sync("Group", {"acts": [fake("a")]}).execute()
+        with self.assertRaises(FileNotFoundError):
+            self._read()
+
+    def test_damaged_journal(self):
+        actor = base.BaseActor("Test")
+        with open(self.path, "w") as f:
+            path, config_hash = journal.RunJournal.key(actor)
+            f.write(json.dumps({"path": path, "hash": config_hash}) + "\n")
+            f.write('{"path": "0/1", "ha')
+
+        self.journal.open(self.path, resume=True)
+        self.assertTrue(self.journal.completed(actor))
+
+    def test_missing_journal(self):
+        self.journal.open(self.path, resume=True)
+        self.assertFalse(self.journal.completed(base.BaseActor("Test")))
+
+    def test_tree_path(self):
+        actor = group.Sync(
+            "Outer",
+            {
+                "acts": [
+                    fake("a"),
+                    {
+                        "actor": "group.Async",
+                        "options": {"acts": [fake("b"), fake("c")]},
+                    },
+                ]
+            },
+        )
+        inner = actor._actions[1]
+        self.assertEqual(actor._tree_path, "0")
+        self.assertEqual(inner._tree_path, "0/1")
+        self.assertEqual(inner._actions[1]._tree_path, "0/1/1")
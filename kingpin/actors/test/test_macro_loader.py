@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+from unittest import mock
+
+from kingpin.actors import macro_loader
+from kingpin.actors.test.test_http_client import LocalHTTPServer
+
+log = logging.getLogger(__name__)
+
+
+class TestRemoteMacroCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = LocalHTTPServer()
+        self.addCleanup(self.server.stop)
+        self.url = f"{self.server.url}/macro.json"
+
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        patcher = mock.patch.object(
+            macro_loader, "MACRO_CACHE_DIR", self.cache_dir.name
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cache = macro_loader._RemoteMacroCache()
+
+    def _etag_route(self, body, etag):
+        def route(handler):
+            if handler.headers.get("If-None-Match") == etag:
+                return (304, {"ETag": etag}, b"")
+            return (200, {"ETag": etag}, body)
+
+        return route
+
+    def test_get(self):
+        self.server.routes["/macro.json"] = (200, {}, b'{"a": 1}')
+        self.assertEqual(self.cache.get(self.url), '{"a": 1}')
+
+        # Downloaded only once per process
+        self.assertEqual(self.cache.get(self.url), '{"a": 1}')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_conditional_get(self):
+        self.server.routes["/macro.json"] = self._etag_route(b'{"a": 1}', '"v1"')
+        self.assertEqual(self.cache.get(self.url), '{"a": 1}')
+
+        # A new process asks the server whether its cached copy is current
+        cache = macro_loader._RemoteMacroCache()
+        self.assertEqual(cache.get(self.url), '{"a": 1}')
+        self.assertEqual(self.server.requests[-1]["headers"]["If-None-Match"], '"v1"')
+
+        # And downloads it again if it's not
+        self.server.routes["/macro.json"] = self._etag_route(b'{"a": 2}', '"v2"')
+        cache = macro_loader._RemoteMacroCache()
+        self.assertEqual(cache.get(self.url), '{"a": 2}')
+
+    def test_last_modified(self):
+        stamp = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+        def route(handler):
+            if handler.headers.get("If-Modified-Since") == stamp:
+                return (304, {}, b"")
+            return (200, {"Last-Modified": stamp}, b"[]")
+
+        self.server.routes["/macro.json"] = route
+        self.cache.get(self.url)
+        self.assertEqual(macro_loader._RemoteMacroCache().get(self.url), "[]")
+        self.assertEqual(
+            [r["headers"].get("If-Modified-Since") for r in self.server.requests],
+            [None, stamp],
+        )
+
+    def test_cache_disabled(self):
+        self.server.routes["/macro.json"] = self._etag_route(b"[]", '"v1"')
+        with mock.patch.object(macro_loader, "MACRO_CACHE_DIR", ""):
+            self.cache.get(self.url)
+            macro_loader._RemoteMacroCache().get(self.url)
+        self.assertNotIn("If-None-Match", self.server.requests[-1]["headers"])
+
+    async def test_concurrent_fetches_are_shared(self):
+        release = threading.Event()
+
+        def slow(handler):
+            release.wait(5)
+            return (200, {}, b"[]")
+
+        self.server.routes["/macro.json"] = slow
+        fetches = [asyncio.ensure_future(self.cache.fetch(self.url)) for _ in range(10)]
+        await asyncio.sleep(0.1)
+        release.set()
+
+        self.assertEqual(await asyncio.gather(*fetches), ["[]"] * 10)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_failures_are_not_remembered(self):
+        with self.assertRaises(urllib.error.HTTPError):
+            self.cache.get(self.url)
+
+        self.server.routes["/macro.json"] = (200, {}, b"[]")
+        self.assertEqual(self.cache.get(self.url), "[]")
+
+    def test_prefetch(self):
+        acts = [
+            {"actor": "misc.Macro", "options": {"macro": "http://a/1.json"}},
+            {"actor": "misc.Macro", "options": {"macro": "http://a/1.json"}},
+            {"actor": "kingpin.actors.misc.Macro", "options": {"macro": "https://b"}},
+            {"actor": "misc.Macro", "options": {"macro": "local.json"}},
+            {"actor": "misc.Macro", "options": {"macro": "http://a/{CTX}.json"}},
+            {"actor": "misc.Sleep", "options": {"sleep": 1}},
+        ]
+        with (
+            mock.patch.object(macro_loader.REMOTE_MACROS, "prefetch") as remote,
+            mock.patch.object(macro_loader.SCRIPTS, "prefetch") as scripts,
+        ):
+            macro_loader.prefetch(acts, {"A": 1})
+        remote.assert_called_once_with(["http://a/1.json", "https://b"])
+        self.assertEqual(len(scripts.call_args[0][0]), 4)
+
+
+class TestFindMacros(unittest.TestCase):
+    def test_find_macros(self):
+        config = {
+            "actor": "group.Sync",
+            "options": {
+                "acts": [
+                    {"actor": "misc.Macro", "options": {"macro": "a.yaml"}},
+                    {
+                        "actor": "group.Async",
+                        "options": {
+                            "acts": [
+                                {
+                                    "actor": "misc.Macro",
+                                    "options": {"macro": "b.yaml", "tokens": {"B": 2}},
+                                },
+                                {
+                                    "actor": "misc.Macro",
+                                    "options": {"macro": "{CTX}.yaml"},
+                                },
+                                {
+                                    "actor": "misc.Macro",
+                                    "options": {
+                                        "macro": "c.yaml",
+                                        "tokens": {"C": "{CTX}"},
+                                    },
+                                },
+                            ]
+                        },
+                    },
+                    {"actor": "misc.Note", "options": {"message": "hi"}},
+                ]
+            },
+        }
+        self.assertEqual(
+            list(macro_loader._find_macros(config, {"A": 1, "B": 1})),
+            [("a.yaml", {"A": 1, "B": 1}), ("b.yaml", {"A": 1, "B": 2})],
+        )
+
+    def test_find_macros_ignores_junk(self):
+        self.assertEqual(list(macro_loader._find_macros("junk", {})), [])
+        self.assertEqual(list(macro_loader._find_macros([1, {"actor": 2}], {})), [])
+
+
+class TestScriptCache(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.cache = macro_loader._ScriptCache()
+
+        patcher = mock.patch.object(macro_loader, "MACRO_PARSE_THRESHOLD", 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write(self, name, contents):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w") as f:
+            f.write(contents)
+        return path
+
+    def _macro(self, path, tokens=None):
+        return {
+            "actor": "misc.Macro",
+            "options": {"macro": path, "tokens": tokens or {}},
+        }
+
+    def test_parses_the_whole_tree(self):
+        leaf = self._write(
+            "leaf.yaml", "actor: misc.Note\noptions: {message: '%MSG%'}\n"
+        )
+        middle = self._write(
+            "middle.json", json.dumps(self._macro(leaf, {"MSG": "%NAME%"}))
+        )
+        other = self._write("other.json", '{"actor": "misc.Sleep", "options": {}}')
+
+        self.cache.prefetch(
+            macro_loader._find_macros(
+                [self._macro(middle), self._macro(other)], {"NAME": "bob"}
+            )
+        )
+
+        self.assertEqual(
+            self.cache.get(middle, {"NAME": "bob"}),
+            self._macro(leaf, {"MSG": "bob"}),
+        )
+        self.assertEqual(
+            self.cache.get(other, {"NAME": "bob"}),
+            {"actor": "misc.Sleep", "options": {}},
+        )
+
+        # The leaf was found by parsing the middle script, and parsed in turn
+        leaf_config = self.cache.get(leaf, {"NAME": "bob", "MSG": "bob"})
+        self.assertEqual(leaf_config["options"], {"message": "bob"})
+
+        # Every caller gets a copy of its own
+        leaf_config["options"]["message"] = "changed"
+        self.assertEqual(
+            self.cache.get(leaf, {"NAME": "bob", "MSG": "bob"})["options"],
+            {"message": "bob"},
+        )
+
+        # But only for the tokens that it was parsed with
+        self.assertIsNone(self.cache.get(leaf, {"MSG": "bob"}))
+
+    def test_failures_are_left_to_the_caller(self):
+        broken = self._write("broken.json", "{nope")
+        missing_token = self._write("token.json", '{"a": "%MISSING%"}')
+        self.cache.prefetch([(broken, {}), (missing_token, {})])
+
+        self.assertIsNone(self.cache.get(broken, {}))
+        self.assertIsNone(self.cache.get(missing_token, {}))
+
+    def test_remote(self):
+        server = LocalHTTPServer()
+        self.addCleanup(server.stop)
+        server.routes["/macro.yaml"] = (200, {}, b"actor: misc.Note\n")
+
+        url = f"{server.url}/macro.yaml"
+        with mock.patch.object(
+            macro_loader, "REMOTE_MACROS", macro_loader._RemoteMacroCache()
+        ):
+            self.cache.prefetch([(url, {})])
+            self.assertEqual(self.cache.get(url, {}), {"actor": "misc.Note"})
+
+    def test_changed_script(self):
+        path = self._write("script.json", '{"a": 1}')
+        self.cache.prefetch([(path, {})])
+        self.assertEqual(self.cache.get(path, {}), {"a": 1})
+
+        self._write("script.json", '{"a": 12}')
+        self.assertIsNone(self.cache.get(path, {}))
+
+    def test_pool_is_shut_down(self):
+        paths = [self._write(f"{i}.json", "{}") for i in range(3)]
+        self.cache.prefetch((path, {}) for path in paths)
+        pool = self.cache._pool
+        for path in paths:
+            self.assertEqual(self.cache.get(path, {}), {})
+
+        # Once everything is parsed (and the callbacks, which may run just
+        # after get() returns, are done) the workers are let go.
+        deadline = time.monotonic() + 5
+        while self.cache._pool is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(self.cache._pool)
+        self.assertEqual(self.cache._pending, 0)
+        with self.assertRaises(RuntimeError):
+            pool.submit(print)
+
+    def test_threshold(self):
+        paths = [self._write(f"{i}.json", "{}") for i in range(3)]
+        with mock.patch.object(macro_loader, "MACRO_PARSE_THRESHOLD", 4):
+            self.cache.prefetch((path, {}) for path in paths)
+        self.assertEqual(self.cache._futures, {})
+        self.assertIsNone(self.cache._pool)
+
+    def test_disabled(self):
+        path = self._write("script.json", "{}")
+        with mock.patch.object(macro_loader, "MACRO_PARSE_WORKERS", 0):
+            self.cache.prefetch([(path, {})])
+        self.assertIsNone(self.cache.get(path, {}))
@@ -0,0 +1,217 @@
+import logging
+import os
+import socket
+import tempfile
+import unittest
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from botocore import exceptions as botocore_exceptions
+
+from kingpin.actors import exceptions, group, metrics
+from kingpin.actors.aws import api_call_queue
+from kingpin.actors.test.helper import FakeActor, fake
+
+log = logging.getLogger(__name__)
+
+
+class UDPListener:
+    """Collects the datagrams sent to a local UDP port."""
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(1)
+        self.port = self.socket.getsockname()[1]
+
+    def receive(self, count):
+        return [self.socket.recv(4096).decode() for _ in range(count)]
+
+    def receive_all(self):
+        lines = []
+        self.socket.settimeout(0.1)
+        try:
+            while True:
+                lines.append(self.socket.recv(4096).decode())
+        except TimeoutError:
+            return lines
+
+    def close(self):
+        self.socket.close()
+
+
+class TestStatsdExporter(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listener = UDPListener()
+        self.addCleanup(self.listener.close)
+        self.exporter = metrics.StatsdExporter("127.0.0.1", self.listener.port)
+        self.addCleanup(self.exporter.close)
+
+    def test_format(self):
+        self.exporter.increment("actors.completed", labels={"class": "Sleep"})
+        self.exporter.gauge("api_queue.delay", 0.25, {"queue": "q", "a": 1})
+        self.exporter.gauge("api_queue.depth", 3)
+        self.assertEqual(
+            self.listener.receive(3),
+            [
+                "kingpin.actors.completed:1|c|#class:Sleep",
+                "kingpin.api_queue.delay:0.25|g|#a:1,queue:q",
+                "kingpin.api_queue.depth:3|g",
+            ],
+        )
+
+    def test_unreachable(self):
+        exporter = metrics.StatsdExporter("127.0.0.1", 1)
+        self.addCleanup(exporter.close)
+        for _ in range(10):
+            exporter.increment("nobody.listening")
+
+    async def test_actors(self):
+        with mock.patch.object(metrics, "METRICS", self.exporter):
+            actor = group.Sync(
+                "Group",
+                {
+                    "acts": [
+                        fake("a"),
+                        fake("b", fail=True, warn_on_failure=True),
+                        fake("c", fail=True),
+                    ]
+                },
+            )
+            with self.assertRaises(exceptions.RecoverableActorFailure):
+                await actor.execute()
+
+        lines = self.listener.receive_all()
+        tags = "|#class:FakeActor,dry:false"
+        self.assertEqual(lines.count(f"kingpin.actors.running:1|g{tags}"), 3)
+        self.assertEqual(lines.count(f"kingpin.actors.running:0|g{tags}"), 3)
+        self.assertIn(f"kingpin.actors.completed:1|c{tags}", lines)
+        self.assertIn(f"kingpin.actors.warned:1|c{tags}", lines)
+        self.assertIn(f"kingpin.actors.failed:1|c{tags}", lines)
+        self.assertIn("kingpin.actors.failed:1|c|#class:Sync,dry:false", lines)
+
+
+class TestPrometheusExporter(unittest.TestCase):
+    def test_render(self):
+        exporter = metrics.PrometheusExporter()
+        exporter.increment("actors.completed", labels={"class": "Sleep"})
+        exporter.increment("actors.completed", labels={"class": "Sleep"})
+        exporter.increment("actors.completed", labels={"class": 'a"b'})
+        exporter.gauge("api_queue.delay", 0.5, {"queue": "q"})
+        exporter.gauge("api_queue.delay", 0.25, {"queue": "q"})
+
+        self.assertEqual(
+            exporter.render(),
+            "# TYPE kingpin_actors_completed_total counter\n"
+            'kingpin_actors_completed_total{class="Sleep"} 2\n'
+            'kingpin_actors_completed_total{class="a\\"b"} 1\n'
+            "# TYPE kingpin_api_queue_delay gauge\n"
+            'kingpin_api_queue_delay{queue="q"} 0.25\n',
+        )
+
+    def test_textfile(self):
+        path = os.path.join(tempfile.mkdtemp(), "kingpin.prom")
+        exporter = metrics.PrometheusExporter(path=path)
+        exporter.gauge("api_queue.depth", 1)
+        # Not rewritten again right away...
+        exporter.gauge("api_queue.depth", 2)
+        with open(path) as f:
+            self.assertIn("kingpin_api_queue_depth 1\n", f.read())
+
+        # ... but always when closed.
+        exporter.close()
+        with open(path) as f:
+            self.assertIn("kingpin_api_queue_depth 2\n", f.read())
+        self.assertFalse(os.path.exists(f"{path}.tmp"))
+
+    def test_http(self):
+        exporter = metrics.PrometheusExporter(address=("127.0.0.1", 0))
+        self.addCleanup(exporter.close)
+        exporter.increment("poll.iterations", labels={"class": "Stack"})
+
+        with urllib.request.urlopen(exporter.url, timeout=5) as response:
+            body = response.read().decode()
+        self.assertIn('kingpin_poll_iterations_total{class="Stack"} 1\n', body)
+
+
+class TestConfigure(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(metrics, "METRICS", metrics.NullExporter()))
+
+    def test_null(self):
+        self.assertIs(type(metrics.configure("")), metrics.NullExporter)
+
+    def test_statsd(self):
+        exporter = metrics.configure("statsd://127.0.0.1:9125")
+        self.addCleanup(exporter.close)
+        self.assertIsInstance(exporter, metrics.StatsdExporter)
+        self.assertEqual(exporter.address, ("127.0.0.1", 9125))
+        self.assertIs(metrics.METRICS, exporter)
+
+        exporter = metrics.configure("statsd://localhost")
+        self.addCleanup(exporter.close)
+        self.assertEqual(exporter.address, ("localhost", metrics.STATSD_PORT))
+
+    def test_prometheus(self):
+        exporter = metrics.configure("prometheus:///tmp/kingpin.prom")
+        self.assertEqual(exporter.path, "/tmp/kingpin.prom")
+        self.assertIsNone(exporter.url)
+
+        exporter = metrics.configure("prometheus://127.0.0.1:0")
+        self.addCleanup(exporter.close)
+        self.assertIsNone(exporter.path)
+        self.assertTrue(exporter.url.startswith("http://127.0.0.1:"))
+
+    def test_invalid(self):
+        for url in ("udp://host:1", "statsd://", "prometheus://host"):
+            with self.assertRaises(ValueError):
+                metrics.configure(url)
+
+
+class TestInstrumentation(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.exporter = metrics.PrometheusExporter()
+        self.enterContext(mock.patch.object(metrics, "METRICS", self.exporter))
+
+    async def test_api_call_queue(self):
+        queue = api_call_queue.ApiCallQueue("unit")
+        queue.delay_min = 0.01
+        self.addCleanup(queue._consumer_task.cancel)
+        throttled = botocore_exceptions.ClientError(
+            {"Error": {"Code": "Throttling"}}, "describe_stacks"
+        )
+        api_function = mock.Mock(side_effect=[throttled, throttled, "ok"])
+
+        await queue.call(api_function)
+
+        body = self.exporter.render()
+        self.assertIn('kingpin_api_queue_throttles_total{queue="unit"} 2\n', body)
+        self.assertIn('kingpin_api_queue_depth{queue="unit"} 0\n', body)
+        self.assertIn('kingpin_api_queue_delay{queue="unit"} 0.01\n', body)
+
+    async def test_executor_call(self):
+        executor = ThreadPoolExecutor(2, thread_name_prefix="unit")
+        self.addCleanup(executor.shutdown)
+        seen = []
+        with metrics.executor_call(executor):
+            with metrics.executor_call(executor):
+                with metrics.executor_call(executor):
+                    seen.append(self.exporter.render())
+
+        self.assertIn('kingpin_executor_in_flight{executor="unit"} 3\n', seen[0])
+        self.assertIn('kingpin_executor_saturation{executor="unit"} 1.5\n', seen[0])
+        body = self.exporter.render()
+        self.assertIn('kingpin_executor_in_flight{executor="unit"} 0\n', body)
+
+    def test_poll(self):
+        actor = FakeActor("unit", {})
+        metrics.poll(actor)
+        metrics.poll(actor)
+        self.assertIn(
+            'kingpin_poll_iterations_total{class="FakeActor"} 2\n',
+            self.exporter.render(),
+        )
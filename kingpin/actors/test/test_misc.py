@@ -1,12 +1,17 @@
 import importlib
+import json
 import logging
+import os
+import tempfile
 import unittest
 import urllib.error
 from unittest import mock
 from unittest.mock import AsyncMock
 
 from kingpin import exceptions as kingpin_exceptions
-from kingpin.actors import exceptions, misc
+from kingpin.actors import exceptions, group, macro_loader, misc
+from kingpin.actors.macro_loader import _RemoteMacroCache
+from kingpin.actors.test.test_http_client import LocalHTTPServer
 
 log = logging.getLogger(__name__)
 
@@ -108,15 +113,67 @@ class TestMacro(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(actor.initial_actor, sync_actor())
 
     def test_init_remote(self):
-        misc.Macro._get_config_from_script = mock.Mock()
-        misc.Macro._get_config_from_script.return_value = {}
+        server = LocalHTTPServer()
+        self.addCleanup(server.stop)
+        server.routes["/test.json"] = (200, {}, b'{"actor": "misc.Note"}')
+
         misc.Macro._check_schema = mock.Mock()
-        with mock.patch("kingpin.actors.utils.get_actor"):
-            with mock.patch("urllib.request.urlopen") as mock_urlopen:
-                mock_resp = mock.Mock()
-                mock_resp.read.return_value = b"foo"
-                mock_urlopen.return_value = mock_resp
-                misc.Macro("Unit Test", {"macro": "http://test.json", "tokens": {}})
+        with (
+            mock.patch("kingpin.actors.utils.get_actor") as get_actor,
+            mock.patch.object(macro_loader, "REMOTE_MACROS", _RemoteMacroCache()),
+        ):
+            misc.Macro("Unit Test", {"macro": f"{server.url}/test.json", "tokens": {}})
+        self.assertEqual(get_actor.call_args[0][0]["actor"], "misc.Note")
+
+    def test_init_remote_failure(self):
+        server = LocalHTTPServer()
+        self.addCleanup(server.stop)
+
+        with mock.patch.object(macro_loader, "REMOTE_MACROS", _RemoteMacroCache()):
+            with self.assertRaises(exceptions.UnrecoverableActorFailure):
+                misc.Macro("Unit Test", {"macro": f"{server.url}/missing.json"})
+
+    def test_init_tree_parsed_ahead(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        def write(name, config):
+            path = os.path.join(tmp.name, name)
+            with open(path, "w") as f:
+                f.write(config if isinstance(config, str) else json.dumps(config))
+            return path
+
+        def macro(path):
+            return {"actor": "misc.Macro", "options": {"macro": path}}
+
+        notes = [
+            write(
+                f"{i}.json",
+                {"actor": "misc.Note", "desc": str(i), "options": {"message": "%M%"}},
+            )
+            for i in range(5)
+        ]
+        outer = write(
+            "outer.json",
+            {"actor": "group.Sync", "options": {"acts": [macro(n) for n in notes]}},
+        )
+
+        scripts = macro_loader._ScriptCache()
+        with mock.patch.object(macro_loader, "SCRIPTS", scripts):
+            actor = misc.Macro("Unit Test", {"macro": outer, "tokens": {"M": "hi"}})
+
+        # Built in order, from the scripts that were parsed ahead of time
+        self.assertEqual(len(scripts._futures), 5)
+        self.assertEqual(
+            [a.initial_actor._desc for a in actor.initial_actor._actions],
+            ["0", "1", "2", "3", "4"],
+        )
+
+        # Errors are still raised by the Macro actor whose script is broken
+        write("3.json", "{broken")
+        with mock.patch.object(macro_loader, "SCRIPTS", macro_loader._ScriptCache()):
+            with self.assertRaisesRegex(exceptions.UnrecoverableActorFailure, "3.json"):
+                misc.Macro("Unit Test", {"macro": outer, "tokens": {"M": "hi"}})
 
     def test_init_dry(self):
         misc.Macro._check_macro = mock.Mock()
@@ -207,6 +264,20 @@ class TestMacro(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(len(actor.get_orgchart()), 3)  # Macro, Group, Sleep
         self.assertEqual(type(actor.get_orgchart()[0]), dict)
 
+    def test_get_actors(self):
+
+        misc.Macro._get_macro = mock.Mock(name="unittestmacro")
+        misc.Macro._get_config_from_script = mock.Mock(
+            return_value=[{"actor": "misc.Sleep", "options": {"sleep": 0}}]
+        )
+        actor = misc.Macro("Unit test", {"macro": "test"})
+
+        actors = actor.get_actors()
+        self.assertEqual(
+            [type(a) for a in actors], [misc.Macro, group.Sync, misc.Sleep]
+        )
+        self.assertEqual(actors[0], actor)
+
 
 class TestSleep(unittest.IsolatedAsyncioTestCase):
     async def test_execute(self):
@@ -253,6 +324,19 @@ class TestGenericHTTP(unittest.IsolatedAsyncioTestCase):
 
         await actor.execute()
 
+    async def test_execute_retries(self):
+        actor = misc.GenericHTTP(
+            "Unit Test Action",
+            {"url": "http://example.com", "retries": 2, "idempotency-key": "abc"},
+        )
+        actor._fetch = AsyncMock(return_value={})
+
+        await actor.execute()
+
+        kwargs = actor._fetch.call_args.kwargs
+        self.assertEqual(kwargs["headers"], {"Idempotency-Key": "abc"})
+        self.assertEqual(kwargs["retry"].max_attempts, 3)
+
     async def test_execute_fail(self):
         actor = misc.GenericHTTP("Unit Test Action", {"url": "http://example.com"})
         error = urllib.error.HTTPError(
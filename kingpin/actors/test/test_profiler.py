@@ -0,0 +1,213 @@
+import logging
+import unittest
+from unittest import mock
+
+import boto3
+from botocore import exceptions as botocore_exceptions
+
+from kingpin.actors import base, exceptions, group, profiler
+from kingpin.actors.aws import api_call_queue
+from kingpin.actors.test.helper import FakeActor, fake
+
+log = logging.getLogger(__name__)
+
+
+class TestRunProfiler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profiler = profiler.RunProfiler()
+        self.profiler.enable()
+        self.enterContext(mock.patch.object(profiler, "PROFILER", self.profiler))
+
+    async def test_report_tree(self):
+        actor = group.Sync(
+            "Outer",
+            {
+                "acts": [
+                    fake("a"),
+                    {
+                        "actor": "group.Async",
+                        "desc": "inner",
+                        "options": {"acts": [fake("b"), fake("c")]},
+                    },
+                ]
+            },
+        )
+        await actor.execute()
+
+        report = self.profiler.report(actor)
+        self.assertEqual(len(report["actors"]), 1)
+        outer = report["actors"][0]
+        self.assertEqual(outer["desc"], "Outer")
+        self.assertEqual(outer["stats"]["status"], "ok")
+        self.assertEqual([c["desc"] for c in outer["children"]], ["a", "inner"])
+        inner = outer["children"][1]
+        self.assertEqual([c["desc"] for c in inner["children"]], ["b", "c"])
+
+        # Each actor's calls are recorded against it, not its group
+        a = outer["children"][0]["stats"]
+        self.assertEqual(a["api_calls"], {"unit.call": 1})
+        self.assertEqual(a["api_time"], 0.5)
+        self.assertEqual(a["retries"], 1)
+        self.assertGreaterEqual(a["sleep"], 0.01)
+        self.assertEqual(outer["stats"]["api_calls"], {})
+        self.assertGreaterEqual(outer["stats"]["wall"], a["wall"])
+
+        totals = report["totals"]
+        self.assertEqual(totals["actors"], 5)
+        self.assertEqual(totals["api_calls"], {"unit.call": 3})
+        self.assertEqual(totals["retries"], 3)
+
+    async def test_status(self):
+        actor = group.Sync(
+            "Outer",
+            {"acts": [fake("warns", fail=True, warn_on_failure=True), fake("b")]},
+        )
+        await actor.execute()
+        failing = group.Sync("Failing", {"acts": [fake("fails", fail=True)]})
+        with self.assertRaises(exceptions.RecoverableActorFailure):
+            await failing.execute()
+
+        children = self.profiler.report(actor)["actors"][0]["children"]
+        self.assertEqual(children[0]["stats"]["status"], "warned")
+        self.assertEqual(children[1]["stats"]["status"], "ok")
+
+        # Only the actors under the one reported on are included
+        report = self.profiler.report(failing)
+        self.assertEqual(report["totals"]["actors"], 2)
+        self.assertEqual(report["actors"][0]["stats"]["status"], "failed")
+
+    async def test_not_executed(self):
+        actor = group.Sync("Outer", {"acts": [fake("fails", fail=True), fake("never")]})
+        with self.assertRaises(exceptions.RecoverableActorFailure):
+            await actor.execute()
+
+        children = self.profiler.report(actor)["actors"][0]["children"]
+        self.assertIsNone(children[1]["stats"])
+
+    async def test_disabled(self):
+        self.profiler.enabled = False
+        actor = FakeActor("a", {})
+        await actor.execute()
+        self.assertEqual(self.profiler.report(actor)["totals"]["actors"], 0)
+
+    async def test_api_call_queue(self):
+        queue = api_call_queue.ApiCallQueue()
+        queue.delay_min = 0.01
+        throttled = botocore_exceptions.ClientError(
+            {"Error": {"Code": "Throttling"}}, "describe_stacks"
+        )
+        api_function = mock.Mock(side_effect=[throttled, "ok"], __name__="describe")
+
+        class Caller(base.BaseActor):
+            async def _execute(self):
+                return await queue.call(api_function)
+
+        actor = Caller("caller", {})
+        await actor.execute()
+        queue._consumer_task.cancel()
+
+        # The work done by the queue's consumer is recorded against the actor
+        stats = self.profiler.report(actor)["actors"][0]["stats"]
+        self.assertEqual(stats["api_calls"], {"describe": 2})
+        self.assertEqual(stats["throttles"], 1)
+        self.assertGreaterEqual(stats["sleep"], 0.01)
+        self.assertGreaterEqual(stats["queue_wait"], 0)
+
+
+class TestTrace(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profiler = profiler.RunProfiler()
+        self.profiler.enable()
+        self.enterContext(mock.patch.object(profiler, "PROFILER", self.profiler))
+
+    async def _run(self):
+        actor = group.Sync(
+            "Outer",
+            {
+                "acts": [
+                    fake("first"),
+                    {
+                        "actor": "group.Async",
+                        "desc": "inner",
+                        "options": {"acts": [fake("slow", sleep=0.1), fake("fast")]},
+                    },
+                    fake("last"),
+                ]
+            },
+        )
+        await actor.execute()
+        return actor
+
+    async def test_critical_path(self):
+        actor = await self._run()
+        path = self.profiler.critical_path(actor)
+        self.assertEqual([r.desc for r in path], ["first", "slow", "last"])
+
+    async def test_critical_path_empty(self):
+        self.assertEqual(self.profiler.critical_path(FakeActor("a", {})), [])
+        self.assertEqual(self.profiler.trace(FakeActor("a", {}))["traceEvents"], [])
+
+    async def test_trace(self):
+        actor = await self._run()
+        trace = self.profiler.trace(actor)
+
+        self.assertEqual(
+            [s["desc"] for s in trace["criticalPath"]], ["first", "slow", "last"]
+        )
+
+        events = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+        actors = {e["name"]: e for e in events if e["cat"] == "actor"}
+        self.assertEqual(
+            set(actors), {"Outer", "inner", "first", "slow", "fast", "last"}
+        )
+        self.assertTrue(actors["slow"]["args"]["critical"])
+        self.assertFalse(actors["fast"]["args"]["critical"])
+
+        # Actors that ran one after the other share a lane, actors that ran
+        # side by side don't.
+        self.assertEqual(actors["first"]["tid"], actors["Outer"]["tid"])
+        self.assertEqual(actors["last"]["tid"], actors["Outer"]["tid"])
+        self.assertNotEqual(actors["slow"]["tid"], actors["fast"]["tid"])
+        self.assertNotEqual(actors["Outer"]["tid"], 0)
+
+        critical = [e["name"] for e in events if e["tid"] == 0]
+        self.assertEqual(critical, ["first", "slow", "last"])
+
+        # Sleeps and API calls are drawn under their actors
+        self.assertEqual(len([e for e in events if e["cat"] == "sleep"]), 4)
+        self.assertEqual(len([e for e in events if e["cat"] == "api"]), 4)
+
+        # Every lane nests neatly
+        for lane in {e["tid"] for e in events}:
+            stack = []
+            for e in sorted(
+                (e for e in events if e["tid"] == lane),
+                key=lambda e: (e["ts"], -e["dur"]),
+            ):
+                while stack and stack[-1] <= e["ts"]:
+                    stack.pop()
+                if stack:
+                    self.assertLessEqual(e["ts"] + e["dur"], stack[-1])
+                stack.append(e["ts"] + e["dur"])
+
+        names = [e for e in trace["traceEvents"] if e["name"] == "thread_name"]
+        self.assertEqual(names[0]["args"]["name"], "critical path")
+
+
+class TestOperationName(unittest.TestCase):
+    def test_boto3_client_method(self):
+        client = boto3.client(
+            "cloudformation",
+            region_name="us-east-1",
+            aws_access_key_id="unit",
+            aws_secret_access_key="unit",
+        )
+        self.assertEqual(
+            profiler.operation_name(client.describe_stacks),
+            "cloudformation.describe_stacks",
+        )
+
+    def test_plain_function(self):
+        self.assertEqual(profiler.operation_name(len), "len")
@@ -10,7 +10,9 @@ import sys
 
 from kingpin import utils
 from kingpin.actors import exceptions as actor_exceptions
+from kingpin.actors import journal, metrics, profiler
 from kingpin.actors import utils as actor_utils
+from kingpin.actors.aws import cloudformation, iam
 from kingpin.actors.misc import Macro
 from kingpin.version import __version__
 
@@ -79,6 +81,59 @@ parser.add_argument(
     dest="orgchart",
     help="Save the orgchart into file. Requires --build-only",
 )
+parser.add_argument(
+    "--preflight",
+    dest="preflight",
+    action="store_true",
+    help="Validate all CloudFormation templates before executing any actors",
+)
+parser.add_argument(
+    "--journal",
+    dest="journal",
+    nargs="?",
+    const=journal.DEFAULT_JOURNAL,
+    help=(
+        "Record every actor that completes successfully in a journal file "
+        f"(default: {journal.DEFAULT_JOURNAL}), so that the run can be resumed "
+        "with --resume if it fails"
+    ),
+)
+parser.add_argument(
+    "--resume",
+    dest="resume",
+    action="store_true",
+    help=(
+        "Skip the actors that a previous run recorded as completed in its "
+        "journal (see --journal), unless they have changed since"
+    ),
+)
+parser.add_argument(
+    "--profile",
+    dest="profile",
+    help=(
+        "Save a profile of the run into file: where each actor spent its "
+        "time, and the API calls it made"
+    ),
+)
+parser.add_argument(
+    "--trace",
+    dest="trace",
+    help=(
+        "Save a timeline of the run into file, along with its critical path, "
+        "in the Chrome trace event format (for chrome://tracing, Perfetto or "
+        "speedscope)"
+    ),
+)
+parser.add_argument(
+    "--metrics",
+    dest="metrics",
+    default=metrics.KINGPIN_METRICS,
+    help=(
+        "Send live metrics about the run to statsd://host:port, a Prometheus "
+        "textfile (prometheus:///path/to/file.prom) or a Prometheus HTTP "
+        "endpoint (prometheus://host:port). Defaults to $KINGPIN_METRICS"
+    ),
+)
 
 # Logging Configuration
 parser.add_argument(
@@ -146,6 +201,81 @@ def _write_orgchart(path, data):
         output.write(json.dumps(data))
 
 
+def _write_profile(path, actor):
+    log.info(f"Writing the profile of the run into {path}")
+    with open(path, "w") as output:
+        output.write(json.dumps(profiler.PROFILER.report(actor), indent=2))
+
+
+def _write_trace(path, actor):
+    trace = profiler.PROFILER.trace(actor)
+    log.info("Critical path of the run:")
+    for step in trace["criticalPath"]:
+        log.info(f"  {step['wall']:>10.2f}s  {step['desc']}")
+
+    log.info(f"Writing the timeline of the run into {path}")
+    with open(path, "w") as output:
+        output.write(json.dumps(trace))
+
+
+async def preflight(actor):
+    """Runs the optional preflight checks against a fully built actor tree."""
+    if not args.preflight:
+        return
+
+    log.info("Preflight checks...")
+    try:
+        await cloudformation.preflight(actor.get_actors())
+    except actor_exceptions.ActorException as e:
+        log.critical("Preflight failed. Reason:")
+        log.critical(e)
+        sys.exit(2)
+
+
+async def rehearse():
+    """Does a dry run first, unless this is a dry run (or SKIP_DRY is set)."""
+    if args.dry:
+        return
+
+    # Lets maybe do a dry run first anyways...
+    skip_dry = False
+    try:
+        skip_dry = utils.str2bool(os.getenv("SKIP_DRY", "False"), strict=True)
+    except ValueError:
+        log.warning("SKIP_DRY is not a valid boolean-like. Defaulting to False.")
+        pass
+
+    if skip_dry:
+        # Okay, the user really does not want to do a dry run... fine
+        log.warning("")
+        log.warning("*** You have disabled the pre-check dry run.")
+        log.warning("*** Execution will begin with no expectation of success.")
+        log.warning("")
+    else:
+        log.info("Rehearsing... Break a leg!")
+
+        # Hold on to the CloudFormation Change Sets generated during the
+        # rehearsal so that the performance can execute them directly.
+        cloudformation.KEEP_DRY_CHANGE_SETS = True
+
+        try:
+            dry_actor = get_main_actor(dry=True)
+            await preflight(dry_actor)
+            await dry_actor.execute()
+        except actor_exceptions.ActorException as e:
+            log.critical("Dry run failed. Reason:")
+            log.critical(e)
+            sys.exit(2)
+        finally:
+            cloudformation.KEEP_DRY_CHANGE_SETS = False
+
+        # The IAM snapshot read during the rehearsal may be stale by now, so
+        # the performance reads its own.
+        iam.IAM_SNAPSHOT.forget()
+
+        log.info("Rehearsal OK! Performing!")
+
+
 async def main():
 
     if args.actor and args.explain:
@@ -170,48 +300,48 @@ async def main():
 
             _write_orgchart(args.orgchart, orgdata)
 
-        sys.exit(0)
+        await preflight(actor)
 
-    if not args.dry:
-        # Lets maybe do a dry run first anyways...
-        skip_dry = False
-        try:
-            skip_dry = utils.str2bool(os.getenv("SKIP_DRY", "False"), strict=True)
-        except ValueError:
-            log.warning("SKIP_DRY is not a valid boolean-like. Defaulting to False.")
-            pass
-
-        if skip_dry:
-            # Okay, the user really does not want to do a dry run... fine
-            log.warning("")
-            log.warning("*** You have disabled the pre-check dry run.")
-            log.warning("*** Execution will begin with no expectation of success.")
-            log.warning("")
-        else:
-            log.info("Rehearsing... Break a leg!")
+        sys.exit(0)
 
-            try:
-                dry_actor = get_main_actor(dry=True)
-                await dry_actor.execute()
-            except actor_exceptions.ActorException as e:
-                log.critical("Dry run failed. Reason:")
-                log.critical(e)
-                sys.exit(2)
+    try:
+        metrics.configure(args.metrics)
+    except (ValueError, OSError) as e:
+        kingpin_fail(str(e))
 
-            log.info("Rehearsal OK! Performing!")
+    if args.journal or args.resume:
+        journal.JOURNAL.open(args.journal or journal.DEFAULT_JOURNAL, args.resume)
 
-    # Begin doing real stuff!
+    # Any Change Sets held on to by the rehearsal are deleted once we're done,
+    # whether or not the performance ever got to use them.
+    runner = None
     try:
-        runner = get_main_actor(dry=args.dry)
+        await rehearse()
 
-        log.info("")
-        log.warning("Lights, camera ... action!")
-        log.info("")
-        await runner.execute()
-    except actor_exceptions.ActorException as e:
-        log.error("Kingpin encountered mistakes during the play.")
-        log.error(e)
-        sys.exit(2)
+        # Begin doing real stuff! Only this run is profiled, not the rehearsal.
+        if args.profile or args.trace:
+            profiler.PROFILER.enable()
+
+        try:
+            runner = get_main_actor(dry=args.dry)
+            await preflight(runner)
+
+            log.info("")
+            log.warning("Lights, camera ... action!")
+            log.info("")
+            await runner.execute()
+        except actor_exceptions.ActorException as e:
+            log.error("Kingpin encountered mistakes during the play.")
+            log.error(e)
+            sys.exit(2)
+    finally:
+        await cloudformation.delete_dry_change_sets()
+        journal.JOURNAL.close()
+        metrics.METRICS.close()
+        if args.profile and runner is not None:
+            _write_profile(args.profile, runner)
+        if args.trace and runner is not None:
+            _write_trace(args.trace, runner)
 
 
 def begin():
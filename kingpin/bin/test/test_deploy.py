@@ -1,7 +1,9 @@
 import asyncio
 import importlib
+import json
 import os
 import sys
+import tempfile
 import unittest
 from unittest import mock
 
@@ -95,6 +97,51 @@ class TestDeploy(unittest.TestCase):
             asyncio.run(self.kingpin_bin_deploy.main())
             mock_get_main_actor.assert_called()
 
+    @mock.patch("sys.argv", ["kingpin"])
+    def test_main_cleans_up_dry_change_sets(self):
+        self._import_kingpin_bin_deploy()
+        with (
+            mock.patch("kingpin.bin.deploy.get_main_actor") as mock_get_main_actor,
+            mock.patch(
+                "kingpin.actors.aws.cloudformation.delete_dry_change_sets",
+                new_callable=mock.AsyncMock,
+            ) as mock_delete,
+            mock.patch("kingpin.actors.aws.iam.IAM_SNAPSHOT.forget") as mock_forget,
+        ):
+            mock_get_main_actor.return_value = Sleep(options={"sleep": 0.1}, dry=True)
+            asyncio.run(self.kingpin_bin_deploy.main())
+            mock_delete.assert_awaited_once()
+
+            # The performance doesn't reuse the rehearsal's IAM snapshot.
+            mock_forget.assert_called_once_with()
+
+        from kingpin.actors.aws import cloudformation
+
+        self.assertFalse(cloudformation.KEEP_DRY_CHANGE_SETS)
+
+    @mock.patch("sys.argv", ["kingpin"])
+    def test_main_cleans_up_dry_change_sets_after_failed_rehearsal(self):
+        for error, code in ((ActorException("testing"), 2), (RuntimeError(), None)):
+            self._import_kingpin_bin_deploy()
+            with (
+                mock.patch("kingpin.bin.deploy.get_main_actor") as mock_get_main_actor,
+                mock.patch(
+                    "kingpin.actors.aws.cloudformation.delete_dry_change_sets",
+                    new_callable=mock.AsyncMock,
+                ) as mock_delete,
+            ):
+                dry_actor = Sleep(options={"sleep": 0}, dry=True)
+                dry_actor.execute = mock.AsyncMock(side_effect=error)
+                mock_get_main_actor.return_value = dry_actor
+                with self.assertRaises((SystemExit, RuntimeError)) as cm:
+                    asyncio.run(self.kingpin_bin_deploy.main())
+                if code:
+                    self.assertEqual(cm.exception.code, code)
+
+                # The real run never started
+                mock_get_main_actor.assert_called_once_with(dry=True)
+                mock_delete.assert_awaited_once()
+
     @mock.patch("sys.argv", ["kingpin"])
     @mock.patch.dict(os.environ, {"SKIP_DRY": "True"})
     def test_main_with_skip_dry(self):
@@ -113,6 +160,84 @@ class TestDeploy(unittest.TestCase):
             asyncio.run(self.kingpin_bin_deploy.main())
             mock_get_main_actor.assert_called()
 
+    @mock.patch("sys.argv", ["kingpin", "--journal", "unit.journal", "--resume"])
+    def test_main_with_journal(self):
+        self._import_kingpin_bin_deploy()
+        journal = self.kingpin_bin_deploy.journal
+        with (
+            mock.patch("kingpin.bin.deploy.get_main_actor") as mock_get_main_actor,
+            mock.patch.object(journal, "JOURNAL") as mock_journal,
+        ):
+            mock_get_main_actor.return_value = Sleep(options={"sleep": 0.1}, dry=True)
+            asyncio.run(self.kingpin_bin_deploy.main())
+
+        mock_journal.open.assert_called_once_with("unit.journal", True)
+        mock_journal.close.assert_called_once_with()
+
+    @mock.patch("sys.argv", ["kingpin", "--resume"])
+    def test_main_with_resume_default_journal(self):
+        self._import_kingpin_bin_deploy()
+        journal = self.kingpin_bin_deploy.journal
+        with (
+            mock.patch("kingpin.bin.deploy.get_main_actor") as mock_get_main_actor,
+            mock.patch.object(journal, "JOURNAL") as mock_journal,
+        ):
+            mock_get_main_actor.return_value = Sleep(options={"sleep": 0.1}, dry=True)
+            asyncio.run(self.kingpin_bin_deploy.main())
+
+        mock_journal.open.assert_called_once_with(journal.DEFAULT_JOURNAL, True)
+
+    def test_main_with_profile(self):
+        path = os.path.join(tempfile.mkdtemp(), "profile.json")
+        with mock.patch("sys.argv", ["kingpin", "--profile", path]):
+            self._import_kingpin_bin_deploy()
+        profiler = self.kingpin_bin_deploy.profiler
+        with (
+            mock.patch("kingpin.bin.deploy.get_main_actor") as mock_get_main_actor,
+            mock.patch.object(profiler, "PROFILER", profiler.RunProfiler()),
+        ):
+            mock_get_main_actor.side_effect = lambda dry: Sleep(
+                desc="nap", options={"sleep": 0}, dry=dry
+            )
+            asyncio.run(self.kingpin_bin_deploy.main())
+
+        with open(path) as f:
+            report = json.load(f)
+
+        # Only the real run is profiled, not the rehearsal
+        self.assertEqual(report["totals"]["actors"], 1)
+        self.assertEqual(report["actors"][0]["desc"], "nap")
+        self.assertEqual(report["actors"][0]["stats"]["status"], "ok")
+
+    def test_main_with_trace(self):
+        path = os.path.join(tempfile.mkdtemp(), "trace.json")
+        with mock.patch("sys.argv", ["kingpin", "--trace", path]):
+            self._import_kingpin_bin_deploy()
+        profiler = self.kingpin_bin_deploy.profiler
+        with (
+            mock.patch("kingpin.bin.deploy.get_main_actor") as mock_get_main_actor,
+            mock.patch.object(profiler, "PROFILER", profiler.RunProfiler()),
+        ):
+            mock_get_main_actor.side_effect = lambda dry: Sleep(
+                desc="nap", options={"sleep": 0}, dry=dry
+            )
+            asyncio.run(self.kingpin_bin_deploy.main())
+
+        with open(path) as f:
+            trace = json.load(f)
+
+        self.assertEqual([s["desc"] for s in trace["criticalPath"]], ["nap"])
+        self.assertIn("nap", [e["name"] for e in trace["traceEvents"]])
+
+    @mock.patch("sys.argv", ["kingpin", "--metrics", "bogus://"])
+    def test_main_with_bad_metrics(self):
+        self._import_kingpin_bin_deploy()
+        with mock.patch("kingpin.bin.deploy.get_main_actor") as mock_get_main_actor:
+            with self.assertRaises(SystemExit) as cm:
+                asyncio.run(self.kingpin_bin_deploy.main())
+            self.assertEqual(cm.exception.code, 1)
+            mock_get_main_actor.assert_not_called()
+
     @mock.patch("sys.argv", ["kingpin"])
     def test_main_with_bad_runner(self):
         self._import_kingpin_bin_deploy()
@@ -202,6 +327,50 @@ class TestDeploy(unittest.TestCase):
                 asyncio.run(self.kingpin_bin_deploy.main())
                 self.assertEqual(cm.exception.code, 2)
 
+    @mock.patch(
+        "sys.argv",
+        [
+            "kingpin",
+            "--dry",
+            "--preflight",
+            "--actor",
+            "misc.Sleep",
+            "--option",
+            "sleep=0",
+        ],
+    )
+    def test_main_with_preflight(self):
+        self._import_kingpin_bin_deploy()
+        with mock.patch(
+            "kingpin.actors.aws.cloudformation.preflight", new_callable=mock.AsyncMock
+        ) as mock_preflight:
+            asyncio.run(self.kingpin_bin_deploy.main())
+            mock_preflight.assert_awaited_once()
+            actors = mock_preflight.call_args[0][0]
+            self.assertEqual([type(a).__name__ for a in actors], ["Sleep"])
+
+    @mock.patch(
+        "sys.argv",
+        [
+            "kingpin",
+            "--dry",
+            "--preflight",
+            "--actor",
+            "misc.Sleep",
+            "--option",
+            "sleep=0",
+        ],
+    )
+    def test_main_with_preflight_failure(self):
+        self._import_kingpin_bin_deploy()
+        with mock.patch(
+            "kingpin.actors.aws.cloudformation.preflight",
+            side_effect=ActorException("testing"),
+        ):
+            with self.assertRaises(SystemExit) as cm:
+                asyncio.run(self.kingpin_bin_deploy.main())
+            self.assertEqual(cm.exception.code, 2)
+
     ############################################################################
     #  begin
     ############################################################################
@@ -1,14 +1,19 @@
 import asyncio
 import importlib
 import io
+import json
 import logging
 import os
+import re
+import tempfile
 import time
 import unittest
 from unittest import mock
 
 import rainbow_logging_handler
 import requests
+import yaml
+from cfn_tools.yaml_loader import CfnYamlLoader
 
 from kingpin import exceptions, utils
 from kingpin.actors import misc
@@ -172,6 +177,115 @@ class TestUtils(unittest.TestCase):
         with self.assertRaises(exceptions.InvalidScript):
             utils.load_json_with_tokens(instance, {})
 
+    def test_load_yaml_cfn_tags(self):
+        doc = """
+        base: &base
+          a: 1
+          b: 2
+        merged:
+          <<: *base
+          b: 3
+        ref: !Ref Bucket
+        att: !GetAtt Bucket.Arn
+        att_list: !GetAtt [Bucket, Arn]
+        sub: !Sub "${AWS::Region}-x"
+        join: !Join ["-", [a, !Ref B]]
+        if: !If [Cond, {x: 1}, !Ref AWS::NoValue]
+        """
+        ret = utils.load_yaml(doc)
+        self.assertEqual(ret["merged"], {"a": 1, "b": 3})
+        self.assertEqual(ret["ref"], {"Ref": "Bucket"})
+        self.assertEqual(ret["att"], {"Fn::GetAtt": ["Bucket", "Arn"]})
+        self.assertEqual(ret["att_list"], {"Fn::GetAtt": ["Bucket", "Arn"]})
+        self.assertEqual(ret["sub"], {"Fn::Sub": "${AWS::Region}-x"})
+        self.assertEqual(ret["join"], {"Fn::Join": ["-", ["a", {"Ref": "B"}]]})
+        self.assertEqual(
+            ret["if"], {"Fn::If": ["Cond", {"x": 1}, {"Ref": "AWS::NoValue"}]}
+        )
+        self.assertEqual(ret, yaml.load(doc, Loader=CfnYamlLoader))
+
+    def test_load_yaml_parity(self):
+        # The libyaml loader must parse every example exactly like the
+        # pure-Python one does.
+        self.assertIsNot(utils.YAML_LOADER, CfnYamlLoader)
+
+        examples = os.path.join(os.path.dirname(__file__), "../../examples")
+        paths = []
+        for root, _, files in os.walk(examples):
+            paths += [os.path.join(root, f) for f in files if f.endswith(".yaml")]
+        self.assertGreater(len(paths), 5)
+
+        for path in sorted(paths):
+            with open(path) as f:
+                # Fill in %TOKENS% with something that's valid YAML
+                raw = re.sub(r"%\w+%", "x", f.read())
+            with self.subTest(path=path):
+                fast = utils.load_yaml(raw)
+                slow = yaml.load(raw, Loader=CfnYamlLoader)
+                self.assertEqual(fast, slow)
+                self.assertEqual(
+                    json.dumps(fast, default=str), json.dumps(slow, default=str)
+                )
+
+    def test_load_yaml_errors(self):
+        for doc in ("a: [1", "a: b: c", "- a\nb: c", "a: 'b", "*missing"):
+            with self.subTest(doc=doc):
+                with self.assertRaises(yaml.YAMLError) as fast:
+                    utils.load_yaml(doc)
+                with self.assertRaises(yaml.YAMLError) as slow:
+                    yaml.load(doc, Loader=CfnYamlLoader)
+                self.assertIs(type(fast.exception), type(slow.exception))
+
+    def _write_records(self, name, contents):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, name)
+        with open(path, "w") as f:
+            f.write(contents)
+        return path
+
+    def test_iter_records_with_tokens_jsonl(self):
+        path = self._write_records(
+            "contexts.jsonl", '{"a": "1"}\n\n{"a": "%TOKEN%", "b": 2}\n'
+        )
+        records = utils.iter_records_with_tokens(path, {"TOKEN": "x"})
+        self.assertEqual(list(records), [{"a": "1"}, {"a": "x", "b": 2}])
+
+    def test_iter_records_with_tokens_csv(self):
+        path = self._write_records(
+            "contexts.csv", 'a,b\n1,"two, three"\n%TOKEN%,"multi\nline"\n'
+        )
+        records = utils.iter_records_with_tokens(path, {"TOKEN": "x"})
+        self.assertEqual(
+            list(records),
+            [{"a": "1", "b": "two, three"}, {"a": "x", "b": "multi\nline"}],
+        )
+
+    def test_iter_records_with_tokens_is_lazy(self):
+        path = self._write_records("contexts.jsonl", '{"a": 1}\njunk\n')
+        records = utils.iter_records_with_tokens(path, {})
+        self.assertEqual(next(records), {"a": 1})
+        with self.assertRaisesRegex(exceptions.InvalidScript, "line 2"):
+            next(records)
+
+    def test_iter_records_with_tokens_errors(self):
+        bad = {
+            "not_object.jsonl": "[1, 2]\n",
+            "short.csv": "a,b\n1\n",
+            "long.csv": "a,b\n1,2,3\n",
+            "missing_token.jsonl": '{"a": "%NOPE%"}\n',
+        }
+        for name, contents in bad.items():
+            with self.subTest(name=name):
+                path = self._write_records(name, contents)
+                with self.assertRaises((exceptions.InvalidScript, LookupError)):
+                    list(utils.iter_records_with_tokens(path, {}))
+
+        with self.assertRaises(exceptions.InvalidScript):
+            list(utils.iter_records_with_tokens("/does/not/exist.jsonl", {}))
+        with self.assertRaises(exceptions.InvalidScriptName):
+            list(utils.iter_records_with_tokens("contexts.json", {}))
+
     def test_exception_logger(self):
         patch = mock.patch.object(utils.logging, "getLogger")
         with patch as logger:
@@ -321,3 +435,55 @@ class TestCoroutineHelpers(unittest.IsolatedAsyncioTestCase):
 
         self.assertEqual(None, utils.diff_dicts(p1, p1))
         self.assertNotEqual(None, utils.diff_dicts(p1, p2))
+
+    def test_diff_dicts_ignores_ordering(self):
+        p1 = {"a": [{"x": 1, "y": [3, 2, 1]}, "b"], "c": None}
+        p2 = {"c": None, "a": ["b", {"y": [1, 2, 3], "x": 1}]}
+
+        self.assertEqual(None, utils.diff_dicts(p1, p2))
+
+    def test_diff_dicts_paths(self):
+        p1 = {
+            "Resources": {
+                "Foo": {"Properties": {"X": "a"}},
+                "Gone": {"Type": "AWS::S3::Bucket"},
+            }
+        }
+        p2 = {
+            "Resources": {
+                "Foo": {"Properties": {"X": "b"}},
+                "New": {"Type": "AWS::SQS::Queue"},
+            }
+        }
+
+        self.assertEqual(
+            utils.diff_dicts(p1, p2).split("\n"),
+            [
+                'Resources.Foo.Properties.X: "a" -> "b"',
+                '- Resources.Gone: {"Type": "AWS::S3::Bucket"}',
+                '+ Resources.New: {"Type": "AWS::SQS::Queue"}',
+            ],
+        )
+
+    def test_diff_dicts_lists(self):
+        # A single changed list item is diffed in place
+        p1 = {"Statement": [{"Effect": "Allow", "Action": "s3:Get"}, "same"]}
+        p2 = {"Statement": ["same", {"Effect": "Deny", "Action": "s3:Get"}]}
+        self.assertEqual(
+            utils.diff_dicts(p1, p2), 'Statement[1].Effect: "Allow" -> "Deny"'
+        )
+
+        # Duplicates count, and multiple changes are listed individually
+        p1 = {"a": [1, 1, 2]}
+        p2 = {"a": [1, 3, 4]}
+        self.assertEqual(
+            utils.diff_dicts(p1, p2).split("\n"),
+            ["- a[]: 1", "- a[]: 2", "+ a[1]: 3", "+ a[2]: 4"],
+        )
+
+    def test_diff_dicts_mismatched_types(self):
+        self.assertEqual(utils.diff_dicts(None, {}), "<root>: null -> {}")
+        self.assertEqual(
+            utils.diff_dicts([{"a": 1}], {"a": 1}), '<root>: [{"a": 1}] -> {"a": 1}'
+        )
+        self.assertEqual(utils.diff_dicts({"a": "1"}, {"a": 1}), 'a: "1" -> 1')
@@ -6,25 +6,26 @@ Common package for utility functions.
 """
 
 import asyncio
+import collections
+import csv
 import datetime
-import difflib
 import functools
 import http.client
 import importlib
 import json
 import logging
 import os
-import pprint
 import re
 import sys
 from io import IOBase
 from json.decoder import JSONDecodeError
 from logging import handlers
 
-import cfn_tools
 import rainbow_logging_handler
+import yaml
 from cfn_tools.yaml_loader import CfnYamlLoader
 from cfn_tools.yaml_loader import construct_mapping as aws_construct_mapping
+from cfn_tools.yaml_loader import multi_constructor as aws_multi_constructor
 
 from kingpin import exceptions
 
@@ -60,6 +61,34 @@ def construct_mapping(self, node, deep=False):
 CfnYamlLoader.add_constructor("tag:yaml.org,2002:map", construct_mapping)
 
 
+# CfnYamlLoader is built on the pure-Python YAML parser, which is where most of
+# the time spent loading a large YAML script goes. When PyYAML was built with
+# libyaml, use the same constructors on top of its C parser instead.
+if getattr(yaml, "__with_libyaml__", False):
+
+    class CfnCYamlLoader(yaml.CSafeLoader):
+        """A libyaml-based equivalent of CfnYamlLoader."""
+
+    CfnCYamlLoader.add_constructor("tag:yaml.org,2002:map", construct_mapping)
+    CfnCYamlLoader.add_multi_constructor("!", aws_multi_constructor)
+
+    YAML_LOADER = CfnCYamlLoader
+else:  # pragma: no cover
+    YAML_LOADER = CfnYamlLoader
+
+
+def load_yaml(source):
+    """Parses a YAML document, CloudFormation short-form tags and all.
+
+    Args:
+        source: YAML string or stream.
+
+    Returns:
+        The parsed document.
+    """
+    return yaml.load(source, Loader=YAML_LOADER)
+
+
 def str_to_class(string: str) -> type:
     """Method that converts a string name into a usable Class name
 
@@ -358,7 +387,7 @@ def load_json_with_tokens(
         if suffix == "json":
             decoded = json.loads(parsed)
         elif suffix in ("yml", "yaml"):
-            decoded = cfn_tools.load_yaml(parsed)
+            decoded = load_yaml(parsed)
             if decoded is None:
                 raise exceptions.InvalidScript(f"Invalid YAML in `{filename}`")
         else:
@@ -370,6 +399,78 @@ def load_json_with_tokens(
     return decoded
 
 
+# Files that iter_records_with_tokens() can read one record at a time.
+STREAMING_SUFFIXES = ("jsonl", "ndjson", "csv")
+
+
+def iter_records_with_tokens(file_path: str, tokens: dict[str, object]):
+    """Reads a JSON Lines or CSV file one record at a time.
+
+    Unlike `load_json_with_tokens`, only a single record is in memory at a
+    time, so the file can be as large as it likes. Every line is run through
+    `populate_with_tokens` before it is parsed.
+
+    JSON Lines files (``.jsonl`` or ``.ndjson``) hold one JSON object per
+    line; blank lines are skipped. CSV files (``.csv``) start with a header
+    row, which names the keys of every record.
+
+    Args:
+        file_path: Path to the file to read.
+        tokens: dictionary to pass to populate_with_tokens.
+
+    Yields:
+        Each record of the file, as a dictionary.
+
+    Raises:
+        kingpin.exceptions.InvalidScript
+        kingpin.exceptions.InvalidScriptName
+    """
+    suffix = file_path.split(".")[-1].strip().lower()
+    if suffix not in STREAMING_SUFFIXES:
+        raise exceptions.InvalidScriptName(f"Invalid file extension: {suffix}")
+
+    try:
+        instance = open(file_path, newline="")
+    except OSError as e:
+        raise exceptions.InvalidScript(f"Error reading {file_path}: {e}") from e
+
+    log.debug(f"Streaming {file_path}")
+    with instance:
+        lines = (populate_with_tokens(line, tokens) for line in instance)
+
+        if suffix == "csv":
+            reader = csv.DictReader(lines)
+            try:
+                for record in reader:
+                    if None in record or None in record.values():
+                        raise exceptions.InvalidScript(
+                            f"Line {reader.line_num} of `{file_path}` does not "
+                            f"match its header"
+                        )
+                    yield record
+            except csv.Error as e:
+                raise exceptions.InvalidScript(
+                    f"CSV in `{file_path}` has an error on line "
+                    f"{reader.line_num}: {e}"
+                ) from e
+            return
+
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except JSONDecodeError as e:
+                raise exceptions.InvalidScript(
+                    f"JSON in `{file_path}` has an error on line {number}: {e}"
+                ) from e
+            if not isinstance(record, dict):
+                raise exceptions.InvalidScript(
+                    f"Line {number} of `{file_path}` is not a JSON object"
+                )
+            yield record
+
+
 def order_dict(obj):
     """Re-orders a dict into a predictable pattern.
 
@@ -427,12 +528,111 @@ def clear_repeating_log(handle):
     handle.timer_handle.cancel()
 
 
+def _canonical(obj, memo):
+    """Returns an order-independent, hashable form of a JSON-like object.
+
+    Dicts become frozensets of (key, value) pairs and lists become frozen
+    multisets of their items, so two objects that only differ in key or list
+    ordering produce equal canonical forms. Every subtree's canonical form is
+    stored in `memo` (keyed by object id) so that nested lists are never
+    canonicalized twice during a single diff.
+
+    Args:
+        obj: Object to canonicalize
+        memo: Dict of id(obj) -> canonical form, populated as we go
+
+    Returns:
+        A hashable object
+    """
+    key = id(obj)
+    if key in memo:
+        return memo[key]
+
+    if isinstance(obj, dict):
+        canon = ("dict", frozenset((k, _canonical(v, memo)) for k, v in obj.items()))
+    elif isinstance(obj, (list, tuple)):
+        counts = collections.Counter(_canonical(x, memo) for x in obj)
+        canon = ("list", frozenset(counts.items()))
+    else:
+        try:
+            hash(obj)
+            canon = obj
+        except TypeError:
+            canon = ("repr", repr(obj))
+
+    memo[key] = canon
+    return canon
+
+
+def _format_value(obj) -> str:
+    return json.dumps(obj, sort_keys=True, default=str)
+
+
+def _diff_tree(path, obj1, obj2, memo, changes):
+    """Walks two objects and appends path-based change records to `changes`.
+
+    Only subtrees that are not plainly equal are descended into. Lists are
+    compared as multisets: items are matched up by their canonical form, and
+    only the leftovers are reported. When exactly one item was removed and one
+    added, they are assumed to be the same item and diffed recursively.
+    """
+    if isinstance(obj1, dict) and isinstance(obj2, dict):
+        for k in sorted(obj1.keys() | obj2.keys(), key=str):
+            subpath = f"{path}.{k}" if path else str(k)
+            if k not in obj2:
+                changes.append(f"- {subpath}: {_format_value(obj1[k])}")
+            elif k not in obj1:
+                changes.append(f"+ {subpath}: {_format_value(obj2[k])}")
+            elif obj1[k] != obj2[k]:
+                _diff_tree(subpath, obj1[k], obj2[k], memo, changes)
+        return
+
+    if isinstance(obj1, (list, tuple)) and isinstance(obj2, (list, tuple)):
+        unmatched = collections.defaultdict(list)
+        for x in obj1:
+            unmatched[_canonical(x, memo)].append(x)
+
+        added = []
+        for i, x in enumerate(obj2):
+            candidates = unmatched.get(_canonical(x, memo))
+            if candidates:
+                candidates.pop()
+            else:
+                added.append((i, x))
+        removed = [x for items in unmatched.values() for x in items]
+
+        if len(removed) == 1 and len(added) == 1:
+            i, x = added[0]
+            _diff_tree(f"{path}[{i}]", removed[0], x, memo, changes)
+            return
+
+        for x in removed:
+            changes.append(f"- {path}[]: {_format_value(x)}")
+        for i, x in added:
+            changes.append(f"+ {path}[{i}]: {_format_value(x)}")
+        return
+
+    changes.append(
+        f"{path or '<root>'}: {_format_value(obj1)} -> {_format_value(obj2)}"
+    )
+
+
 def diff_dicts(dict1: dict, dict2: dict) -> str | None:
     """Compares two dicts and returns the difference as a string, if there is
     any.
 
-    Sorts two dicts (including sorting of the lists!!) and then diffs them. This
-    will ignore string types ('unicode' vs 'string').
+    Subtrees that are equal as-is are skipped right away. The rest are reduced
+    (once) to an order-independent canonical form, so lists are treated as
+    unordered (multisets) and two objects that only differ in key or list
+    ordering are considered equal.
+
+    Each line of the returned string describes one change by its path:
+
+    .. code-block:: text
+
+        Resources.Foo.Properties.X: "a" -> "b"
+        + Resources.Bar: {"Type": "AWS::S3::Bucket"}
+        - Statement[]: {"Action": "s3:*", "Effect": "Allow"}
 
     Args:
         dict1: First dict
@@ -441,16 +641,13 @@ def diff_dicts(dict1: dict, dict2: dict) -> str | None:
     Returns:
         A diff string if there's any difference, otherwise None.
     """
-    dict1 = order_dict(dict1)
-    dict2 = order_dict(dict2)
-
+    # Plain equality is done in C and is enough when nothing was re-ordered.
     if dict1 == dict2:
-        return
-
-    dict1 = pprint.pformat(dict1).splitlines()
-    dict2 = pprint.pformat(dict2).splitlines()
+        return None
 
-    return "\n".join(difflib.unified_diff(dict1, dict2, n=2))
+    changes = []
+    _diff_tree("", dict1, dict2, {}, changes)
+    return "\n".join(changes) or None
 
 
 def str2bool(v: str | bool | int, strict: bool = False) -> bool:
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Benchmark kingpin.utils.diff_dicts against the legacy implementation.
+
+Usage:
+    python scripts/bench_diff_dicts.py [resources] [repeat]
+
+Generates a synthetic CloudFormation template with `resources` resources
+(default 5000, roughly 1 MB of JSON), then times both the structural diff in
+kingpin.utils and the old order_dict + pprint + difflib approach on:
+
+    * identical templates (the common "no changes" case)
+    * templates with a single changed property
+    * templates with shuffled resource and list ordering
+"""
+
+import copy
+import difflib
+import functools
+import json
+import pprint
+import random
+import sys
+import timeit
+
+from kingpin import utils
+
+
+def legacy_diff_dicts(dict1, dict2):
+    dict1 = utils.order_dict(dict1)
+    dict2 = utils.order_dict(dict2)
+
+    if dict1 == dict2:
+        return
+
+    dict1 = pprint.pformat(dict1).splitlines()
+    dict2 = pprint.pformat(dict2).splitlines()
+
+    return "\n".join(difflib.unified_diff(dict1, dict2, n=2))
+
+
+def build_template(resources):
+    template = {"AWSTemplateFormatVersion": "2010-09-09", "Resources": {}}
+    for i in range(resources):
+        template["Resources"][f"Bucket{i}"] = {
+            "Type": "AWS::S3::Bucket",
+            "Properties": {
+                "BucketName": f"bucket-{i}",
+                "Tags": [{"Key": f"tag{t}", "Value": f"value{t}"} for t in range(5)],
+                "PolicyDocument": {
+                    "Statement": [
+                        {
+                            "Effect": "Allow",
+                            "Action": ["s3:GetObject", "s3:PutObject"],
+                            "Resource": f"arn:aws:s3:::bucket-{i}/*",
+                        }
+                    ]
+                },
+            },
+        }
+    return template
+
+
+def shuffled(template):
+    template = copy.deepcopy(template)
+    items = list(template["Resources"].items())
+    random.shuffle(items)
+    template["Resources"] = dict(items)
+    for resource in template["Resources"].values():
+        random.shuffle(resource["Properties"]["Tags"])
+    return template
+
+
+def main():
+    resources = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    base = build_template(resources)
+    changed = copy.deepcopy(base)
+    changed["Resources"]["Bucket0"]["Properties"]["BucketName"] = "changed"
+
+    print(f"Template size: {len(json.dumps(base)) / 1024:.0f} KiB")
+    cases = {
+        "identical": copy.deepcopy(base),
+        "one change": changed,
+        "shuffled": shuffled(base),
+    }
+    for name, other in cases.items():
+        for label, func in (
+            ("structural", utils.diff_dicts),
+            ("legacy", legacy_diff_dicts),
+        ):
+            t = min(
+                timeit.repeat(
+                    functools.partial(func, base, other), number=1, repeat=repeat
+                )
+            )
+            print(f"{name:<12} {label:<12} {t:.3f}s")
+
+
+if __name__ == "__main__":
+    main()